@@ -0,0 +1,100 @@
+# actuators.py - Cached LED outputs that only touch the hardware on a change
+# updateLights used to switch both LEDs off and then on or pulsing again, and
+# the state hooks toggled the same LEDs once more, so every pass issued several
+# GPIO writes and restarted gpiozero's pulse thread even when nothing changed.
+#
+# Each channel now remembers the output mode it last applied (off, on, or pulse
+# with its parameters). Callers say which mode they want; the actuator compares
+# it with the cached one and only drives the LED when they differ, counting the
+# operations it avoided.
+import logging
+import threading
+
+# Output modes; pulse modes carry gpiozero's pulse() parameters
+OFF = ("off",)
+ON = ("on",)
+
+
+def pulse_mode(fade_in_time=1, fade_out_time=1, n=None):
+    return ("pulse", fade_in_time, fade_out_time, n)
+
+
+PULSE = pulse_mode()
+
+
+class LedActuator():
+    def __init__(self, led, name=None):
+        self.led = led
+        self.name = name
+        # None until the first apply: the hardware state is unknown at start-up
+        self.mode = None
+        self.lock = threading.Lock()
+        self.applied = 0
+        self.skipped = 0
+        self.failures = 0
+
+    # Drive the LED into mode unless it is already there; returns True if it was written
+    def set(self, mode):
+        with self.lock:
+            if mode == self.mode:
+                self.skipped += 1
+                return False
+            try:
+                if mode[0] == "pulse":
+                    self.led.pulse(*mode[1:])
+                elif mode[0] == "on":
+                    self.led.on()
+                else:
+                    self.led.off()
+            except Exception as e:
+                # Whatever the LED is doing now, don't trust the cache for it
+                self.mode = None
+                self.failures += 1
+                logging.error(f"LED {self.name} update to {mode[0]} failed: {e}")
+                return False
+            self.mode = mode
+            self.applied += 1
+            return True
+
+    def on(self):
+        return self.set(ON)
+
+    def off(self):
+        return self.set(OFF)
+
+    def pulse(self, fade_in_time=1, fade_out_time=1, n=None):
+        return self.set(pulse_mode(fade_in_time, fade_out_time, n))
+
+    # Forget the cached mode, e.g. after something else drove the LED directly
+    def invalidate(self):
+        with self.lock:
+            self.mode = None
+
+    def stats(self):
+        return {
+            "mode": self.mode[0] if self.mode else None,
+            "applied": self.applied,
+            "skipped": self.skipped,
+            "failures": self.failures,
+        }
+
+
+class ActuatorBank():
+    def __init__(self, leds):
+        self.channels = {name: LedActuator(led, name) for name, led in leds.items()}
+
+    def __getitem__(self, name):
+        return self.channels[name]
+
+    def apply(self, **modes):
+        for name, mode in modes.items():
+            self.channels[name].set(mode)
+
+    def stats(self):
+        channels = {name: actuator.stats() for name, actuator in self.channels.items()}
+        return {
+            "applied": sum(c["applied"] for c in channels.values()),
+            "skipped": sum(c["skipped"] for c in channels.values()),
+            "failures": sum(c["failures"] for c in channels.values()),
+            "channels": channels,
+        }
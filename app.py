@@ -0,0 +1,313 @@
+# app.py - Application factory for the thermostat
+# "Enhancement Three Databases.py" used to do everything at module top level:
+# read config.json, configure logging, open and migrate temperature_log.db, and
+# bring up the sensor, UART, LEDs, buttons and LCD one after another. Loading
+# it touched hardware, and a missing serial port raised during import and took
+# the process down.
+#
+# Importing this module does nothing. create_app(config) builds a
+# ThermostatApp: hardware libraries are only imported by the real backends in
+# hal.py, the database, the telemetry outbox and the hardware are brought up in
+# parallel, the UART is opened by the first telemetry write (see
+# hal.ReconnectingSerial), and the first LCD frame is drawn as soon as there
+# is a reading, before the runtime starts.
+#
+#     python app.py [--config config.json]
+#     python app.py --bench-startup [--runs 5]    cold start to first LCD frame
+import argparse
+import asyncio
+import json
+import logging
+import sqlite3
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from db_writer import BatchedWriter
+from deadband import TIME_FORMAT, close_session, expand_readings, make_deadband_filter, open_session
+from hal import build_hardware, play_button_script
+from inputs import make_input_queue
+from log_pipeline import setup_logging
+from metrics import start_metrics
+from outbox import TelemetryOutbox
+from outliers import make_outlier_filter
+from rollups import install_rollups, rollup_repeat_sql
+from runtime import ThermostatRuntime
+from sampler import SensorSampler
+from schema import ensure_schema, reading_insert_sql
+from smoothing import make_filter
+from state_intervals import StateIntervalRecorder, apply_events, close_dangling, install_intervals
+from telemetry import TelemetryWriter
+from thermostat import ManagedDisplay, TemperatureMachine
+
+# Cold start (interpreter launch) to the first LCD frame, in milliseconds
+STARTUP_TARGET_MS = 1500
+
+FIRST_FRAME_MARKER = "first-frame"
+
+
+def load_config(path='config.json'):
+    with open(path, 'r') as config_file:
+        return json.load(config_file)
+
+
+class ThermostatApp():
+    def __init__(self, config, db_path='temperature_log.db', log_pipeline=None):
+        self.config = config
+        self.db_path = db_path
+        self.log_pipeline = log_pipeline
+        self.created = time.perf_counter()
+        # Startup phase -> milliseconds; phases that run in parallel overlap
+        self.timings = {}
+        self.conn = None
+        self.hardware = None
+        self.outbox = None
+        self.db_writer = None
+        self.telemetry = None
+        self.screen = None
+        self.sampler = None
+        self.tsm = None
+        self.metrics = None
+        self.schema_version = None
+        # "db_log_mode": "change" only stores rows that differ (see deadband.py)
+        self.log_filter = make_deadband_filter(config)
+        self.log_session = None
+        self.intervals = StateIntervalRecorder()
+
+    def timed(self, name, fn, *args):
+        started = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            self.timings[name] = round((time.perf_counter() - started) * 1000, 1)
+
+    # === Startup ===
+    # New databases get the compact v2 layout; existing v1 databases keep their
+    # table and indexes until they are converted with migrate.py. The rollup
+    # trigger and the avg_temp_by_state view are (re)created on top, and a state
+    # interval left open by a crash is closed.
+    def prepare_database(self):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            self.schema_version = ensure_schema(conn)
+            install_rollups(conn)
+            install_intervals(conn)
+            close_dangling(conn)
+            if self.log_filter is not None:
+                self.log_session = open_session(
+                    conn, datetime.now().strftime(TIME_FORMAT), self.config.get("db_log_period", 30),
+                    self.log_filter.deadband, self.log_filter.heartbeat)
+        finally:
+            conn.close()
+
+    def open_outbox(self):
+        return TelemetryOutbox(
+            self.config.get("telemetry_outbox", "telemetry_outbox.db"),
+            max_samples=self.config.get("telemetry_outbox_max", 100000)
+        )
+
+    def build(self):
+        config = self.config
+        # Independent and mostly I/O bound: schema DDL, the outbox file, and the
+        # I2C/LCD/GPIO bring-up ("hardware": "simulated" needs none of it)
+        with ThreadPoolExecutor(3, thread_name_prefix="startup") as pool:
+            database = pool.submit(self.timed, "database", self.prepare_database)
+            outbox = pool.submit(self.timed, "outbox", self.open_outbox)
+            hardware = pool.submit(self.timed, "hardware", build_hardware, config)
+        if hardware.exception() is None:
+            self.hardware = hardware.result()
+        if outbox.exception() is None:
+            self.outbox = outbox.result()
+        for future in (hardware, outbox, database):
+            if future.exception() is not None:
+                # Don't leave the half that did come up holding devices and files
+                self.close(hardware=True)
+                raise future.exception()
+
+        # Rows are grouped and committed on the runtime's SQLite thread; rows
+        # change-only logging does not store still count in the rollups
+        self.db_writer = BatchedWriter(
+            self.db_path,
+            reading_insert_sql(self.schema_version),
+            batch_size=config.get("db_batch_size", 32),
+            flush_interval=config.get("db_flush_interval", 60),
+            repeat_sql=rollup_repeat_sql(self.schema_version) if self.log_filter is not None else ()
+        )
+        # Samples are sent as batched frames ("binary") or the original
+        # "state,temp,setpoint" strings ("text"); batches that cannot be written
+        # wait in the outbox until the link recovers
+        self.telemetry = TelemetryWriter(
+            self.hardware.serial,
+            mode=config.get("telemetry_mode", "binary"),
+            batch_size=config.get("telemetry_batch_size", 4),
+            max_delay=config.get("telemetry_max_delay", 5.0),
+            outbox=self.outbox
+        )
+        self.screen = ManagedDisplay(self.hardware.display)
+        self.sampler = SensorSampler(
+            self.hardware.sensor,
+            interval=config.get("sample_interval", 1.0),
+            smoother=make_filter(config),
+            outlier_filter=make_outlier_filter(config)
+        )
+        # Button presses and auto-repeats are coalesced into one set-point change per batch
+        self.tsm = TemperatureMachine(self.hardware, self.screen, self.sampler,
+                                      set_point=config["default_set_point"],
+                                      inputs=make_input_queue(config),
+                                      log_filter=self.log_filter,
+                                      intervals=self.intervals)
+        # LCD refresh, line alternation, telemetry and DB logging each run on their
+        # own drift-free period with a per-job "overrun_policy"
+        self.tsm.scheduleJobs(config)
+        # Latency histograms and error/drop counters on http://127.0.0.1:<metrics_port>/metrics;
+        # "metrics_port": null turns them off
+        if config.get("metrics_port", 9108):
+            try:
+                self.metrics = start_metrics(self, config)
+            except OSError as e:
+                logging.warning(f"Metrics endpoint not started: {e}")
+        self.timed("first_frame", self.first_frame)
+        self.timings["total"] = round((time.perf_counter() - self.created) * 1000, 1)
+        logging.info(f"Startup timings (ms): {self.timings}")
+        return self
+
+    # One reading and one LCD frame straight away, instead of after the runtime is up
+    def first_frame(self):
+        self.sampler.sample()
+        self.tsm.refreshDisplay()
+
+    # === Running ===
+    # Until SIGINT/SIGTERM, then an ordered shutdown (see runtime.py)
+    def run(self):
+        simulation = self.config.get("simulation", {})
+        if self.hardware.simulated and simulation.get("button_script"):
+            play_button_script(self.hardware, simulation["button_script"])
+        runtime = ThermostatRuntime(self.config, self.hardware, self.screen, self.sampler,
+                                    self.tsm, self.db_writer, self.telemetry, self.outbox)
+        asyncio.run(runtime.run())
+        self.close()
+
+    # === Query function for historical data ===
+    def connection(self):
+        if self.conn is None:
+            self.conn = sqlite3.connect(self.db_path)
+        return self.conn
+
+    def query_temperature_data(self, start_date=None, end_date=None, state_filter=None):
+        print("Timestamp\t\tState\tTemp\tSetPoint")
+        # Rows are streamed in chunks rather than loaded into memory all at once;
+        # change-only sessions are expanded back to one row per logging period
+        live_until = self.log_filter.latest if self.log_filter is not None else None
+        for row in expand_readings(self.connection(), start_date, end_date, state_filter,
+                                   chunk_size=self.config.get("query_chunk_size", 1000),
+                                   live_until=live_until):
+            print(f"{row[0]}\t{row[1]}\t{row[2]}\t{row[3]}")
+
+    # A runtime that ran to the end has already ended the open interval and
+    # written it on its own thread. Otherwise (it never ran, or stopped early)
+    # the interval in progress is ended here and whatever the recorder still
+    # holds is written on this connection, instead of being dropped.
+    def finish_intervals(self):
+        self.intervals.writer = None
+        if self.tsm is not None:
+            self.tsm.endInterval()
+        events, self.intervals.pending = self.intervals.pending, []
+        if events:
+            apply_events(self.connection(), events)
+
+    # The runtime closes the hardware and the outbox itself on a normal shutdown;
+    # hardware=True closes whatever was opened without running it
+    def close(self, hardware=False):
+        # Record where this session's last run ends so it can be expanded
+        if self.log_session is not None:
+            close_session(self.connection(), self.log_session, self.log_filter.latest)
+            self.log_session = None
+        self.finish_intervals()
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+        if self.metrics is not None:
+            self.metrics.close()
+            self.metrics = None
+        if hardware:
+            if self.screen is not None:
+                self.screen.cleanupDisplay()
+            if self.hardware is not None:
+                self.hardware.close()
+            if self.outbox is not None:
+                self.outbox.close()
+        if self.log_pipeline is not None:
+            logging.info(f"Log pipeline stats: {self.log_pipeline.stats()}")
+            self.log_pipeline.close()
+            self.log_pipeline = None
+
+
+def create_app(config=None, config_path='config.json', log_file='thermostat.log'):
+    config = load_config(config_path) if config is None else config
+    # Queued logging with rotation and an in-memory flight recorder
+    log_pipeline = setup_logging(config, log_file) if log_file else None
+    app = ThermostatApp(config, log_pipeline=log_pipeline)
+    return app.build()
+
+
+# === Startup benchmark ===
+# Each run is a fresh interpreter (imports included) that builds the app, draws
+# the first LCD frame, prints its timings and shuts down again.
+def bench_startup(runs, config_path, target_ms):
+    results = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        child = subprocess.Popen([sys.executable, __file__, "--first-frame", "--config", config_path],
+                                 stdout=subprocess.PIPE, text=True)
+        for line in child.stdout:
+            if line.startswith(FIRST_FRAME_MARKER):
+                cold_ms = (time.perf_counter() - started) * 1000
+                results.append((cold_ms, json.loads(line[len(FIRST_FRAME_MARKER):])))
+                break
+        child.communicate()
+        if child.returncode:
+            raise RuntimeError(f"Startup run failed with exit code {child.returncode}")
+
+    cold = sorted(cold_ms for cold_ms, _ in results)
+    median = statistics.median(cold)
+    report = {
+        "runs": runs,
+        "cold_start_to_first_frame_ms": {"min": round(cold[0], 1), "median": round(median, 1),
+                                         "max": round(cold[-1], 1)},
+        "phases_ms": {phase: statistics.median(timings[phase] for _, timings in results)
+                      for phase in results[0][1]},
+        "target_ms": target_ms,
+        "within_target": median <= target_ms,
+    }
+    print(json.dumps(report, indent=2))
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the thermostat")
+    parser.add_argument("--config", default="config.json")
+    parser.add_argument("--bench-startup", action="store_true",
+                        help="measure cold start to first LCD frame")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--first-frame", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.bench_startup:
+        config = load_config(args.config)
+        report = bench_startup(args.runs, args.config, config.get("startup_target_ms", STARTUP_TARGET_MS))
+        return 0 if report["within_target"] else 1
+
+    app = create_app(config_path=args.config)
+    if args.first_frame:
+        print(FIRST_FRAME_MARKER + json.dumps(app.timings), flush=True)
+        app.close(hardware=True)
+        return 0
+    app.run()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
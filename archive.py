@@ -0,0 +1,404 @@
+# archive.py - Columnar monthly archives for cold temperature history
+# temperature_log.db only ever grew. The retention job moves every whole month
+# older than "archive_max_age_days" out of SQLite into one file per month in
+# "archive_dir" (relative to the database file), records it in the
+# archive_months catalog, deletes the rows and runs an incremental vacuum so
+# the freed pages go back to the filesystem.
+#
+# An archive holds the month in the v2 layout, one column after another:
+#   ts           first value, then deltas          zig-zag varints
+#   state        dictionary codes (see "states")   one byte each
+#   temp_tenths  deltas                            zig-zag varints
+#   set_point    deltas                            zig-zag varints
+# compressed as a whole with zlib or lzma ("archive_codec"), behind a small
+# JSON header with the row count, time range, codec and a CRC of the columns.
+#
+# history.iter_reading_chunks() merges archived rows into its results, so
+# query_temperature_data, exports and change-only expansion read across hot
+# and cold data without knowing; only months that overlap the requested range
+# are decoded. Rollups are not touched by archiving, so avg_temp_by_state and
+# the rollup summaries still cover archived months, and rollups.backfill()
+# includes them.
+#
+#     python archive.py run [db] [--max-age-days 365] [--dir archive] [--codec lzma]
+#     python archive.py list [db]
+#     python archive.py vacuum [db]    one-off switch to auto_vacuum=INCREMENTAL
+import argparse
+import heapq
+import json
+import logging
+import lzma
+import os
+import sqlite3
+import struct
+import zlib
+from datetime import datetime, timedelta
+from itertools import accumulate
+
+from schema import SCHEMA_V2, STATE_CODES, STATE_NAMES, readings_query, schema_version
+
+MAGIC = b"TCA1"
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+CODECS = {
+    "zlib": (lambda data: zlib.compress(data, 9), zlib.decompress),
+    "lzma": (lambda data: lzma.compress(data, preset=6), lzma.decompress),
+}
+
+CATALOG_DDL = '''
+    CREATE TABLE IF NOT EXISTS archive_months (
+        month TEXT NOT NULL PRIMARY KEY,
+        path TEXT NOT NULL,
+        rows INTEGER NOT NULL,
+        first_ts INTEGER NOT NULL,
+        last_ts INTEGER NOT NULL,
+        codec TEXT NOT NULL,
+        bytes INTEGER NOT NULL,
+        archived_at TEXT NOT NULL
+    ) WITHOUT ROWID
+'''
+
+
+# === Column encoding ===
+def zigzag(value):
+    return value << 1 if value >= 0 else ((-value) << 1) - 1
+
+
+def unzigzag(value):
+    return value >> 1 if not value & 1 else -((value + 1) >> 1)
+
+
+def encode_varints(values):
+    out = bytearray()
+    for value in values:
+        while value > 0x7f:
+            out.append((value & 0x7f) | 0x80)
+            value >>= 7
+        out.append(value)
+    return bytes(out)
+
+
+def decode_varints(data):
+    values = []
+    append = values.append
+    value = shift = 0
+    for byte in data:
+        value |= (byte & 0x7f) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            append(value)
+            value = shift = 0
+    return values
+
+
+def delta_encode(values):
+    previous = 0
+    out = []
+    for value in values:
+        out.append(zigzag(value - previous))
+        previous = value
+    return encode_varints(out)
+
+
+def delta_decode(data):
+    return list(accumulate(unzigzag(value) for value in decode_varints(data)))
+
+
+# rows are v2 tuples (ts, state code, temp_tenths, set_point) in ts order
+def encode_month(rows, month, codec="lzma"):
+    states = [STATE_NAMES[code] for code in sorted(STATE_NAMES)]
+    columns = [
+        delta_encode(row[0] for row in rows),
+        bytes(row[1] for row in rows),
+        delta_encode(row[2] for row in rows),
+        delta_encode(row[3] for row in rows),
+    ]
+    payload = b"".join(encode_varints([len(column)]) + column for column in columns)
+    header = json.dumps({
+        "month": month,
+        "rows": len(rows),
+        "first_ts": rows[0][0],
+        "last_ts": rows[-1][0],
+        "codec": codec,
+        "states": states,
+        "columns": ["ts", "state", "temp_tenths", "set_point"],
+        "crc32": zlib.crc32(payload),
+    }).encode()
+    return MAGIC + struct.pack("<H", len(header)) + header + CODECS[codec][0](payload)
+
+
+def decode_month(data):
+    if data[:4] != MAGIC:
+        raise ValueError("Not a temperature archive")
+    header_len = struct.unpack_from("<H", data, 4)[0]
+    header = json.loads(data[6:6 + header_len])
+    payload = CODECS[header["codec"]][1](data[6 + header_len:])
+    if zlib.crc32(payload) != header["crc32"]:
+        raise ValueError(f"Archive for {header['month']} is corrupt (CRC mismatch)")
+
+    columns = []
+    offset = 0
+    for _ in header["columns"]:
+        # The length prefix is a single varint
+        end = offset
+        while payload[end] & 0x80:
+            end += 1
+        length = decode_varints(payload[offset:end + 1])[0]
+        columns.append(payload[end + 1:end + 1 + length])
+        offset = end + 1 + length
+    codes = {index: STATE_CODES[name] for index, name in enumerate(header["states"])}
+    ts = delta_decode(columns[0])
+    state = [codes[code] for code in columns[1]]
+    rows = list(zip(ts, state, delta_decode(columns[2]), delta_decode(columns[3])))
+    if len(rows) != header["rows"]:
+        raise ValueError(f"Archive for {header['month']} holds {len(rows)} rows, header says {header['rows']}")
+    return header, rows
+
+
+def read_archive(path):
+    with open(path, "rb") as archive_file:
+        return decode_month(archive_file.read())
+
+
+# Written to a temporary file and renamed, so a month file is always complete
+def write_archive(path, data):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as archive_file:
+        archive_file.write(data)
+        archive_file.flush()
+        os.fsync(archive_file.fileno())
+    os.replace(tmp_path, path)
+
+
+# === Months ===
+# ts is UTC epoch seconds (see schema.py); dates, months and the v1 strings
+# are local time
+def to_ts(text):
+    return int(datetime.fromisoformat(text).timestamp())
+
+
+def from_ts(ts):
+    return datetime.fromtimestamp(ts).strftime(TIME_FORMAT)
+
+
+def month_bounds(month):
+    start = datetime.strptime(month, "%Y-%m")
+    end = datetime(start.year + start.month // 12, start.month % 12 + 1, 1)
+    return int(start.timestamp()), int(end.timestamp())
+
+
+def next_month(month):
+    year, number = int(month[:4]), int(month[5:])
+    return f"{year + number // 12:04d}-{number % 12 + 1:02d}"
+
+
+def oldest_hot_ts(conn):
+    if schema_version(conn) == SCHEMA_V2:
+        return conn.execute("SELECT MIN(ts) FROM readings").fetchone()[0]
+    oldest = conn.execute("SELECT MIN(timestamp) FROM temperature_readings").fetchone()[0]
+    return None if oldest is None else to_ts(oldest)
+
+
+def delete_hot_rows(conn, first_ts, end_ts):
+    if schema_version(conn) == SCHEMA_V2:
+        cursor = conn.execute("DELETE FROM readings WHERE ts >= ? AND ts < ?", (first_ts, end_ts))
+    else:
+        cursor = conn.execute("DELETE FROM temperature_readings WHERE timestamp >= ? AND timestamp < ?",
+                              (from_ts(first_ts), from_ts(end_ts)))
+    return cursor.rowcount
+
+
+# === Catalog ===
+def install_catalog(conn):
+    conn.execute(CATALOG_DDL)
+    conn.commit()
+
+
+def has_catalog(conn):
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'archive_months'").fetchone() is not None
+
+
+# Archive paths are stored relative to the database file, so the catalog still
+# finds them when the app is started from another directory or the database
+# and its archive directory are moved together
+def database_dir(conn):
+    path = conn.execute("PRAGMA database_list").fetchone()[2]
+    return os.path.dirname(path) if path else os.getcwd()
+
+
+def catalog_path(conn, path):
+    return os.path.relpath(os.path.abspath(path), database_dir(conn))
+
+
+def resolve_path(conn, path):
+    return os.path.join(database_dir(conn), path)
+
+
+def archived_months(conn):
+    if not has_catalog(conn):
+        return []
+    return conn.execute(
+        "SELECT month, path, rows, first_ts, last_ts, codec, bytes, archived_at FROM archive_months ORDER BY month"
+    ).fetchall()
+
+
+# === Retention job ===
+# Moves one month from SQLite into its archive file in a single transaction.
+# Rows that reached SQLite after the month was archived are merged into the
+# existing file. Returns the number of rows moved.
+def archive_month(conn, month, archive_dir, codec="lzma"):
+    start_ts, end_ts = month_bounds(month)
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        query, params = readings_query(conn, from_ts(start_ts), from_ts(end_ts - 1), layout="v2")
+        hot = conn.execute(query, params).fetchall()
+        if not hot:
+            conn.execute("ROLLBACK")
+            return 0
+        existing = conn.execute("SELECT path FROM archive_months WHERE month = ?", (month,)).fetchone()
+        rows = hot
+        if existing is not None:
+            cold = read_archive(resolve_path(conn, existing[0]))[1]
+            hot_ts = {row[0] for row in hot}
+            rows = list(heapq.merge([row for row in cold if row[0] not in hot_ts], hot))
+
+        data = encode_month(rows, month, codec)
+        # Never delete anything that cannot be read back
+        if decode_month(data)[1] != rows:
+            raise ValueError(f"Archive for {month} does not decode to the rows it was built from")
+        path = os.path.join(archive_dir, f"readings-{month}.tca")
+        write_archive(path, data)
+        conn.execute(
+            "INSERT OR REPLACE INTO archive_months VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (month, catalog_path(conn, path), len(rows), rows[0][0], rows[-1][0], codec, len(data),
+             datetime.now().strftime(TIME_FORMAT)))
+        deleted = delete_hot_rows(conn, start_ts, end_ts)
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    logging.info(f"Archived {deleted} rows of {month} to {path} ({len(data)} bytes, {codec})")
+    return deleted
+
+
+# Give freed pages back to the filesystem, if the database allows it
+def incremental_vacuum(conn):
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        logging.info("Database is not in auto_vacuum=INCREMENTAL mode; run 'python archive.py vacuum' once")
+        return 0
+    free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    conn.commit()
+    # execute() would only step the pragma once, freeing a single page
+    conn.executescript("PRAGMA incremental_vacuum;")
+    return free - conn.execute("PRAGMA freelist_count").fetchone()[0]
+
+
+# Archive every whole month that ended more than max_age_days before now
+def run_retention(conn, archive_dir="archive", max_age_days=365, codec="lzma", now=None):
+    if codec not in CODECS:
+        raise ValueError(f"Unknown archive codec '{codec}', expected one of {tuple(CODECS)}")
+    install_catalog(conn)
+    # A relative archive_dir is next to the database, wherever the app runs from
+    archive_dir = resolve_path(conn, archive_dir)
+    os.makedirs(archive_dir, exist_ok=True)
+    cutoff_ts = int(((now or datetime.now()) - timedelta(days=max_age_days)).timestamp())
+    stats = {"months": 0, "rows": 0, "pages_freed": 0}
+    oldest = oldest_hot_ts(conn)
+    if oldest is None:
+        return stats
+    month = from_ts(oldest)[:7]
+    while month_bounds(month)[1] <= cutoff_ts:
+        moved = archive_month(conn, month, archive_dir, codec)
+        if moved:
+            stats["months"] += 1
+            stats["rows"] += moved
+        month = next_month(month)
+    if stats["rows"]:
+        stats["pages_freed"] = incremental_vacuum(conn)
+    return stats
+
+
+# === Reading archived rows ===
+# Rows of the archived months overlapping [start_date, end_date], in the same
+# shape and order readings_query() gives, or None if nothing is archived
+def archived_readings(conn, start_date=None, end_date=None, state_filter=None, layout="v1"):
+    if not has_catalog(conn):
+        return None
+    low = to_ts(start_date) if start_date else None
+    high = to_ts(end_date) if end_date else None
+    query = "SELECT path FROM archive_months WHERE 1=1"
+    params = []
+    if low is not None:
+        query += " AND last_ts >= ?"
+        params.append(low)
+    if high is not None:
+        query += " AND first_ts <= ?"
+        params.append(high)
+    paths = [resolve_path(conn, row[0]) for row in conn.execute(query + " ORDER BY month", params)]
+    if not paths:
+        return None
+    return iter_archived(paths, low, high, STATE_CODES.get(state_filter, -1) if state_filter else None, layout)
+
+
+def iter_archived(paths, low, high, state_code, layout):
+    for path in paths:
+        for row in read_archive(path)[1]:
+            if (low is not None and row[0] < low) or (high is not None and row[0] > high):
+                continue
+            if state_code is not None and row[1] != state_code:
+                continue
+            if layout == "v1":
+                temp = row[2] // 10 if row[2] % 10 == 0 else row[2] / 10
+                yield (from_ts(row[0]), STATE_NAMES[row[1]], temp, row[3])
+            else:
+                yield row
+
+
+# For rollups.backfill(): copies every archived row into temp.archived_readings,
+# laid out like source, and returns how many there were
+def stage_archived_rows(conn, source):
+    rows = archived_readings(conn, layout="v2" if source == "readings" else "v1")
+    if rows is None:
+        return 0
+    conn.execute("DROP TABLE IF EXISTS temp.archived_readings")
+    conn.execute(f"CREATE TEMP TABLE archived_readings AS SELECT * FROM {source} WHERE 0")
+    cursor = conn.executemany("INSERT INTO temp.archived_readings VALUES (?, ?, ?, ?)", rows)
+    conn.commit()
+    return cursor.rowcount
+
+
+# One-off: switch an existing database to incremental auto-vacuum (rewrites the file)
+def enable_incremental_vacuum(conn):
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    conn.execute("VACUUM")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Archive cold temperature history into monthly files")
+    parser.add_argument("command", choices=["run", "list", "vacuum"])
+    parser.add_argument("db", nargs="?", default="temperature_log.db")
+    parser.add_argument("--max-age-days", type=float, default=365)
+    parser.add_argument("--dir", default="archive", help="relative to the database file")
+    parser.add_argument("--codec", choices=list(CODECS), default="lzma")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    conn = sqlite3.connect(args.db)
+    try:
+        if args.command == "run":
+            print(run_retention(conn, args.dir, args.max_age_days, args.codec))
+        elif args.command == "vacuum":
+            enable_incremental_vacuum(conn)
+            print("auto_vacuum is now INCREMENTAL")
+        else:
+            print("Month\tRows\tBytes\tCodec\tPath")
+            for month, path, rows, _, _, codec, size, _ in archived_months(conn):
+                print(f"{month}\t{rows}\t{size}\t{codec}\t{path}")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
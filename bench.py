@@ -0,0 +1,430 @@
+# bench.py - Benchmark suite for smoothing, persistence, queries and the display loop
+# Everything runs on the simulated hardware and on synthetic databases, so the
+# numbers can be reproduced on any machine and compared between commits:
+#
+#   smoothing  SensorSampler.sample() per filter (outlier stage included) and
+#              get_smoothed_fahrenheit() calls per second
+#   inserts    rows per second through BatchedWriter.commit(), one commit per
+#              row versus batch_size rows per commit, on the production schema
+#   queries    the query_temperature_data() read path (iter_readings) over
+#              synthetic v1 databases, with the planner free to use
+#              idx_timestamp/idx_state and with NOT INDEXED forcing a scan
+#   summary    avg_temp_by_state as the original GROUP BY over every row versus
+#              the rollup-backed view
+#   display    simulated seconds of the production loop: the 1 Hz sensor
+#              sample, every scheduled display job (button poll, LCD refresh
+#              and alternation, telemetry, DB logging) timed on its own, and
+#              the telemetry and DB writer flushes
+#
+# Synthetic databases hold one v1 row every 30 s and are cached in --workdir by
+# size. Results are written as JSON with one entry per metric, including its
+# unit and whether higher or lower is better. The compare mode reports the
+# change of every metric and exits non-zero when one is worse by more than
+# --threshold or is missing from the current run.
+#
+#     python bench.py run [--suites smoothing,inserts,queries,summary,display]
+#                         [--sizes 10000,100000,1000000] [--out bench.json] [--baseline old.json]
+#     python bench.py compare old.json new.json [--threshold 0.10]
+import argparse
+import json
+import os
+import platform
+import sqlite3
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+
+from clock import VirtualClock
+from db_writer import BatchedWriter
+from hal import build_simulated_hardware
+from harness import DEFAULT_START, drain
+from inputs import make_input_queue
+from history import DEFAULT_CHUNK
+from outliers import make_outlier_filter
+from rollups import backfill, create_rollup_objects, install_rollups
+from sampler import SensorSampler
+from schema import V1_INDEX_DDL, V1_TABLE_DDL, ensure_schema, reading_insert_sql, readings_query
+from smoothing import FILTERS, make_filter
+from telemetry import TelemetryWriter
+from thermostat import DISPLAY_JOBS, ManagedDisplay, TemperatureMachine
+
+SUITES = ("smoothing", "inserts", "queries", "summary", "display")
+DEFAULT_SIZES = (10_000, 100_000, 1_000_000)
+
+SYNTHETIC_START = datetime(2020, 1, 1)
+ROW_PERIOD_S = 30
+# Rows are generated this many at a time, one transaction each
+GENERATE_CHUNK = 1_000_000
+
+# (start offset from the middle of the history, window length, state filter)
+QUERY_CASES = {
+    "hour": (0, timedelta(hours=1), None),
+    "day": (0, timedelta(days=1), None),
+    "day_heat": (0, timedelta(days=1), "heat"),
+    "week_cool": (0, timedelta(days=7), "cool"),
+}
+
+# The view as Enhancement Three first defined it: a scan of every reading
+AVG_BY_STATE_SCAN = "SELECT state, AVG(temperature) AS avg_temp FROM temperature_readings GROUP BY state"
+
+
+class Results():
+    def __init__(self):
+        self.metrics = {}
+
+    def add(self, name, value, unit, better):
+        self.metrics[name] = {"value": round(value, 6), "unit": unit, "better": better}
+        print(f"  {name:58s} {value:14.3f} {unit}", flush=True)
+
+
+def median_seconds(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - started)
+    return statistics.median(times)
+
+
+def remove_db(path):
+    for suffix in ("", "-wal", "-shm", "-journal"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+
+# === Synthetic readings ===
+# Row i is at SYNTHETIC_START + 30 i seconds; the state changes every hour and
+# the set point every day. The Python and SQL versions produce the same rows.
+def synthetic_row(i):
+    timestamp = SYNTHETIC_START + timedelta(seconds=i * ROW_PERIOD_S)
+    state = ("off", "heat", "cool")[(i // 120) % 3]
+    return (timestamp.strftime("%Y-%m-%d %H:%M:%S"), state, 60 + (i * 7919) % 25, 68 + (i // 2880) % 8)
+
+
+GENERATE_SQL = f'''
+    WITH RECURSIVE seq(i) AS (SELECT ? UNION ALL SELECT i + 1 FROM seq WHERE i + 1 < ?)
+    INSERT INTO temperature_readings (timestamp, state, temperature, set_point)
+    SELECT datetime('{SYNTHETIC_START:%Y-%m-%d %H:%M:%S}', '+' || (i * {ROW_PERIOD_S}) || ' seconds'),
+           CASE (i / 120) % 3 WHEN 0 THEN 'off' WHEN 1 THEN 'heat' ELSE 'cool' END,
+           60 + (i * 7919) % 25,
+           68 + (i / 2880) % 8
+    FROM seq
+'''
+
+
+# A v1 database (the layout the idx_timestamp/idx_state claims are about) with
+# its indexes and backfilled rollups, built once per size and reused
+def synthetic_db(workdir, rows):
+    path = os.path.join(workdir, f"readings_v1_{rows}.db")
+    if os.path.exists(path):
+        conn = sqlite3.connect(path)
+        try:
+            if conn.execute("SELECT rows FROM bench_meta").fetchone() == (rows,):
+                return conn
+        except sqlite3.Error:
+            pass
+        conn.close()
+        remove_db(path)
+
+    print(f"  building {path} ...", flush=True)
+    started = time.perf_counter()
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=OFF")
+    conn.execute("PRAGMA synchronous=OFF")
+    conn.execute(V1_TABLE_DDL)
+    for first in range(0, rows, GENERATE_CHUNK):
+        conn.execute(GENERATE_SQL, (first, min(rows, first + GENERATE_CHUNK)))
+        conn.commit()
+    for ddl in V1_INDEX_DDL:
+        conn.execute(ddl)
+    create_rollup_objects(conn)
+    backfill(conn)
+    conn.execute("CREATE TABLE bench_meta (rows INTEGER NOT NULL)")
+    conn.execute("INSERT INTO bench_meta VALUES (?)", (rows,))
+    conn.commit()
+    conn.execute("ANALYZE")
+    print(f"  built in {time.perf_counter() - started:.1f} s", flush=True)
+    return conn
+
+
+def simulated_sampler(clock, config=None):
+    config = config or {}
+    hardware = build_simulated_hardware({"simulation": {"seed": 1}}, clock=clock.monotonic)
+    sampler = SensorSampler(hardware.sensor, smoother=make_filter(config),
+                            outlier_filter=make_outlier_filter(config), clock=clock)
+    sampler.sample()
+    return hardware, sampler
+
+
+# === Suites ===
+def bench_smoothing(results, args):
+    clock = VirtualClock(DEFAULT_START)
+    n = args.iterations
+    for kind in FILTERS:
+        _, sampler = simulated_sampler(clock, {"smoothing_filter": kind})
+
+        def run():
+            for _ in range(n):
+                clock.advance(1.0)
+                sampler.sample()
+        results.add(f"smoothing.sample_{kind}.ops_per_s", n / median_seconds(run, args.repeat),
+                    "ops/s", "higher")
+
+    hardware, sampler = simulated_sampler(clock)
+    tsm = TemperatureMachine(hardware, ManagedDisplay(hardware.display), sampler, 72, clock=clock)
+    get = tsm.get_smoothed_fahrenheit
+
+    def run():
+        for _ in range(n):
+            get()
+    results.add("smoothing.get_smoothed_fahrenheit.ops_per_s", n / median_seconds(run, args.repeat),
+                "ops/s", "higher")
+
+
+def bench_inserts(results, args):
+    # As the logger hands them over: v1 columns, then the epoch seconds
+    rows = [row + (int(datetime.strptime(row[0], "%Y-%m-%d %H:%M:%S").timestamp()),)
+            for row in map(synthetic_row, range(args.insert_rows))]
+    for mode, batch_size in (("commit_per_row", 1), ("batched", args.batch_size)):
+        path = os.path.join(args.workdir, f"inserts_{mode}.db")
+        remove_db(path)
+        conn = sqlite3.connect(path)
+        version = ensure_schema(conn)
+        install_rollups(conn)
+        conn.close()
+        writer = BatchedWriter(path, reading_insert_sql(version), batch_size=batch_size)
+        conn = writer.connect()
+        started = time.perf_counter()
+        for first in range(0, len(rows), batch_size):
+            writer.commit(conn, rows[first:first + batch_size])
+        elapsed = time.perf_counter() - started
+        conn.close()
+        remove_db(path)
+        results.add(f"inserts.{mode}.rows_per_s", len(rows) / elapsed, "rows/s", "higher")
+
+
+def fetch_all(conn, query, params):
+    cursor = conn.execute(query, params)
+    count = 0
+    while True:
+        rows = cursor.fetchmany(DEFAULT_CHUNK)
+        if not rows:
+            return count
+        count += len(rows)
+
+
+def bench_queries(results, args):
+    for size in args.sizes:
+        conn = synthetic_db(args.workdir, size)
+        middle = SYNTHETIC_START + timedelta(seconds=size * ROW_PERIOD_S / 2)
+        for case, (offset, window, state) in QUERY_CASES.items():
+            start = middle + timedelta(seconds=offset)
+            query, params = readings_query(conn, f"{start:%Y-%m-%d %H:%M:%S}",
+                                           f"{start + window:%Y-%m-%d %H:%M:%S}", state)
+            variants = {
+                "indexed": query,
+                "no_index": query.replace("FROM temperature_readings", "FROM temperature_readings NOT INDEXED"),
+            }
+            for variant, sql in variants.items():
+                seconds = median_seconds(lambda: fetch_all(conn, sql, params), args.repeat)
+                results.add(f"queries.{size}.{case}.{variant}_ms", seconds * 1000, "ms", "lower")
+        conn.close()
+
+
+def bench_summary(results, args):
+    for size in args.sizes:
+        conn = synthetic_db(args.workdir, size)
+        for variant, sql in (("scan", AVG_BY_STATE_SCAN), ("rollup", "SELECT * FROM avg_temp_by_state")):
+            seconds = median_seconds(lambda: conn.execute(sql).fetchall(), args.repeat)
+            results.add(f"summary.{size}.avg_temp_by_state_{variant}_ms", seconds * 1000, "ms", "lower")
+        conn.close()
+
+
+# Wraps a job callback so each run's duration is appended to times
+def timed_callback(callback, times):
+    def run():
+        started = time.perf_counter()
+        callback()
+        times.append(time.perf_counter() - started)
+    return run
+
+
+def add_latencies(results, name, times):
+    if not times:
+        return
+    times.sort()
+    results.add(f"{name}_us_mean", statistics.fmean(times) * 1e6, "us", "lower")
+    results.add(f"{name}_us_p99", times[int(len(times) * 0.99)] * 1e6, "us", "lower")
+
+
+# Simulated seconds of what the production runtime runs: the 1 Hz sample, the
+# display scheduler woken every button poll period with its default jobs, and
+# the telemetry and DB writers flushing full batches (the DB on the v2 schema)
+def bench_display(results, args):
+    clock = VirtualClock(DEFAULT_START)
+    hardware, sampler = simulated_sampler(clock)
+    telemetry = TelemetryWriter(hardware.serial)
+    path = os.path.join(args.workdir, "display.db")
+    remove_db(path)
+    conn = sqlite3.connect(path)
+    version = ensure_schema(conn)
+    install_rollups(conn)
+    conn.close()
+    db_writer = BatchedWriter(path, reading_insert_sql(version))
+    tsm = TemperatureMachine(hardware, ManagedDisplay(hardware.display), sampler, 72,
+                             telemetry=telemetry, db_writer=db_writer, clock=clock,
+                             inputs=make_input_queue({}, clock=clock))
+    tsm.attachButtons(hardware)
+    tsm.scheduleJobs()
+    job_times = {}
+    for job in tsm.scheduler.jobs:
+        job.callback = timed_callback(job.callback, job_times.setdefault(job.name, []))
+    tick = DISPLAY_JOBS["buttons"][1]
+    ticks_per_second = round(1.0 / tick)
+
+    conn = db_writer.connect()
+    seconds, samples, dispatches, commits = [], [], [], []
+    sample = timed_callback(sampler.sample, samples)
+    telemetry_batch, db_batch = [], []
+    for i in range(args.iterations):
+        if i % 600 == 0:
+            hardware.increase_button.press()
+        started = time.perf_counter()
+        sample()
+        for step in range(1, ticks_per_second + 1):
+            clock.set(clock.start + i + step * tick)
+            tsm.scheduler.run_pending()
+        telemetry_batch.extend(drain(telemetry.queue))
+        db_batch.extend(drain(db_writer.queue))
+        if len(telemetry_batch) >= telemetry.batch_size:
+            flush_started = time.perf_counter()
+            telemetry.dispatch(telemetry_batch)
+            dispatches.append(time.perf_counter() - flush_started)
+            telemetry_batch = []
+        if len(db_batch) >= db_writer.batch_size:
+            flush_started = time.perf_counter()
+            db_writer.commit(conn, db_batch)
+            commits.append(time.perf_counter() - flush_started)
+            db_batch = []
+        seconds.append(time.perf_counter() - started)
+    conn.close()
+    remove_db(path)
+
+    add_latencies(results, "display.second", seconds)
+    add_latencies(results, "display.sample", samples)
+    for name, times in job_times.items():
+        add_latencies(results, f"display.job_{name}", times)
+    add_latencies(results, "display.telemetry_dispatch", dispatches)
+    add_latencies(results, "display.db_commit", commits)
+
+
+RUNNERS = {
+    "smoothing": bench_smoothing,
+    "inserts": bench_inserts,
+    "queries": bench_queries,
+    "summary": bench_summary,
+    "display": bench_display,
+}
+
+
+def run(args):
+    os.makedirs(args.workdir, exist_ok=True)
+    results = Results()
+    for suite in args.suites:
+        print(f"[{suite}]", flush=True)
+        RUNNERS[suite](results, args)
+    report = {
+        "meta": {
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "suites": args.suites,
+            "sizes": args.sizes,
+            "repeat": args.repeat,
+        },
+        "metrics": results.metrics,
+    }
+    with open(args.out, "w") as out:
+        json.dump(report, out, indent=2)
+    print(f"Wrote {len(results.metrics)} metrics to {args.out}")
+    return report
+
+
+# === Comparison ===
+# Returns the names of metrics that got worse by more than threshold (a fraction)
+# or that the current run no longer reports
+def compare(baseline, current, threshold=0.10):
+    regressions = []
+    print(f"{'metric':58s} {'baseline':>12s} {'current':>12s} {'change':>8s}")
+    for name, base in baseline["metrics"].items():
+        cur = current["metrics"].get(name)
+        if cur is None:
+            print(f"{name:58s} {base['value']:12.3f} {'missing':>12s} {'':8s} REGRESSION")
+            regressions.append(name)
+            continue
+        if not base["value"]:
+            continue
+        change = (cur["value"] - base["value"]) / base["value"]
+        worse = -change if base["better"] == "higher" else change
+        status = ""
+        if worse > threshold:
+            status = "REGRESSION"
+            regressions.append(name)
+        elif worse < -threshold:
+            status = "improved"
+        print(f"{name:58s} {base['value']:12.3f} {cur['value']:12.3f} {change:+8.1%} {status}")
+    print(f"{len(regressions)} regression(s) beyond {threshold:.0%} or missing")
+    return regressions
+
+
+def load_report(path):
+    with open(path, "r") as report_file:
+        return json.load(report_file)
+
+
+def parse_list(text, kind=str):
+    return [kind(item) for item in text.split(",") if item]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Thermostat benchmark suite")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="run benchmarks and write JSON results")
+    run_parser.add_argument("--suites", type=parse_list, default=list(SUITES),
+                            help=f"comma-separated subset of {','.join(SUITES)}")
+    run_parser.add_argument("--sizes", type=lambda text: parse_list(text, int), default=list(DEFAULT_SIZES),
+                            help="synthetic database sizes in rows, e.g. 10000,1000000,100000000")
+    run_parser.add_argument("--repeat", type=int, default=5, help="runs per measurement; the median is kept")
+    run_parser.add_argument("--iterations", type=int, default=20000,
+                            help="calls per smoothing measurement and display passes")
+    run_parser.add_argument("--insert-rows", type=int, default=5000)
+    run_parser.add_argument("--batch-size", type=int, default=32)
+    run_parser.add_argument("--workdir", default="bench_data", help="where synthetic databases are cached")
+    run_parser.add_argument("--out", default="bench.json")
+    run_parser.add_argument("--baseline", help="results to compare against once the run finishes")
+    run_parser.add_argument("--threshold", type=float, default=0.10)
+
+    compare_parser = commands.add_parser("compare", help="compare two result files")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=0.10,
+                                help="flag metrics worse by more than this fraction")
+    args = parser.parse_args(argv)
+
+    if args.command == "compare":
+        return 1 if compare(load_report(args.baseline), load_report(args.current), args.threshold) else 0
+
+    unknown = set(args.suites) - set(SUITES)
+    if unknown:
+        parser.error(f"unknown suites: {', '.join(sorted(unknown))}")
+    report = run(args)
+    if args.baseline:
+        return 1 if compare(load_report(args.baseline), report, args.threshold) else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
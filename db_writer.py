@@ -0,0 +1,176 @@
+# db_writer.py - Batched, group-committed SQLite writer for temperature_readings
+# The display loop hands rows to a bounded queue and a dedicated thread writes
+# them with executemany(), committing once per batch instead of once per row.
+# On SD-card storage every commit is an fsync, so this keeps that stall out of
+# the 1 Hz display loop.
+import logging
+import queue
+import sqlite3
+import threading
+import time
+
+# === Pragmas applied to the writer's connection ===
+# WAL lets query_temperature_data() read while the writer is appending, and
+# synchronous=NORMAL in WAL mode only syncs at checkpoints rather than on every
+# commit. journal_mode=WAL is persistent, so it only has to succeed once per file.
+WRITER_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA wal_autocheckpoint=1000",
+)
+
+# Sentinel placed on the queue by close() to stop the writer thread
+_STOP = object()
+
+
+# A row the change-only filter did not store (see deadband.py). It is not
+# inserted, only passed to the writer's repeat_sql statements (the rollups).
+class RepeatedRow(tuple):
+    pass
+
+
+class BatchedWriter():
+    def __init__(self, db_path, insert_sql, batch_size=32, flush_interval=60.0, max_queue=1000,
+                 repeat_sql=()):
+        self.db_path = db_path
+        self.insert_sql = insert_sql
+        self.repeat_sql = repeat_sql
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.thread = threading.Thread(target=self.run, name="db-writer", daemon=True)
+
+        # Counters reported through stats()
+        self.lock = threading.Lock()
+        self.rows_written = 0
+        self.rows_dropped = 0
+        self.rows_failed = 0
+        # Rows the insert skipped because one with the same key is stored
+        self.rows_conflicted = 0
+        self.rows_repeated = 0
+        self.commits = 0
+        self.last_commit_ms = 0.0
+        self.max_commit_ms = 0.0
+        self.total_commit_ms = 0.0
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    # Never blocks the caller: if the queue is full the row is dropped and counted
+    def submit(self, row):
+        try:
+            self.queue.put_nowait(row)
+            return True
+        except queue.Full:
+            with self.lock:
+                self.rows_dropped += 1
+            logging.warning("DB writer queue full, dropping row")
+            return False
+
+    # Flush everything still queued, commit it and stop the thread
+    def close(self, timeout=10.0):
+        if not self.thread.is_alive():
+            return
+        self.queue.put(_STOP)
+        self.thread.join(timeout)
+        if self.thread.is_alive():
+            logging.error("DB writer did not stop within timeout; queued rows may be lost")
+
+    def stats(self):
+        with self.lock:
+            commits = self.commits
+            return {
+                "queue_depth": self.queue.qsize(),
+                "rows_written": self.rows_written,
+                "rows_dropped": self.rows_dropped,
+                "rows_failed": self.rows_failed,
+                "rows_conflicted": self.rows_conflicted,
+                "rows_repeated": self.rows_repeated,
+                "commits": commits,
+                "last_commit_ms": round(self.last_commit_ms, 3),
+                "max_commit_ms": round(self.max_commit_ms, 3),
+                "avg_commit_ms": round(self.total_commit_ms / commits, 3) if commits else 0.0,
+            }
+
+    def connect(self):
+        conn = sqlite3.connect(self.db_path)
+        for pragma in WRITER_PRAGMAS:
+            try:
+                conn.execute(pragma)
+            except sqlite3.Error as e:
+                logging.warning(f"DB writer could not apply '{pragma}': {e}")
+        return conn
+
+    def run(self):
+        conn = self.connect()
+        batch = []
+        deadline = None
+
+        while True:
+            # Wait indefinitely while idle; once a batch is open, only until its deadline
+            timeout = None if not batch else max(0.0, deadline - time.monotonic())
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            if item is _STOP:
+                break
+            if item is not None:
+                if not batch:
+                    deadline = time.monotonic() + self.flush_interval
+                batch.append(item)
+
+            if batch and (len(batch) >= self.batch_size or time.monotonic() >= deadline):
+                self.commit(conn, batch)
+                batch = []
+
+        # Shutdown path: drain anything queued behind the sentinel as well
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _STOP:
+                batch.append(item)
+        if batch:
+            self.commit(conn, batch)
+        conn.close()
+
+    def commit(self, conn, batch):
+        start = time.perf_counter()
+        repeats = [row for row in batch if isinstance(row, RepeatedRow)]
+        if repeats:
+            batch = [row for row in batch if not isinstance(row, RepeatedRow)]
+        try:
+            stored = conn.executemany(self.insert_sql, batch).rowcount if batch else 0
+            if repeats:
+                for sql in self.repeat_sql:
+                    conn.executemany(sql, repeats)
+            conn.commit()
+        except sqlite3.Error as e:
+            conn.rollback()
+            with self.lock:
+                self.rows_failed += len(batch)
+            logging.error(f"DB writer failed to commit {len(batch)} rows: {e}")
+            return
+        elapsed_ms = (time.perf_counter() - start) * 1000.0
+
+        # An INSERT ... ON CONFLICT DO NOTHING leaves rows out of the rowcount;
+        # a negative rowcount means SQLite did not report one
+        stored = len(batch) if stored < 0 else stored
+        if stored < len(batch):
+            logging.warning(f"DB writer: {len(batch) - stored} of {len(batch)} rows share a timestamp "
+                            f"with a stored row and were not stored")
+        with self.lock:
+            self.rows_written += stored
+            self.rows_conflicted += len(batch) - stored
+            self.rows_repeated += len(repeats)
+            self.commits += 1
+            self.last_commit_ms = elapsed_ms
+            self.max_commit_ms = max(self.max_commit_ms, elapsed_ms)
+            self.total_commit_ms += elapsed_ms
+        logging.debug("Committed %d rows in %.1f ms (queue depth %d)",
+                      len(batch), elapsed_ms, self.queue.qsize())
@@ -0,0 +1,277 @@
+# deadband.py - Change-only logging of temperature_readings and its reconstruction
+# The db_log job writes a full row every 30 s, although for a thermostat the
+# state, temperature and set point are unchanged most of the time. With
+# "db_log_mode": "change" a row is only written when
+#   - the state or the set point changes,
+#   - the temperature moves more than "db_deadband" degrees away from the last
+#     written row (0, the default, means any change), or
+#   - "db_heartbeat" seconds have passed since the last written row,
+# and each run of the app is recorded in change_log_sessions with its logging
+# period and, once it shuts down, the timestamp of the last row it would have
+# written.
+#
+# expand_readings() turns the stored rows back into the dense log: every row is
+# repeated once per period until the next stored row or the end of its
+# session, the repeats spread evenly over the gap since the job does not run
+# exactly a period apart. With a deadband of 0 that is the series dense logging
+# writes, with timestamps off by the job's jitter; with a larger one
+# temperatures are off by at most the deadband. Rows logged outside
+# any change-only session pass through unchanged, and the tail of a session
+# that never recorded its end (a crash) is not extended past its last row.
+# resample_readings() samples the same step function on a fixed grid.
+#
+# Rollups still count every logging period: the rows the filter suppresses are
+# handed to the DB writer as RepeatedRows with the last stored values, which
+# update the rollups without being stored (see rollups.py).
+#
+#     python deadband.py expand [db] [--start ...] [--end ...] [--state heat]
+#     python deadband.py resample [db] --start ... --end ... [--interval 300]
+import argparse
+import sqlite3
+from collections import namedtuple
+from datetime import datetime, timedelta
+from itertools import chain
+
+from history import DEFAULT_CHUNK, iter_readings
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Logged rows are up to this many periods apart before the gap counts as
+# missing rows (a late run is not a skipped one)
+SPACING_SLACK = 1.5
+
+SESSIONS_DDL = '''
+    CREATE TABLE IF NOT EXISTS change_log_sessions (
+        id INTEGER PRIMARY KEY,
+        started TEXT NOT NULL,
+        ended TEXT,
+        period INTEGER NOT NULL,
+        deadband REAL NOT NULL,
+        heartbeat INTEGER NOT NULL
+    )
+'''
+
+LogSession = namedtuple("LogSession", ["id", "started", "ended", "period", "deadband", "heartbeat"])
+
+
+# === Write side: decide which rows of the db_log job to keep ===
+class DeadbandFilter():
+    def __init__(self, deadband=0.0, heartbeat=900.0):
+        self.deadband = deadband
+        self.heartbeat = heartbeat
+        # Last row written and when; latest is the timestamp of the last row offered
+        self.last = None
+        self.last_at = None
+        self.latest = None
+        self.offered = 0
+        self.written = 0
+        self.heartbeats = 0
+
+    # row is in temperature_readings column order; now is when it was taken
+    def accept(self, row, now):
+        self.offered += 1
+        self.latest = row[0]
+        last = self.last
+        if (last is not None and row[1] == last[1] and row[3] == last[3]
+                and abs(row[2] - last[2]) <= self.deadband):
+            if (now - self.last_at).total_seconds() < self.heartbeat:
+                return False
+            self.heartbeats += 1
+        self.last = row
+        self.last_at = now
+        self.written += 1
+        return True
+
+    def stats(self):
+        return {
+            "offered": self.offered,
+            "written": self.written,
+            "suppressed": self.offered - self.written,
+            "heartbeats": self.heartbeats,
+        }
+
+
+def make_deadband_filter(config):
+    if config.get("db_log_mode", "dense") != "change":
+        return None
+    return DeadbandFilter(config.get("db_deadband", 0), config.get("db_heartbeat", 900))
+
+
+# === Sessions ===
+def install_sessions(conn):
+    conn.execute(SESSIONS_DDL)
+    conn.commit()
+
+
+def open_session(conn, started, period, deadband, heartbeat):
+    install_sessions(conn)
+    cursor = conn.execute(
+        "INSERT INTO change_log_sessions (started, period, deadband, heartbeat) VALUES (?, ?, ?, ?)",
+        (started, int(period), deadband, int(heartbeat)))
+    conn.commit()
+    return cursor.lastrowid
+
+
+# ended is the timestamp of the last row offered to the filter, None if nothing was logged
+def close_session(conn, session_id, ended):
+    conn.execute("UPDATE change_log_sessions SET ended = COALESCE(?, started) WHERE id = ?",
+                 (ended, session_id))
+    conn.commit()
+
+
+def load_sessions(conn):
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'change_log_sessions'"
+    ).fetchone()
+    if not exists:
+        return []
+    rows = conn.execute(
+        "SELECT id, started, ended, period, deadband, heartbeat FROM change_log_sessions ORDER BY started, id"
+    ).fetchall()
+    return [LogSession(*row) for row in rows]
+
+
+# === Read side: the dense series back from the stored rows ===
+# Maps time-ordered timestamps to the session that logged them, or None
+class SessionIndex():
+    def __init__(self, sessions):
+        self.sessions = sessions
+        self.index = -1
+
+    def lookup(self, timestamp):
+        sessions = self.sessions
+        while self.index + 1 < len(sessions) and sessions[self.index + 1].started <= timestamp:
+            self.index += 1
+        if self.index < 0:
+            return None
+        session = sessions[self.index]
+        if session.ended is not None:
+            return session if timestamp <= session.ended else None
+        following = sessions[self.index + 1] if self.index + 1 < len(sessions) else None
+        return session if following is None or timestamp < following.started else None
+
+
+# The dense rows a stored row stands for: one per period from its timestamp
+# until next_timestamp (exclusive, the next row of the same session) or, for
+# the session's last row, until the session's end (inclusive). The db_log job
+# runs late or skips runs now and then, so stored rows are not a whole number
+# of periods apart: the gap is divided into round(gap / period) equal steps.
+def expand_run(row, session, next_timestamp):
+    if session is None or (next_timestamp is None and session.ended is None):
+        yield row
+        return
+    start = datetime.strptime(row[0], TIME_FORMAT)
+    end = datetime.strptime(next_timestamp or session.ended, TIME_FORMAT)
+    gap = (end - start).total_seconds()
+    steps = round(gap / session.period)
+    if next_timestamp is None:
+        # The session's end is itself a row the job logged
+        repeats = max(steps, 1) if gap > 0 else 0
+    else:
+        repeats = steps - 1
+    yield row
+    for step in range(1, repeats + 1):
+        at = start + timedelta(seconds=gap * step / max(steps, 1))
+        yield (at.strftime(TIME_FORMAT), row[1], row[2], row[3])
+
+
+# Same arguments and rows as history.iter_readings. live_until is, for a
+# session that is still logging, the timestamp of the latest row its filter
+# has seen (DeadbandFilter.latest), so its current run is included.
+def expand_readings(conn, start_date=None, end_date=None, state_filter=None,
+                    chunk_size=DEFAULT_CHUNK, live_until=None):
+    sessions = load_sessions(conn)
+    if not sessions:
+        yield from iter_readings(conn, start_date, end_date, state_filter, chunk_size)
+        return
+    if live_until is not None and sessions[-1].ended is None:
+        sessions[-1] = sessions[-1]._replace(ended=live_until)
+
+    # The row in effect at start_date was written at most a heartbeat earlier
+    scan_from = start_date
+    if start_date:
+        lookback = max(session.heartbeat + SPACING_SLACK * session.period for session in sessions)
+        scan_from = (datetime.fromisoformat(start_date) - timedelta(seconds=lookback)).strftime(TIME_FORMAT)
+    # No upper bound: the first row after end_date is what ends the last run
+    index = SessionIndex(sessions)
+    previous = None
+    previous_session = None
+    for row in iter_readings(conn, scan_from, None, None, chunk_size):
+        session = index.lookup(row[0])
+        if previous is not None:
+            next_timestamp = row[0] if session is previous_session else None
+            yield from select(expand_run(previous, previous_session, next_timestamp),
+                              start_date, end_date, state_filter)
+        if end_date and row[0] > end_date:
+            return
+        previous = row
+        previous_session = session
+    if previous is not None:
+        yield from select(expand_run(previous, previous_session, None), start_date, end_date, state_filter)
+
+
+def select(rows, start_date, end_date, state_filter):
+    for row in rows:
+        if start_date and row[0] < start_date:
+            continue
+        if end_date and row[0] > end_date:
+            return
+        if state_filter and row[1] != state_filter:
+            continue
+        yield row
+
+
+# Step-function value of the (expanded) log every interval seconds from
+# start_date to end_date. A grid point gets the dense row at or before it as
+# long as it is less than SPACING_SLACK periods old; grid points in gaps are
+# skipped.
+def resample_readings(conn, start_date, end_date, interval=300, state_filter=None,
+                      chunk_size=DEFAULT_CHUNK, live_until=None):
+    sessions = load_sessions(conn)
+    coverage = max([session.period for session in sessions] or [30]) * SPACING_SLACK
+    at = datetime.fromisoformat(start_date)
+    end = datetime.fromisoformat(end_date)
+    step = timedelta(seconds=interval)
+    # Start that far early so the row in effect at start_date is seen
+    scan_from = (at - timedelta(seconds=coverage)).strftime(TIME_FORMAT)
+    current = None
+    current_at = None
+    # A final None flushes the grid points after the last row
+    for row in chain(expand_readings(conn, scan_from, end_date, None, chunk_size, live_until), [None]):
+        row_at = end + step if row is None else datetime.strptime(row[0], TIME_FORMAT)
+        while at <= end and at < row_at:
+            if (current is not None and (at - current_at).total_seconds() < coverage
+                    and (not state_filter or current[1] == state_filter)):
+                yield (at.strftime(TIME_FORMAT), current[1], current[2], current[3])
+            at += step
+        current = row
+        current_at = row_at
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Read a change-only temperature log as a dense series")
+    parser.add_argument("command", choices=["expand", "resample"])
+    parser.add_argument("db", nargs="?", default="temperature_log.db")
+    parser.add_argument("--start")
+    parser.add_argument("--end")
+    parser.add_argument("--state", choices=["heat", "cool", "off"])
+    parser.add_argument("--interval", type=int, default=300, help="resample grid in seconds")
+    args = parser.parse_args(argv)
+    if args.command == "resample" and not (args.start and args.end):
+        parser.error("resample needs --start and --end")
+
+    conn = sqlite3.connect(args.db)
+    try:
+        if args.command == "expand":
+            rows = expand_readings(conn, args.start, args.end, args.state)
+        else:
+            rows = resample_readings(conn, args.start, args.end, args.interval, args.state)
+        print("Timestamp\t\tState\tTemp\tSetPoint")
+        for row in rows:
+            print(f"{row[0]}\t{row[1]}\t{row[2]}\t{row[3]}")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
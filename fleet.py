@@ -0,0 +1,248 @@
+# fleet.py - Many simulated thermostats in one process
+# Each virtual device is a full TemperatureMachine with its own simulated
+# sensor, LEDs, buttons, LCD framebuffer, sampler and set point. Instead of one
+# display thread per device, the fleet advances every device once per tick,
+# split into shards across a small worker pool. All devices share one
+# BatchedWriter into fleet_readings, keyed by (device_id, ts).
+#
+# fleet_readings lives in its own database (--db) rather than in the readings
+# table of temperature_log.db, which has no device column: rollups, history
+# queries, migrate.py and archive.py only ever see the single real thermostat.
+#
+# Time is simulated: each tick moves the fleet clock forward by tick_seconds,
+# every device takes a sensor sample and runs whatever jobs of its display
+# scheduler (the same DeadlineScheduler the runtime drives) are due, and the
+# thermal models follow the clock, so the fleet runs as fast as the host
+# allows and reports how much faster than real time that is. Buttons are
+# polled once per tick.
+#
+#     python fleet.py --sizes 100,1000,5000 --ticks 120 [--workers 4] [--db fleet.db]
+#
+# CPython runs only one thread at a time, so extra workers overlap only the
+# SQLite work; --workers 1 (the default) steps the shards inline.
+import argparse
+import json
+import logging
+import random
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from clock import SYSTEM_CLOCK, VirtualClock
+from db_writer import BatchedWriter
+from hal import build_simulated_hardware
+from sampler import SensorSampler
+from schema import STATE_CODES
+from smoothing import MovingAverage
+from thermostat import ManagedDisplay, TemperatureMachine
+
+FLEET_TABLE_DDL = '''
+    CREATE TABLE IF NOT EXISTS fleet_readings (
+        device_id INTEGER NOT NULL,
+        ts INTEGER NOT NULL,
+        state INTEGER NOT NULL CHECK (state BETWEEN 0 AND 2),
+        temp_tenths INTEGER NOT NULL,
+        set_point INTEGER NOT NULL,
+        PRIMARY KEY (device_id, ts)
+    ) WITHOUT ROWID
+'''
+
+FLEET_INSERT_SQL = "INSERT OR IGNORE INTO fleet_readings VALUES (?, ?, ?, ?, ?)"
+
+
+# === One virtual device ===
+# Writes v2-shaped rows with its device id instead of v1 temperature_readings rows
+class FleetThermostat(TemperatureMachine):
+    def __init__(self, device_id, hardware, screen, sampler, set_point, db_writer=None,
+                 clock=SYSTEM_CLOCK):
+        self.deviceId = device_id
+        self.hardware = hardware
+        super().__init__(hardware, screen, sampler, set_point, db_writer=db_writer, clock=clock)
+
+    def readingRow(self, now, current_time, temp):
+        return (self.deviceId, int(now.timestamp()), STATE_CODES[self.current_state_value],
+                round(self.get_smoothed_fahrenheit() * 10), self.setPoint)
+
+    # One tick: read the sensor, then run the display jobs that are due
+    def step(self):
+        self.sampler.sample()
+        self.scheduler.run_pending()
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class Fleet():
+    def __init__(self, size, db_path="fleet.db", tick_seconds=1.0, workers=1, seed=0,
+                 press_rate=0.0005, set_point=72, start_time=None):
+        self.size = size
+        self.tick_seconds = tick_seconds
+        self.workers = workers
+        self.press_rate = press_rate
+        self.clock = VirtualClock(time.time() if start_time is None else start_time)
+        self.ticks = 0
+        self.presses = 0
+        self.tick_ms = []
+
+        conn = sqlite3.connect(db_path)
+        conn.execute(FLEET_TABLE_DDL)
+        conn.commit()
+        conn.close()
+        self.db_writer = BatchedWriter(
+            db_path, FLEET_INSERT_SQL,
+            batch_size=500, flush_interval=1.0, max_queue=max(1000, size)
+        ).start()
+
+        rng = random.Random(seed)
+        started = time.perf_counter()
+        self.devices = [self.build_device(device_id, rng, set_point) for device_id in range(size)]
+        self.build_seconds = time.perf_counter() - started
+
+        shard_count = max(1, workers)
+        self.shards = [(self.devices[i::shard_count], random.Random(seed * 1000 + i))
+                       for i in range(shard_count)]
+        self.pool = ThreadPoolExecutor(workers, thread_name_prefix="fleet") if workers > 1 else None
+
+    def build_device(self, device_id, rng, set_point):
+        ambient = rng.uniform(60.0, 80.0)
+        config = {"simulation": {
+            "ambient_f": ambient,
+            "start_f": ambient + rng.uniform(-3.0, 3.0),
+            "seed": device_id,
+        }}
+        hardware = build_simulated_hardware(config, clock=self.clock.monotonic)
+        sampler = SensorSampler(hardware.sensor, smoother=MovingAverage(window=5), clock=self.clock)
+        sampler.sample()
+        device = FleetThermostat(device_id, hardware, ManagedDisplay(hardware.display), sampler,
+                                 set_point + rng.randint(-3, 3), db_writer=self.db_writer,
+                                 clock=self.clock)
+        # Scripted presses go through the same handlers and input queue as GPIO buttons
+        device.attachButtons(hardware)
+        # Spread the zones over off/heat/cool, and their database rows over the 30 s cycle
+        for _ in range(device_id % 3):
+            device.cycle()
+        device.scheduleJobs({"button_poll_period": self.tick_seconds},
+                            stagger=device_id % 30 * self.tick_seconds)
+        return device
+
+    def step_shard(self, shard):
+        devices, rng = shard
+        presses = 0
+        for device in devices:
+            if self.press_rate and rng.random() < self.press_rate:
+                rng.choice(list(device.hardware.buttons().values())).press()
+                presses += 1
+            try:
+                device.step()
+            except Exception as e:
+                logging.error(f"Device {device.deviceId} step failed: {e}")
+        return presses
+
+    def tick(self):
+        self.clock.advance(self.tick_seconds)
+        started = time.perf_counter()
+        if self.pool is None:
+            presses = sum(self.step_shard(shard) for shard in self.shards)
+        else:
+            presses = sum(self.pool.map(self.step_shard, self.shards))
+        self.tick_ms.append((time.perf_counter() - started) * 1000)
+        self.presses += presses
+        self.ticks += 1
+
+    def run(self, ticks):
+        started = time.perf_counter()
+        for _ in range(ticks):
+            self.tick()
+        return time.perf_counter() - started
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+        self.db_writer.close()
+
+    def report(self, elapsed):
+        latencies = sorted(self.tick_ms)
+        writer = self.db_writer.stats()
+        leds = [device.actuators.stats() for device in self.devices]
+        inputs = [device.inputs.stats() for device in self.devices]
+        elapsed = elapsed or 1e-9
+        return {
+            "devices": self.size,
+            "workers": self.workers,
+            "ticks": self.ticks,
+            "build_s": round(self.build_seconds, 3),
+            "tick_ms_p50": round(percentile(latencies, 0.50), 3),
+            "tick_ms_p95": round(percentile(latencies, 0.95), 3),
+            "tick_ms_p99": round(percentile(latencies, 0.99), 3),
+            "tick_ms_max": round(latencies[-1] if latencies else 0.0, 3),
+            "device_steps_per_s": round(self.size * self.ticks / elapsed, 1),
+            "realtime_factor": round(self.ticks * self.tick_seconds / elapsed, 2),
+            "button_presses": self.presses,
+            "button_events_queued": sum(stats["presses"] + stats["bounced"] + stats["overflowed"]
+                                        for stats in inputs),
+            "button_events_applied": sum(stats["applied"] for stats in inputs),
+            "button_events_pending": sum(stats["pending"] for stats in inputs),
+            "led_ops_applied": sum(stats["applied"] for stats in leds),
+            "led_ops_skipped": sum(stats["skipped"] for stats in leds),
+            "rows_written": writer["rows_written"],
+            "rows_dropped": writer["rows_dropped"],
+            "avg_commit_ms": writer["avg_commit_ms"],
+        }
+
+
+# Every scripted press must have reached a device's input queue, and every
+# queued event must have been applied by processInput or still be waiting for
+# its coalescing window
+def check_button_delivery(report):
+    if report["button_events_queued"] != report["button_presses"]:
+        raise RuntimeError(f"{report['button_presses']} button presses but "
+                           f"{report['button_events_queued']} reached the input queues")
+    if report["button_events_applied"] + report["button_events_pending"] != report["button_presses"]:
+        raise RuntimeError(f"{report['button_presses']} button presses but "
+                           f"{report['button_events_applied']} applied by processInput")
+
+
+def run_fleet(size, ticks, db_path="fleet.db", workers=1, seed=0, press_rate=0.0005):
+    fleet = Fleet(size, db_path, workers=workers, seed=seed, press_rate=press_rate)
+    try:
+        elapsed = fleet.run(ticks)
+    finally:
+        fleet.close()
+    report = fleet.report(elapsed)
+    check_button_delivery(report)
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a fleet of simulated thermostats")
+    parser.add_argument("--sizes", default="100,1000",
+                        help="comma-separated fleet sizes to run one after another")
+    parser.add_argument("--ticks", type=int, default=60, help="simulated seconds per run")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--db", default="fleet.db")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--press-rate", type=float, default=0.0005,
+                        help="probability per device per tick of a random button press")
+    parser.add_argument("--json", action="store_true", help="print one JSON object per run")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    columns = ["devices", "build_s", "tick_ms_p50", "tick_ms_p95", "tick_ms_max",
+               "device_steps_per_s", "realtime_factor", "button_presses", "button_events_applied",
+               "rows_written", "rows_dropped"]
+    if not args.json:
+        print("\t".join(columns))
+    for size in (int(n) for n in args.sizes.split(",")):
+        report = run_fleet(size, args.ticks, args.db, args.workers, args.seed, args.press_rate)
+        if args.json:
+            print(json.dumps(report))
+        else:
+            print("\t".join(str(report[c]) for c in columns))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,472 @@
+# hal.py - Hardware abstraction layer for the thermostat
+# Every peripheral the controller touches (temperature sensor, character LCD,
+# UART, the two PWM LEDs and the three buttons) sits behind a small interface
+# with a real backend for the Raspberry Pi and a simulated one that runs on any
+# Linux box. Hardware libraries are only imported when a real backend is built,
+# so the simulated controller needs nothing beyond the standard library and
+# python-statemachine.
+#
+# config.json selects the backends:
+#     "hardware": "real" (default) or "simulated"
+#     "simulation": {"ambient_f": 68, "start_f": 72, "noise_f": 0.2, "seed": 1,
+#                    "serial": "loopback" | "pty", "button_script": [[5, "increase"], ...]}
+import logging
+import math
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from pwm import WaveformEngine, make_waveform_led
+from telemetry import LoopbackPort, PtyPort
+
+
+# === Interfaces ===
+class TemperatureSensor():
+    # Degrees Celsius, like the AHTx0 driver
+    @property
+    def temperature(self):
+        raise NotImplementedError
+
+    # Percent relative humidity
+    @property
+    def relative_humidity(self):
+        raise NotImplementedError
+
+
+# The subset of adafruit_character_lcd that LcdFramebuffer relies on
+class CharacterDisplay():
+    columns = 16
+    rows = 2
+
+    def clear(self):
+        raise NotImplementedError
+
+    def cursor_position(self, column, row):
+        raise NotImplementedError
+
+    def create_char(self, location, pattern):
+        raise NotImplementedError
+
+    def write(self, text):
+        raise NotImplementedError
+
+    @property
+    def message(self):
+        return None
+
+    @message.setter
+    def message(self, text):
+        self.write(text)
+
+    def deinit(self):
+        pass
+
+
+# LED and button backends follow gpiozero's PWMLED (on/off/pulse/close) and
+# Button (when_pressed/close) interfaces; serial backends need write()/close().
+
+
+# === Real backends (Raspberry Pi) ===
+def open_sensor():
+    import board
+    import adafruit_ahtx0
+    try:
+        return adafruit_ahtx0.AHTx0(board.I2C())
+    except Exception as e:
+        logging.error(f"Failed to initialize temperature sensor: {e}")
+        raise
+
+
+class CharLcdDisplay(CharacterDisplay):
+    def __init__(self, columns=16, rows=2):
+        import board
+        import digitalio
+        import adafruit_character_lcd.character_lcd as characterlcd
+        self.columns = columns
+        self.rows = rows
+        self.pins = [digitalio.DigitalInOut(pin) for pin in
+                     (board.D17, board.D27, board.D5, board.D6, board.D13, board.D26)]
+        self.lcd = characterlcd.Character_LCD_Mono(*self.pins, columns, rows)
+
+    def clear(self):
+        self.lcd.clear()
+
+    def cursor_position(self, column, row):
+        self.lcd.cursor_position(column, row)
+
+    def create_char(self, location, pattern):
+        self.lcd.create_char(location, pattern)
+
+    def write(self, text):
+        self.lcd.message = text
+
+    def deinit(self):
+        for pin in self.pins:
+            pin.deinit()
+
+
+def open_uart(config):
+    import serial
+    try:
+        return serial.Serial(
+            port=config["serial_port"],
+            baudrate=config["baudrate"],
+            parity=serial.PARITY_NONE,
+            stopbits=serial.STOPBITS_ONE,
+            bytesize=serial.EIGHTBITS,
+            timeout=1,
+            # Bound a write on a wedged link; it only ever blocks the telemetry thread
+            write_timeout=1
+        )
+    except Exception as e:
+        logging.error(f"Failed to initialize serial port: {e}")
+        raise
+
+
+# Serial port opened on first use and reopened after a failure, so a missing or
+# unplugged UART never stops the thermostat from starting. Writes raise until
+# the port opens again, and the telemetry writer parks those samples in its
+# outbox (see outbox.py) meanwhile.
+class ReconnectingSerial():
+    def __init__(self, opener, retry_interval=30.0, clock=time.monotonic):
+        self.opener = opener
+        self.retry_interval = retry_interval
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.port = None
+        self.next_attempt = 0.0
+        self.opens = 0
+
+    def connect(self):
+        if self.port is not None:
+            return self.port
+        now = self.clock()
+        if now < self.next_attempt:
+            raise ConnectionError("serial port unavailable, will retry")
+        try:
+            self.port = self.opener()
+        except Exception:
+            self.next_attempt = now + self.retry_interval
+            raise
+        self.opens += 1
+        if self.opens > 1:
+            logging.info("Serial port reopened")
+        return self.port
+
+    def write(self, data):
+        with self.lock:
+            port = self.connect()
+            try:
+                return port.write(data)
+            except Exception:
+                # Reopen on the next write rather than keep using a dead handle
+                self.drop()
+                raise
+
+    def drop(self):
+        port, self.port = self.port, None
+        if port is not None:
+            try:
+                port.close()
+            except Exception as e:
+                logging.warning(f"Failed to close serial port: {e}")
+
+    def close(self):
+        with self.lock:
+            self.drop()
+
+
+# === Simulated backends ===
+# First-order thermal model of the room: the temperature relaxes towards the
+# ambient temperature with time constant tau_s, and the HVAC adds heat_rate_f
+# (or removes cool_rate_f) degrees per minute while demand() is +1 (or -1).
+# Each read adds Gaussian noise. clock is any monotonic seconds source, so a
+# virtual clock can drive it.
+class SimulatedSensor(TemperatureSensor):
+    def __init__(self, ambient_f=68.0, start_f=None, tau_s=3600.0, heat_rate_f=0.5,
+                 cool_rate_f=0.5, noise_f=0.2, humidity=40.0, seed=None, demand=None,
+                 clock=time.monotonic):
+        self.ambient_f = ambient_f
+        self.actual_f = ambient_f if start_f is None else start_f
+        self.tau_s = tau_s
+        self.heat_rate_f = heat_rate_f
+        self.cool_rate_f = cool_rate_f
+        self.noise_f = noise_f
+        self.humidity = humidity
+        self.random = random.Random(seed)
+        self.demand = demand if demand is not None else (lambda: 0)
+        self.clock = clock
+        self.last_update = clock()
+        self.reads = 0
+
+    def advance(self):
+        now = self.clock()
+        dt = now - self.last_update
+        self.last_update = now
+        if dt <= 0:
+            return
+        demand = self.demand()
+        drive = self.heat_rate_f if demand > 0 else -self.cool_rate_f if demand < 0 else 0.0
+        # Exact solution for a constant drive over dt
+        equilibrium = self.ambient_f + drive / 60.0 * self.tau_s
+        self.actual_f = equilibrium + (self.actual_f - equilibrium) * math.exp(-dt / self.tau_s)
+
+    @property
+    def temperature(self):
+        self.advance()
+        self.reads += 1
+        reading_f = self.actual_f + self.random.gauss(0.0, self.noise_f)
+        return (reading_f - 32) * 5 / 9
+
+    @property
+    def relative_humidity(self):
+        return self.humidity + self.random.gauss(0.0, 0.5)
+
+
+# In-memory HD44780: keeps the visible cells and counts bus operations
+class InMemoryDisplay(CharacterDisplay):
+    def __init__(self, columns=16, rows=2):
+        self.columns = columns
+        self.rows = rows
+        self.cells = [[" "] * columns for _ in range(rows)]
+        self.glyphs = {}
+        self.column = 0
+        self.row = 0
+        self.commands = 0
+        self.chars_written = 0
+
+    def clear(self):
+        self.cells = [[" "] * self.columns for _ in range(self.rows)]
+        self.column = self.row = 0
+        self.commands += 1
+
+    def cursor_position(self, column, row):
+        self.column, self.row = column, row
+        self.commands += 1
+
+    def create_char(self, location, pattern):
+        self.glyphs[location] = list(pattern)
+        self.commands += 1
+
+    # Same behaviour as the adafruit driver: writes from the cursor, "\n" moves to the next row
+    def write(self, text):
+        for char in text:
+            if char == "\n":
+                self.row += 1
+                self.column = 0
+                self.commands += 1
+                continue
+            if self.row < self.rows and self.column < self.columns:
+                self.cells[self.row][self.column] = char
+            self.column += 1
+            self.chars_written += 1
+        self.column = self.row = 0
+
+    def text(self):
+        return "\n".join("".join(row) for row in self.cells)
+
+
+class SimulatedLed():
+    def __init__(self, pin=None):
+        self.pin = pin
+        self.mode = "off"
+        self.value = 0.0
+        self.pulse_args = None
+        self.operations = 0
+
+    def on(self):
+        self.mode, self.value, self.pulse_args = "on", 1.0, None
+        self.operations += 1
+
+    def off(self):
+        self.mode, self.value, self.pulse_args = "off", 0.0, None
+        self.operations += 1
+
+    def pulse(self, fade_in_time=1, fade_out_time=1, n=None, background=True):
+        self.mode, self.value = "pulse", 0.5
+        self.pulse_args = (fade_in_time, fade_out_time, n)
+        self.operations += 1
+
+    @property
+    def is_lit(self):
+        return self.mode != "off"
+
+    def close(self):
+        self.off()
+
+
+class ScriptedButton():
+    def __init__(self, pin=None, hold_time=0.5):
+        self.pin = pin
+        self.hold_time = hold_time
+        self.held_time = None
+        self.when_pressed = None
+        self.when_held = None
+        self.presses = 0
+
+    # Invoke the handler on the calling thread, like a gpiozero callback thread would
+    def press(self):
+        self.presses += 1
+        if self.when_pressed is not None:
+            self.when_pressed()
+
+    # Press and keep the button down for `seconds`: when_held fires every
+    # hold_time, as gpiozero does with hold_repeat=True. No real time passes.
+    def hold(self, seconds):
+        self.press()
+        held = self.hold_time
+        while held <= seconds:
+            self.held_time = held
+            if self.when_held is not None:
+                self.when_held()
+            held += self.hold_time
+        self.held_time = None
+
+    def close(self):
+        self.when_pressed = None
+        self.when_held = None
+
+
+# === The assembled set of peripherals ===
+class Hardware():
+    def __init__(self, sensor, display, serial, red_led, blue_led,
+                 state_button, increase_button, decrease_button, simulated=False,
+                 pwm_engine=None):
+        self.sensor = sensor
+        self.display = display
+        self.serial = serial
+        self.red_led = red_led
+        self.blue_led = blue_led
+        self.state_button = state_button
+        self.increase_button = increase_button
+        self.decrease_button = decrease_button
+        self.simulated = simulated
+        # WaveformEngine driving the LEDs, when "led_driver" is "waveform"
+        self.pwm_engine = pwm_engine
+
+    def buttons(self):
+        return {"state": self.state_button, "increase": self.increase_button,
+                "decrease": self.decrease_button}
+
+    def close(self):
+        for device in (self.red_led, self.blue_led, *self.buttons().values()):
+            try:
+                device.close()
+            except Exception as e:
+                logging.warning(f"Failed to close {device}: {e}")
+        if self.pwm_engine is not None:
+            self.pwm_engine.stop()
+        try:
+            self.serial.close()
+        except Exception as e:
+            logging.warning(f"Failed to close serial port: {e}")
+
+
+def build_real_hardware(config):
+    # The sensor and the LCD are slow to import and initialise; bring them up
+    # alongside the GPIO devices instead of one after another
+    with ThreadPoolExecutor(2, thread_name_prefix="hal") as pool:
+        sensor = pool.submit(open_sensor)
+        display = pool.submit(CharLcdDisplay)
+        return build_gpio_hardware(config, sensor, display)
+
+
+# sensor and display are futures, waited for once the GPIO devices are set up
+def build_gpio_hardware(config, sensor, display):
+    from gpiozero import Button, PWMLED
+    # Held buttons fire when_held every hold_time seconds for auto-repeat
+    hold_time = config.get("button_hold_time", 0.5)
+    red_led = PWMLED(config["red_led_pin"])
+    blue_led = PWMLED(config["blue_led_pin"])
+    # Optionally fade both LEDs from one precomputed-waveform thread (see pwm.py)
+    # instead of a gpiozero pulse thread per LED
+    pwm_engine = None
+    driver = config.get("led_driver", "gpiozero")
+    if driver == "waveform":
+        pwm_engine = WaveformEngine().start()
+        red_led = make_waveform_led(pwm_engine, "red", red_led, config)
+        blue_led = make_waveform_led(pwm_engine, "blue", blue_led, config)
+    elif driver != "gpiozero":
+        raise ValueError(f"Unknown LED driver '{driver}', expected 'gpiozero' or 'waveform'")
+    buttons = [Button(config[f"{name}_button_pin"], hold_time=hold_time, hold_repeat=True)
+               for name in ("state", "increase", "decrease")]
+    return Hardware(
+        sensor=sensor.result(),
+        display=display.result(),
+        # Opened by the first telemetry write, not here
+        serial=ReconnectingSerial(lambda: open_uart(config), config.get("serial_retry_interval", 30.0)),
+        red_led=red_led,
+        blue_led=blue_led,
+        state_button=buttons[0],
+        increase_button=buttons[1],
+        decrease_button=buttons[2],
+        pwm_engine=pwm_engine
+    )
+
+
+def build_simulated_hardware(config, clock=time.monotonic):
+    options = config.get("simulation", {})
+    red_led = SimulatedLed(config.get("red_led_pin"))
+    blue_led = SimulatedLed(config.get("blue_led_pin"))
+
+    # A pulsing LED is the thermostat calling for heat (red) or cooling (blue)
+    def demand():
+        return (red_led.mode == "pulse") - (blue_led.mode == "pulse")
+
+    sensor = SimulatedSensor(
+        ambient_f=options.get("ambient_f", 68.0),
+        start_f=options.get("start_f"),
+        tau_s=options.get("tau_s", 3600.0),
+        heat_rate_f=options.get("heat_rate_f", 0.5),
+        cool_rate_f=options.get("cool_rate_f", 0.5),
+        noise_f=options.get("noise_f", 0.2),
+        seed=options.get("seed"),
+        demand=demand,
+        clock=clock
+    )
+    serial = PtyPort() if options.get("serial", "loopback") == "pty" else LoopbackPort()
+    return Hardware(
+        sensor=sensor,
+        display=InMemoryDisplay(),
+        serial=serial,
+        red_led=red_led,
+        blue_led=blue_led,
+        state_button=ScriptedButton(config.get("state_button_pin")),
+        increase_button=ScriptedButton(config.get("increase_button_pin")),
+        decrease_button=ScriptedButton(config.get("decrease_button_pin")),
+        simulated=True
+    )
+
+
+def build_hardware(config, clock=time.monotonic):
+    kind = config.get("hardware", "real")
+    if kind == "real":
+        return build_real_hardware(config)
+    if kind == "simulated":
+        logging.info("Using simulated hardware backends")
+        return build_simulated_hardware(config, clock)
+    raise ValueError(f"Unknown hardware backend '{kind}', expected 'real' or 'simulated'")
+
+
+# === Scripted button presses ===
+# script is a list of [seconds_from_start, "state" | "increase" | "decrease"],
+# optionally with a third element: how many seconds the button is held.
+# Presses are delivered from a background thread, as gpiozero would.
+def play_button_script(hardware, script, sleep=time.sleep):
+    buttons = hardware.buttons()
+
+    def run():
+        elapsed = 0.0
+        for at, name, *held in sorted(script, key=lambda event: event[0]):
+            if at > elapsed:
+                sleep(at - elapsed)
+                elapsed = at
+            if held:
+                buttons[name].hold(held[0])
+            else:
+                buttons[name].press()
+
+    thread = threading.Thread(target=run, name="button-script", daemon=True)
+    thread.start()
+    return thread
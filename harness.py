@@ -0,0 +1,319 @@
+# harness.py - Deterministic virtual-time replay of the thermostat
+# Runs the same TemperatureMachine, sampler, LCD framebuffer, telemetry
+# encoder and database writer as "Enhancement Three Databases.py", on the
+# simulated hardware, but with every timed activity driven by a
+# VirtualScheduler instead of threads and sleep(). Time jumps straight from
+# one event to the next, so hours of operation replay in well under a second
+# and produce byte-identical LCD frames, serial output and database rows on every
+# run with the same seed.
+#
+# The default horizon is two simulated hours, with every scripted press inside
+# it. A full day (--hours 24) is a soak run rather than a regression check: each
+# of its 86400 one-second ticks runs the real sampler, outlier filter and LCD
+# code, so it takes several seconds.
+#
+# The display loop is the machine's own DeadlineScheduler with the jobs
+# scheduleJobs() registers for the runtime; the harness only wakes it with
+# run_pending() at its next deadline. While no button event is waiting, the
+# 50 ms button poll (a no-op on an empty queue) is parked rather than woken 20
+# times a second, and a scripted press puts it back on its period grid.
+#
+# The writer threads are not started: the harness hands their queued items to
+# the writers' own commit()/dispatch() paths on the same batch-size and
+# flush-interval rules, measured in virtual time.
+#
+#     python harness.py [--hours 2] [--seed 1] [--db :memory:] [--repeat 2]
+import argparse
+import hashlib
+import json
+import logging
+import math
+import queue
+import sqlite3
+import time
+
+from clock import VirtualClock, VirtualScheduler
+from db_writer import BatchedWriter
+from hal import build_simulated_hardware
+from inputs import make_input_queue
+from outliers import make_outlier_filter
+from rollups import install_rollups
+from sampler import SensorSampler
+from schema import ensure_schema, reading_insert_sql, readings_query
+from smoothing import make_filter
+from telemetry import TelemetryWriter
+from thermostat import ManagedDisplay, TemperatureMachine
+
+# 2025-01-01 00:00:00 UTC
+DEFAULT_START = 1735689600.0
+
+# Heat, then cool, then off, all within the default two hours
+DEFAULT_BUTTON_SCRIPT = [
+    [20 * 60, "state"],
+    [20 * 60 + 5, "increase"],
+    [60 * 60, "state"],
+    [60 * 60 + 5, "decrease"],
+    [60 * 60 + 6, "decrease"],
+    [100 * 60, "state"],
+]
+
+
+def drain(items):
+    if items.empty():
+        return []
+    drained = []
+    while True:
+        try:
+            drained.append(items.get_nowait())
+        except queue.Empty:
+            return drained
+
+
+# Items waiting for a writer, flushed when batch_size accumulate or max_age
+# virtual seconds after the first one arrived (the writer threads' rule). The
+# max_age flush is a scheduler event, so nothing has to look at the batch on
+# every tick.
+class PendingBatch():
+    def __init__(self, flush, batch_size, max_age, scheduler):
+        self.flush = flush
+        self.batch_size = batch_size
+        self.max_age = max_age
+        self.scheduler = scheduler
+        self.items = []
+        self.opened = None
+
+    def add(self, items):
+        if not items:
+            return
+        if not self.items:
+            self.open()
+        self.items.extend(items)
+        while len(self.items) >= self.batch_size:
+            self.flush(self.items[:self.batch_size])
+            del self.items[:self.batch_size]
+            if self.items:
+                self.open()
+            else:
+                self.opened = None
+
+    def open(self):
+        self.opened = self.scheduler.clock.time()
+        self.scheduler.call_at(self.opened + self.max_age, self.expire, self.opened)
+
+    def expire(self, opened):
+        if self.opened == opened:
+            self.close()
+
+    def close(self):
+        if self.items:
+            self.flush(self.items)
+        self.items = []
+        self.opened = None
+
+
+class ReplayHarness():
+    def __init__(self, config=None, start=DEFAULT_START, db_path=":memory:", seed=1,
+                 button_script=None):
+        config = dict(config or {})
+        simulation = dict(config.get("simulation", {}))
+        simulation.setdefault("seed", seed)
+        simulation.setdefault("start_f", 70.0)
+        simulation["serial"] = "loopback"
+        config["simulation"] = simulation
+
+        self.clock = VirtualClock(start)
+        self.scheduler = VirtualScheduler(self.clock)
+        self.hardware = build_simulated_hardware(config, clock=self.clock.monotonic)
+
+        self.conn = sqlite3.connect(db_path)
+        version = ensure_schema(self.conn)
+        install_rollups(self.conn)
+        self.db_writer = BatchedWriter(
+            db_path, reading_insert_sql(version),
+            batch_size=config.get("db_batch_size", 32),
+            flush_interval=config.get("db_flush_interval", 60)
+        )
+        self.telemetry = TelemetryWriter(
+            self.hardware.serial,
+            mode=config.get("telemetry_mode", "binary"),
+            batch_size=config.get("telemetry_batch_size", 4),
+            max_delay=config.get("telemetry_max_delay", 5.0)
+        )
+        self.db_pending = PendingBatch(
+            lambda rows: self.db_writer.commit(self.conn, rows),
+            self.db_writer.batch_size, self.db_writer.flush_interval, self.scheduler)
+        self.telemetry_pending = PendingBatch(
+            self.telemetry.dispatch, self.telemetry.batch_size, self.telemetry.max_delay, self.scheduler)
+
+        self.sampler = SensorSampler(
+            self.hardware.sensor,
+            interval=config.get("sample_interval", 1.0),
+            smoother=make_filter(config),
+            outlier_filter=make_outlier_filter(config),
+            clock=self.clock
+        )
+        self.sampler.sample()
+        self.screen = ManagedDisplay(self.hardware.display)
+        self.tsm = TemperatureMachine(
+            self.hardware, self.screen, self.sampler,
+            set_point=config.get("default_set_point", 72),
+            telemetry=self.telemetry,
+            db_writer=self.db_writer,
+            clock=self.clock,
+            inputs=make_input_queue(config, clock=self.clock)
+        )
+        self.tsm.attachButtons(self.hardware)
+        self.tsm.scheduleJobs(config)
+        self.jobs = {job.name: job for job in self.tsm.scheduler.jobs}
+        self.idle_polls = 0
+        self.parked = None
+        self.wake_at = None
+
+        # Everything observable goes into one digest for regression checks
+        self.digest = hashlib.sha256()
+        self.frames = 0
+
+        buttons = self.hardware.buttons()
+        script = DEFAULT_BUTTON_SCRIPT if button_script is None else button_script
+        for at, name, *held in script:
+            self.scheduler.call_at(start + at, self.pressButton, buttons[name], held)
+        self.scheduler.every(self.sampler.interval, self.sampler.sample)
+        self.wakeDisplay(self.virtualTime(self.tsm.scheduler.next_deadline()))
+
+    # Virtual time at which the display scheduler's clock reads `deadline`
+    def virtualTime(self, deadline):
+        at = self.clock.start + deadline
+        while at - self.clock.start < deadline:
+            at = math.nextafter(at, math.inf)
+        return at
+
+    def wakeDisplay(self, at):
+        if self.wake_at is None or at < self.wake_at:
+            self.wake_at = at
+            self.scheduler.call_at(at, self.runDisplayJobs, at)
+
+    # One wake-up of the display loop, then hand its output to the writers
+    def runDisplayJobs(self, at):
+        if at != self.wake_at:
+            # Superseded by an earlier wake-up for a button press
+            return
+        jobs = self.jobs
+        refreshes = jobs["lcd_refresh"].runs
+        samples = jobs["telemetry"].runs
+        rows = jobs["db_log"].runs
+        self.tsm.scheduler.run_pending()
+        if jobs["lcd_refresh"].runs != refreshes:
+            self.digest.update(self.hardware.display.text().encode())
+            self.frames += 1
+        # Only the telemetry and db_log jobs queue anything for the writers
+        if jobs["telemetry"].runs != samples:
+            self.telemetry_pending.add(drain(self.telemetry.queue))
+        if jobs["db_log"].runs != rows:
+            self.db_pending.add(drain(self.db_writer.queue))
+        self.parkIdlePoll()
+        self.wake_at = None
+        self.wakeDisplay(self.virtualTime(self.tsm.scheduler.next_deadline()))
+
+    # With nothing queued, take the button poll off the schedule until the next press
+    def parkIdlePoll(self):
+        if self.parked is None and not self.tsm.inputs.pending():
+            buttons = self.jobs["buttons"]
+            self.parked = buttons.deadline
+            buttons.deadline = math.inf
+
+    # A scripted press or hold; a parked button poll resumes at its first
+    # deadline at or after now, on its original period grid
+    def pressButton(self, button, held):
+        if held:
+            button.hold(held[0])
+        else:
+            button.press()
+        buttons = self.jobs["buttons"]
+        if self.parked is not None:
+            polls = max(0, math.ceil((self.clock.monotonic() - self.parked) / buttons.period))
+            buttons.deadline = self.parked + polls * buttons.period
+            self.idle_polls += polls
+            self.parked = None
+        self.wakeDisplay(self.virtualTime(buttons.deadline))
+
+    def run(self, seconds):
+        started = time.perf_counter()
+        self.scheduler.run_for(seconds)
+        return time.perf_counter() - started
+
+    # Flush the writers and fold serial output and stored rows into the digest
+    def finish(self):
+        self.telemetry_pending.close()
+        self.db_pending.close()
+        self.digest.update(self.hardware.serial.read_all())
+        # The stored layout, so the digest doesn't depend on the local time zone
+        query, params = readings_query(self.conn, layout="v2")
+        for row in self.conn.execute(query, params):
+            self.digest.update(repr(row).encode())
+        return self.digest.hexdigest()
+
+    def report(self, elapsed):
+        telemetry = self.telemetry.stats()
+        db = self.db_writer.stats()
+        leds = self.tsm.actuators.stats()
+        simulated = self.clock.monotonic()
+        return {
+            "simulated_s": simulated,
+            "wall_s": round(elapsed, 3),
+            "speedup": round(simulated / elapsed) if elapsed else None,
+            "events": self.scheduler.executed,
+            "display_jobs": {name: job.runs for name, job in self.jobs.items()},
+            "idle_polls_skipped": self.idle_polls,
+            "lcd_frames": self.frames,
+            "lcd_cells_written": self.screen.framebuffer.cells_written,
+            "serial_frames": telemetry["frames_sent"],
+            "serial_bytes": telemetry["bytes_sent"],
+            "db_rows": db["rows_written"],
+            "db_commits": db["commits"],
+            "button_presses": sum(b.presses for b in self.hardware.buttons().values()),
+            "led_ops_applied": leds["applied"],
+            "led_ops_skipped": leds["skipped"],
+            "final_state": self.tsm.current_state_value,
+            "final_temp_f": round(self.sampler.latest().smoothed, 2),
+        }
+
+
+def replay(hours=2.0, seed=1, db_path=":memory:", config=None):
+    harness = ReplayHarness(config, db_path=db_path, seed=seed)
+    elapsed = harness.run(hours * 3600)
+    digest = harness.finish()
+    report = harness.report(elapsed)
+    report["digest"] = digest
+    harness.conn.close()
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay thermostat operation in virtual time")
+    parser.add_argument("--hours", type=float, default=2.0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--db", default=":memory:")
+    parser.add_argument("--config", help="config.json to take filter/telemetry settings from")
+    parser.add_argument("--repeat", type=int, default=1,
+                        help="run several times and check the digests match")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    config = None
+    if args.config:
+        with open(args.config, 'r') as config_file:
+            config = json.load(config_file)
+
+    digests = set()
+    for _ in range(args.repeat):
+        report = replay(args.hours, args.seed, args.db, config)
+        digests.add(report["digest"])
+        print(json.dumps(report))
+    if len(digests) > 1:
+        print("Replays diverged: digests differ between runs")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
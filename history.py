@@ -0,0 +1,188 @@
+# history.py - Streaming access to the logged temperature history
+# query_temperature_data used to fetchall() the whole result and print it. These
+# helpers stream rows with fetchmany() in fixed-size chunks, page through them
+# with keyset pagination (no OFFSET scans), and export to CSV, JSON Lines or a
+# NumPy .npy structured array, all in constant memory. Months moved to the
+# cold archive (see archive.py) are merged in transparently.
+#
+#     python history.py export --format csv --out readings.csv [--start ...] [--end ...] [--state heat]
+import argparse
+import csv
+import heapq
+import json
+import sqlite3
+import sys
+from itertools import islice
+
+from archive import archived_readings
+from schema import readings_query
+
+DEFAULT_CHUNK = 1000
+
+# Structured dtype for .npy exports: the v2 storage layout
+NPY_FIELDS = [("ts", "<i8"), ("state", "u1"), ("temp_tenths", "<i2"), ("set_point", "<i2")]
+
+
+# === Generator API ===
+# Yields lists of up to chunk_size rows: v1-shaped (timestamp, state, temperature,
+# set_point) tuples, or (ts, state code, temp_tenths, set_point) with
+# layout="v2", in time order.
+def iter_reading_chunks(conn, start_date=None, end_date=None, state_filter=None,
+                        chunk_size=DEFAULT_CHUNK, layout="v1"):
+    cold = archived_readings(conn, start_date, end_date, state_filter, layout)
+    if cold is not None:
+        hot = iter_hot_readings(conn, start_date, end_date, state_filter, chunk_size, layout)
+        rows = heapq.merge(cold, hot, key=lambda row: row[0])
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            if not chunk:
+                return
+            yield chunk
+    yield from iter_hot_reading_chunks(conn, start_date, end_date, state_filter, chunk_size, layout)
+
+
+# Only what is still in SQLite
+def iter_hot_reading_chunks(conn, start_date=None, end_date=None, state_filter=None,
+                            chunk_size=DEFAULT_CHUNK, layout="v1"):
+    query, params = readings_query(conn, start_date, end_date, state_filter, layout=layout)
+    cursor = conn.cursor()
+    try:
+        cursor.execute(query, params)
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield rows
+    finally:
+        cursor.close()
+
+
+def iter_hot_readings(conn, start_date=None, end_date=None, state_filter=None,
+                      chunk_size=DEFAULT_CHUNK, layout="v1"):
+    for rows in iter_hot_reading_chunks(conn, start_date, end_date, state_filter, chunk_size, layout):
+        yield from rows
+
+
+# Same rows one at a time
+def iter_readings(conn, start_date=None, end_date=None, state_filter=None,
+                  chunk_size=DEFAULT_CHUNK, layout="v1"):
+    for rows in iter_reading_chunks(conn, start_date, end_date, state_filter, chunk_size, layout):
+        yield from rows
+
+
+# === Keyset pagination ===
+# Returns (rows, next_page). Pass next_page back as after= to get the following
+# page; it is None once the last page has been returned. Each page is an index
+# range scan, so page 1000 costs the same as page 1. Pages only cover rows still
+# in SQLite, not archived months.
+def page_readings(conn, after=None, limit=500, start_date=None, end_date=None,
+                  state_filter=None, layout="v1"):
+    query, params = readings_query(conn, start_date, end_date, state_filter, layout=layout,
+                                   after=after, limit=limit, with_key=True)
+    rows = conn.execute(query, params).fetchall()
+    next_page = tuple(rows[-1][-2:]) if len(rows) == limit else None
+    return [row[:-2] for row in rows], next_page
+
+
+# === Export sinks ===
+# Each takes an open text/binary file and an iterable of chunks; returns rows written.
+def export_csv(chunks, out):
+    writer = csv.writer(out)
+    writer.writerow(["timestamp", "state", "temperature", "set_point"])
+    count = 0
+    for rows in chunks:
+        writer.writerows(rows)
+        count += len(rows)
+    return count
+
+
+def export_jsonl(chunks, out):
+    count = 0
+    for rows in chunks:
+        out.write("".join(
+            json.dumps({"timestamp": r[0], "state": r[1], "temperature": r[2], "set_point": r[3]}) + "\n"
+            for r in rows))
+        count += len(rows)
+    return count
+
+
+# Expects v2-layout chunks. The .npy header needs the row count, which is only
+# known at the end, so a header sized for the largest possible count is written
+# first and rewritten in place once streaming is done.
+def export_npy(chunks, out):
+    import numpy as np
+    dtype = np.dtype(NPY_FIELDS)
+
+    def header(count):
+        descr = np.lib.format.dtype_to_descr(dtype)
+        return f"{{'descr': {descr!r}, 'fortran_order': False, 'shape': ({count},), }}"
+
+    width = len(header(10 ** 18))
+
+    def write_header(count):
+        text = header(count).ljust(width)
+        # magic + version + length field + header text + newline, padded to 64 bytes
+        total = 10 + width + 1
+        text += " " * (-total % 64) + "\n"
+        out.write(b"\x93NUMPY\x01\x00" + len(text).to_bytes(2, "little") + text.encode("latin1"))
+
+    start = out.tell()
+    write_header(0)
+    count = 0
+    for rows in chunks:
+        np.array(rows, dtype=dtype).tofile(out)
+        count += len(rows)
+    end = out.tell()
+    out.seek(start)
+    write_header(count)
+    out.seek(end)
+    return count
+
+
+# Load a (possibly filtered) history into a structured array in one pass
+def readings_array(conn, start_date=None, end_date=None, state_filter=None, chunk_size=10000):
+    import numpy as np
+    dtype = np.dtype(NPY_FIELDS)
+    parts = [np.array(rows, dtype=dtype) for rows in iter_reading_chunks(
+        conn, start_date, end_date, state_filter, chunk_size, layout="v2")]
+    return np.concatenate(parts) if parts else np.empty(0, dtype=dtype)
+
+
+def export(conn, fmt, out_path, start_date=None, end_date=None, state_filter=None,
+           chunk_size=DEFAULT_CHUNK):
+    layout = "v2" if fmt == "npy" else "v1"
+    chunks = iter_reading_chunks(conn, start_date, end_date, state_filter, chunk_size, layout)
+    if fmt == "npy":
+        with open(out_path, "wb") as out:
+            return export_npy(chunks, out)
+    sink = export_csv if fmt == "csv" else export_jsonl
+    if out_path == "-":
+        return sink(chunks, sys.stdout)
+    with open(out_path, "w", newline="") as out:
+        return sink(chunks, out)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export temperature_readings history")
+    parser.add_argument("command", choices=["export"])
+    parser.add_argument("db", nargs="?", default="temperature_log.db")
+    parser.add_argument("--format", choices=["csv", "jsonl", "npy"], default="csv")
+    parser.add_argument("--out", default="-", help="output file ('-' for stdout, not for npy)")
+    parser.add_argument("--start")
+    parser.add_argument("--end")
+    parser.add_argument("--state", choices=["heat", "cool", "off"])
+    parser.add_argument("--chunk", type=int, default=DEFAULT_CHUNK)
+    args = parser.parse_args(argv)
+    if args.format == "npy" and args.out == "-":
+        parser.error("--out is required for npy exports")
+
+    conn = sqlite3.connect(args.db)
+    try:
+        count = export(conn, args.format, args.out, args.start, args.end, args.state, args.chunk)
+    finally:
+        conn.close()
+    print(f"Exported {count} rows", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
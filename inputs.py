@@ -0,0 +1,144 @@
+# inputs.py - Debounced, coalescing button input queue
+# Button callbacks used to run processTempIncButton/processTempDecButton
+# directly on gpiozero's threads: every press did a sensor read and an LED
+# off/on cycle, mashing or holding a button queued a burst of them, and the
+# set point was updated from several threads at once.
+#
+# Now callbacks only record an event here (cheap and thread-safe). The
+# thermostat drains the queue from its own loop: every press and auto-repeat
+# gathered during a short coalescing window is folded into one net set-point
+# delta and a net number of state cycles, and applied with a single actuation.
+#
+# Holding increase/decrease auto-repeats (gpiozero when_held with hold_repeat),
+# and the step grows the longer the button is held.
+import logging
+import threading
+from collections import deque
+
+from clock import SYSTEM_CLOCK
+
+# (seconds held, set-point step per repeat), in ascending order of hold time
+DEFAULT_REPEAT_STEPS = ((0.0, 1), (2.0, 2), (4.0, 5))
+
+SET_POINT_BUTTONS = {"increase": 1, "decrease": -1}
+STATE_CYCLE_LENGTH = 3
+
+
+class ButtonInputQueue():
+    # debounce: presses of the same button closer together than this are
+    # contact bounce; window: how long after the first event of a batch to wait
+    # for more before it is applied; max_events: bound on queued events.
+    def __init__(self, debounce=0.05, window=0.15, max_events=64,
+                 repeat_steps=DEFAULT_REPEAT_STEPS, clock=SYSTEM_CLOCK):
+        self.debounce = debounce
+        self.window = window
+        self.repeat_steps = tuple(tuple(step) for step in repeat_steps)
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.events = deque()
+        self.max_events = max_events
+        self.last_press = {}
+
+        self.presses = 0
+        self.repeats = 0
+        self.bounced = 0
+        self.overflowed = 0
+        self.batches = 0
+        self.applied = 0
+
+    def add(self, name, step, now):
+        if len(self.events) >= self.max_events:
+            self.overflowed += 1
+            return False
+        self.events.append((now, name, step))
+        return True
+
+    # gpiozero when_pressed
+    def press(self, name):
+        now = self.clock.monotonic()
+        with self.lock:
+            last = self.last_press.get(name)
+            if last is not None and now - last < self.debounce:
+                self.bounced += 1
+                return
+            self.last_press[name] = now
+            if self.add(name, SET_POINT_BUTTONS.get(name, 1), now):
+                self.presses += 1
+
+    # gpiozero when_held, called every hold_time while the button stays down
+    def hold(self, name, held_time):
+        if name not in SET_POINT_BUTTONS:
+            return
+        step = self.repeat_step(held_time or 0.0) * SET_POINT_BUTTONS[name]
+        with self.lock:
+            if self.add(name, step, self.clock.monotonic()):
+                self.repeats += 1
+
+    def repeat_step(self, held_time):
+        step = self.repeat_steps[0][1]
+        for threshold, value in self.repeat_steps:
+            if held_time >= threshold:
+                step = value
+        return step
+
+    def pending(self):
+        with self.lock:
+            return len(self.events)
+
+    # Once the oldest event is `window` old, take everything queued as one batch:
+    # returns (set-point delta, state cycles) or None if nothing is ready yet
+    def drain(self):
+        now = self.clock.monotonic()
+        with self.lock:
+            if not self.events or now - self.events[0][0] < self.window:
+                return None
+            events = list(self.events)
+            self.events.clear()
+        delta = sum(step for _, name, step in events if name in SET_POINT_BUTTONS)
+        cycles = sum(1 for _, name, _ in events if name == "state") % STATE_CYCLE_LENGTH
+        self.batches += 1
+        self.applied += len(events)
+        if len(events) > 1:
+            logging.debug("Coalesced %d button events into delta %+d, %d cycles", len(events), delta, cycles)
+        return delta, cycles
+
+    def stats(self):
+        with self.lock:
+            return {
+                "presses": self.presses,
+                "repeats": self.repeats,
+                "bounced": self.bounced,
+                "overflowed": self.overflowed,
+                "batches": self.batches,
+                "applied": self.applied,
+                "pending": len(self.events),
+            }
+
+
+# Zero-argument handler for gpiozero's when_pressed/when_held. gpiozero inspects
+# a handler's signature to decide what to pass it, which functools.partial
+# objects don't support, so bind the arguments in a plain closure instead.
+def button_handler(fn, *args):
+    def handler():
+        fn(*args)
+    return handler
+
+
+# when_held handler calling fn(*args, held_time). held_time is read when gpiozero
+# calls it, on gpiozero's thread: a call handed on to the event loop runs later,
+# when the button may have been released and its held_time reset to None.
+def hold_handler(button, fn, *args):
+    def handler():
+        fn(*args, button.held_time)
+    return handler
+
+
+# === Build the queue from config.json ===
+def make_input_queue(config, clock=SYSTEM_CLOCK):
+    return ButtonInputQueue(
+        debounce=config.get("button_debounce", 0.05),
+        window=config.get("button_coalesce_window", 0.15),
+        max_events=config.get("button_max_events", 64),
+        repeat_steps=config.get("button_repeat_steps", DEFAULT_REPEAT_STEPS),
+        clock=clock
+    )
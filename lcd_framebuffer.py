@@ -0,0 +1,124 @@
+# lcd_framebuffer.py - Dirty-cell framebuffer for the 16x2 HD44780 character LCD
+# updateScreen used to clear() the panel and rewrite every cell each second.
+# On a bit-banged HD44780 the clear alone takes milliseconds and blanks the
+# panel (visible flicker), while usually only the seconds digit has changed.
+# The framebuffer keeps a shadow copy of what is on the glass, diffs each new
+# frame against it and sends only a cursor move plus the changed characters
+# for each run of dirty cells.
+#
+# Characters that are not in the HD44780 ROM (the degree sign) are drawn with
+# custom CGRAM glyphs, uploaded once and cached in one of the 8 glyph slots.
+
+# === Custom 5x8 glyphs ===
+DEGREE_GLYPH = [0b00110, 0b01001, 0b01001, 0b00110, 0b00000, 0b00000, 0b00000, 0b00000]
+CUSTOM_GLYPHS = {"°": DEGREE_GLYPH}
+GLYPH_SLOTS = 8
+
+# An unchanged cell costs one data write to carry through, the same as the
+# cursor-address command needed to skip it, so runs separated by a gap this
+# small are merged into a single write.
+MERGE_GAP = 1
+
+
+class LcdFramebuffer():
+    def __init__(self, lcd, columns=16, rows=2, glyphs=None):
+        self.lcd = lcd
+        self.columns = columns
+        self.rows = rows
+        self.glyphs = CUSTOM_GLYPHS if glyphs is None else glyphs
+        # char -> CGRAM slot, in least-recently-used order (oldest first)
+        self.glyph_slots = {}
+        # What is currently on the glass; None means unknown and forces a redraw
+        self.shown = [None] * rows
+
+        self.frames = 0
+        self.cells_written = 0
+        self.cursor_moves = 0
+        self.glyph_uploads = 0
+
+    # Clear the panel and record that every cell is blank
+    def clear(self):
+        self.lcd.clear()
+        self.shown = [[" "] * self.columns for _ in range(self.rows)]
+
+    # Forget the shadow copy so the next render redraws everything
+    def invalidate(self):
+        self.shown = [None] * self.rows
+
+    # Map a character to something the panel can display, uploading its glyph if needed
+    def encode(self, char):
+        pattern = self.glyphs.get(char)
+        if pattern is None:
+            return char
+        slot = self.glyph_slots.pop(char, None)
+        if slot is None:
+            if len(self.glyph_slots) >= GLYPH_SLOTS:
+                evicted, slot = next(iter(self.glyph_slots.items()))
+                del self.glyph_slots[evicted]
+                # Cells showing the old glyph would silently change; mark them dirty
+                old = chr(slot)
+                for row in self.shown:
+                    if row is not None:
+                        for col, cell in enumerate(row):
+                            if cell == old:
+                                row[col] = None
+            else:
+                slot = len(self.glyph_slots)
+            self.lcd.create_char(slot, pattern)
+            self.glyph_uploads += 1
+        self.glyph_slots[char] = slot
+        return chr(slot)
+
+    def frame_lines(self, message):
+        lines = message.split("\n")[:self.rows]
+        lines += [""] * (self.rows - len(lines))
+        frame = []
+        for line in lines:
+            line = line[:self.columns].ljust(self.columns)
+            # Most lines hold no custom glyph; only those pay for per-character encoding
+            for char in self.glyphs:
+                if char in line:
+                    line = line.replace(char, self.encode(char))
+            frame.append(list(line))
+        return frame
+
+    # Runs of changed columns as (start, end) pairs, end exclusive
+    def dirty_runs(self, old, new):
+        if old == new:
+            return []
+        runs = []
+        for col in range(self.columns):
+            if old is not None and old[col] == new[col]:
+                continue
+            if runs and col - runs[-1][1] <= MERGE_GAP:
+                runs[-1][1] = col + 1
+            else:
+                runs.append([col, col + 1])
+        return runs
+
+    def render(self, message):
+        frame = self.frame_lines(message)
+        try:
+            for row, new in enumerate(frame):
+                old = self.shown[row]
+                for start, end in self.dirty_runs(old, new):
+                    self.lcd.cursor_position(start, row)
+                    self.lcd.message = "".join(new[start:end])
+                    self.cursor_moves += 1
+                    self.cells_written += end - start
+                self.shown[row] = new
+        except Exception:
+            # Part of the frame may have been written; redraw everything next time
+            self.invalidate()
+            raise
+        self.frames += 1
+
+    def stats(self):
+        frames = self.frames or 1
+        return {
+            "frames": self.frames,
+            "cells_written": self.cells_written,
+            "cursor_moves": self.cursor_moves,
+            "glyph_uploads": self.glyph_uploads,
+            "cells_per_frame": round(self.cells_written / frames, 2),
+        }
@@ -0,0 +1,222 @@
+# log_pipeline.py - Non-blocking logging with rotation and a flight recorder
+# basicConfig(filename='thermostat.log') formatted every record and wrote it to
+# the SD card on the thread that logged it (the display loop, the button
+# handlers), and the file grew without bound.
+#
+# Now the root logger only has a QueueHandler: a record is put on an in-memory
+# queue as-is, without formatting its message, and a QueueListener thread does
+# the rest:
+#   - a size-rotated log file, where repetitive DEBUG records are rate-limited
+#     per message template (token bucket, with 1-in-N sampling of the excess)
+#   - a flight recorder: a fixed-size ring of the most recent records of every
+#     level, dumped as JSON lines only when an ERROR is logged or on a signal
+#     (SIGUSR1 by default), so the lead-up to a failure is on disk without
+#     writing every DEBUG record there all the time
+#
+# Log calls on hot paths pass their arguments %-style so the message is only
+# built if a handler actually writes it.
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import signal
+import threading
+import time
+from collections import deque
+
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+
+# === Producer side: enqueue records unformatted ===
+# The stock QueueHandler formats each record before queuing it so it can be
+# pickled; everything here stays in-process, so formatting waits for the listener.
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        return record
+
+
+# === Per-template DEBUG rate limit for the log file ===
+class DebugRateLimit(logging.Filter):
+    # rate: records per second allowed per message template, up to burst at once;
+    # sample_every: of the records over the limit, keep every Nth (0 drops them all)
+    def __init__(self, rate=1.0, burst=10, sample_every=0, clock=time.monotonic):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self.sample_every = sample_every
+        self.clock = clock
+        # message template -> [tokens, last refill, records over the limit]
+        self.buckets = {}
+        self.suppressed = 0
+        self.sampled = 0
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG:
+            return True
+        now = self.clock()
+        bucket = self.buckets.get(record.msg)
+        if bucket is None:
+            bucket = self.buckets[record.msg] = [self.burst, now, 0]
+        bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[1] = now
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            return True
+        bucket[2] += 1
+        if self.sample_every and bucket[2] % self.sample_every == 0:
+            self.sampled += 1
+            return True
+        self.suppressed += 1
+        return False
+
+
+# === Ring of recent records, dumped to disk on error or on request ===
+class FlightRecorder(logging.Handler):
+    def __init__(self, path, capacity=2000, min_interval=60.0, clock=time.monotonic):
+        super().__init__(logging.DEBUG)
+        self.path = path
+        self.ring = deque(maxlen=capacity)
+        self.min_interval = min_interval
+        self.clock = clock
+        self.last_dump = None
+        self.dumps = 0
+
+    def emit(self, record):
+        self.ring.append(record)
+        if record.levelno >= logging.ERROR:
+            now = self.clock()
+            # One dump per burst of errors; the ring keeps collecting in between
+            if self.last_dump is None or now - self.last_dump >= self.min_interval:
+                self.dump(f"{record.levelname}: {record.getMessage()}")
+
+    def event(self, record):
+        try:
+            message = record.getMessage()
+        except Exception:
+            message = str(record.msg)
+        return {
+            "ts": round(record.created, 6),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "message": message,
+        }
+
+    def dump(self, reason):
+        self.last_dump = self.clock()
+        records = list(self.ring)
+        try:
+            with open(self.path, 'a') as out:
+                out.write(json.dumps({"dump": reason, "at": round(time.time(), 6),
+                                      "events": len(records)}) + "\n")
+                for record in records:
+                    out.write(json.dumps(self.event(record)) + "\n")
+        except Exception as e:
+            # Reported through logging's own error hook: logging from here would loop
+            self.handleError(logging.makeLogRecord({"msg": f"Flight recorder dump failed: {e}"}))
+            return
+        self.dumps += 1
+
+
+# A queued request for the listener to dump the flight recorder
+class DumpRequest(logging.LogRecord):
+    def __init__(self, reason):
+        super().__init__("log_pipeline", logging.NOTSET, __file__, 0, reason, None, None)
+
+
+class RecorderListener(logging.handlers.QueueListener):
+    def __init__(self, queue, recorder, *handlers):
+        super().__init__(queue, recorder, *handlers, respect_handler_level=True)
+        self.recorder = recorder
+
+    def handle(self, record):
+        if isinstance(record, DumpRequest):
+            self.recorder.dump(record.msg)
+            return
+        super().handle(record)
+
+
+class LogPipeline():
+    def __init__(self, filename='thermostat.log', level=logging.DEBUG, file_level=logging.DEBUG,
+                 max_bytes=1_000_000, backup_count=3, debug_rate=1.0, debug_burst=10,
+                 debug_sample_every=0, recorder_path='flight_recorder.jsonl',
+                 recorder_capacity=2000, recorder_min_interval=60.0):
+        # SimpleQueue.put is reentrant, so request_dump() is safe from a signal handler
+        self.queue = queue.SimpleQueue()
+        self.file_handler = logging.handlers.RotatingFileHandler(
+            filename, maxBytes=max_bytes, backupCount=backup_count)
+        self.file_handler.setLevel(file_level)
+        self.file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+        self.rate_limit = DebugRateLimit(debug_rate, debug_burst, debug_sample_every)
+        self.file_handler.addFilter(self.rate_limit)
+        self.recorder = FlightRecorder(recorder_path, recorder_capacity, recorder_min_interval)
+        self.listener = RecorderListener(self.queue, self.recorder, self.file_handler)
+        self.handler = LazyQueueHandler(self.queue)
+        self.level = level
+        self.lock = threading.Lock()
+        self.started = False
+
+    # Route the root logger through the queue and start the listener thread
+    def start(self):
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(self.handler)
+        root.setLevel(self.level)
+        # Nothing here uses the process fields; skip collecting them on every record
+        logging.logProcesses = False
+        logging.logMultiprocessing = False
+        self.listener.start()
+        self.started = True
+        atexit.register(self.close)
+        return self
+
+    def request_dump(self, reason="requested"):
+        self.queue.put(DumpRequest(reason))
+
+    # Dump the flight recorder whenever the process receives signum
+    def install_signal(self, signum):
+        def handler(received, frame):
+            self.request_dump(f"signal {signal.Signals(received).name}")
+        signal.signal(signum, handler)
+
+    # Detach from the root logger, then write out everything still queued
+    def close(self):
+        with self.lock:
+            if not self.started:
+                return
+            self.started = False
+        logging.getLogger().removeHandler(self.handler)
+        self.listener.stop()
+        self.file_handler.close()
+
+    def stats(self):
+        return {
+            "queued": self.queue.qsize(),
+            "debug_suppressed": self.rate_limit.suppressed,
+            "debug_sampled": self.rate_limit.sampled,
+            "recorder_events": len(self.recorder.ring),
+            "recorder_dumps": self.recorder.dumps,
+        }
+
+
+# === Build and start the pipeline from config.json ===
+def setup_logging(config, filename='thermostat.log'):
+    pipeline = LogPipeline(
+        filename=filename,
+        level=logging.getLevelName(config.get("log_level", "DEBUG")),
+        file_level=logging.getLevelName(config.get("log_file_level", "DEBUG")),
+        max_bytes=config.get("log_max_bytes", 1_000_000),
+        backup_count=config.get("log_backup_count", 3),
+        debug_rate=config.get("log_debug_rate", 1.0),
+        debug_burst=config.get("log_debug_burst", 10),
+        debug_sample_every=config.get("log_debug_sample_every", 0),
+        recorder_path=config.get("flight_recorder_path", "flight_recorder.jsonl"),
+        recorder_capacity=config.get("flight_recorder_size", 2000),
+        recorder_min_interval=config.get("flight_recorder_min_interval", 60.0)
+    ).start()
+    dump_signal = config.get("flight_recorder_signal", "SIGUSR1")
+    if dump_signal:
+        pipeline.install_signal(getattr(signal, dump_signal))
+    return pipeline
@@ -0,0 +1,204 @@
+# migrate.py - Online, resumable conversion of temperature_log.db from schema v1 to v2
+# Rows are copied from temperature_readings into the compact readings table in
+# small rowid-ordered chunks, each in its own short transaction, with a pause in
+# between so the logger's writer thread is never locked out for long. Progress is
+# recorded in schema_migration, so an interrupted run picks up where it stopped.
+# Once the copy has caught up, a single transaction swaps temperature_readings
+# for the v2 compatibility view; a logger that is still running keeps inserting
+# through it without noticing.
+#
+#     python migrate.py temperature_log.db [--chunk 5000] [--pause 0.05] [--drop-old] [--vacuum]
+#     python migrate.py compare temperature_log.db
+import argparse
+import logging
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+
+from rollups import create_rollup_objects
+from schema import (SCHEMA_V1, SCHEMA_V2, V2_INDEX_DDL, V2_TABLE_DDL, readings_query,
+                    schema_version, v1_to_v2_exprs, v2_compat_view_ddl)
+
+MIGRATION_NAME = "v1_to_v2"
+PROGRESS_DDL = '''
+    CREATE TABLE IF NOT EXISTS schema_migration (
+        name TEXT PRIMARY KEY,
+        last_rowid INTEGER NOT NULL,
+        copied INTEGER NOT NULL,
+        skipped INTEGER NOT NULL
+    )
+'''
+
+
+def connect(db_path):
+    # Autocommit mode so every transaction below is explicit
+    return sqlite3.connect(db_path, isolation_level=None, timeout=30)
+
+
+# Copy v1 rows with rowid in (last_rowid, last_rowid + chunk]. Returns the new
+# last rowid, how many rows were read and how many were actually inserted.
+# Rows that cannot be converted, or repeat an existing second, are skipped.
+def copy_chunk(conn, last_rowid, chunk_size):
+    upper = conn.execute(
+        "SELECT MAX(rowid) FROM (SELECT rowid FROM temperature_readings "
+        "WHERE rowid > ? ORDER BY rowid LIMIT ?)", (last_rowid, chunk_size)
+    ).fetchone()[0]
+    if upper is None:
+        return last_rowid, 0, 0
+
+    exprs = v1_to_v2_exprs()
+    read = conn.execute(
+        "SELECT COUNT(*) FROM temperature_readings WHERE rowid > ? AND rowid <= ?",
+        (last_rowid, upper)
+    ).fetchone()[0]
+    cur = conn.execute(f'''
+        INSERT INTO readings (ts, state, temp_tenths, set_point)
+        SELECT {exprs["ts"]}, {exprs["state"]}, {exprs["temp_tenths"]}, {exprs["set_point"]}
+        FROM temperature_readings
+        WHERE rowid > ? AND rowid <= ?
+          AND {exprs["ts"]} IS NOT NULL AND {exprs["state"]} IS NOT NULL
+        ON CONFLICT(ts) DO NOTHING
+    ''', (last_rowid, upper))
+    return upper, read, cur.rowcount
+
+
+# Runs while holding the write lock, after the last chunk has been copied
+def cut_over(conn, drop_old):
+    conn.execute("DROP TRIGGER IF EXISTS trg_temperature_rollups")
+    conn.execute("ALTER TABLE temperature_readings RENAME TO temperature_readings_v1")
+    for ddl in V2_INDEX_DDL:
+        conn.execute(ddl)
+    for ddl in v2_compat_view_ddl():
+        conn.execute(ddl)
+    conn.execute(f"PRAGMA user_version = {SCHEMA_V2}")
+    # Rollups now follow the readings table
+    create_rollup_objects(conn)
+    if drop_old:
+        conn.execute("DROP TABLE temperature_readings_v1")
+
+
+def migrate(db_path, chunk_size=5000, pause=0.05, drop_old=False, vacuum=False):
+    conn = connect(db_path)
+    try:
+        version = schema_version(conn)
+        if version == SCHEMA_V2:
+            logging.info(f"{db_path} is already on schema v2")
+            return {"copied": 0, "skipped": 0, "seconds": 0.0}
+        if version != SCHEMA_V1:
+            raise ValueError(f"{db_path} has no temperature_readings table to migrate")
+
+        conn.execute(V2_TABLE_DDL)
+        conn.execute(PROGRESS_DDL)
+        conn.execute("INSERT OR IGNORE INTO schema_migration VALUES (?, 0, 0, 0)", (MIGRATION_NAME,))
+
+        start = time.perf_counter()
+        while True:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                last_rowid, copied, skipped = conn.execute(
+                    "SELECT last_rowid, copied, skipped FROM schema_migration WHERE name = ?",
+                    (MIGRATION_NAME,)
+                ).fetchone()
+                last_rowid, read, inserted = copy_chunk(conn, last_rowid, chunk_size)
+                copied += inserted
+                skipped += read - inserted
+                conn.execute(
+                    "UPDATE schema_migration SET last_rowid = ?, copied = ?, skipped = ? WHERE name = ?",
+                    (last_rowid, copied, skipped, MIGRATION_NAME)
+                )
+                caught_up = read == 0
+                if caught_up:
+                    cut_over(conn, drop_old)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+            if caught_up:
+                break
+            logging.info(f"Migrated {copied} rows (up to rowid {last_rowid})")
+            time.sleep(pause)
+
+        if vacuum:
+            conn.execute("VACUUM")
+        elapsed = time.perf_counter() - start
+        logging.info(f"Migration to schema v2 finished: {copied} rows copied, "
+                     f"{skipped} skipped in {elapsed:.1f} s")
+        return {"copied": copied, "skipped": skipped, "seconds": elapsed}
+    finally:
+        conn.close()
+
+
+# === Before/after comparison on a throwaway copy of the database ===
+def measure(db_path, repeat=5):
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.execute("PRAGMA journal_mode=DELETE")
+        conn.execute("VACUUM")
+        newest = conn.execute("SELECT MAX(timestamp) FROM temperature_readings").fetchone()[0]
+        day_before = conn.execute("SELECT datetime(?, '-1 day')", (newest,)).fetchone()[0]
+        queries = {
+            "last_day": readings_query(conn, start_date=day_before),
+            "state_heat": readings_query(conn, state_filter="heat"),
+            "all_rows": readings_query(conn),
+        }
+        timings = {}
+        for name, (sql, params) in queries.items():
+            best = None
+            for _ in range(repeat):
+                start = time.perf_counter()
+                rows = conn.execute(sql, params).fetchall()
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            timings[name] = (len(rows), best * 1000.0)
+    finally:
+        conn.close()
+    return os.path.getsize(db_path), timings
+
+
+def compare(db_path, chunk_size=5000):
+    workdir = tempfile.mkdtemp(prefix="thermostat-migrate-")
+    try:
+        before_path = os.path.join(workdir, "before.db")
+        after_path = os.path.join(workdir, "after.db")
+        source = sqlite3.connect(db_path)
+        target = sqlite3.connect(before_path)
+        source.backup(target)
+        source.close()
+        target.close()
+        shutil.copyfile(before_path, after_path)
+
+        before_size, before_times = measure(before_path)
+        migrate(after_path, chunk_size=chunk_size, pause=0, drop_old=True)
+        after_size, after_times = measure(after_path)
+
+        print(f"File size: v1 {before_size / 1024:.0f} KiB, v2 {after_size / 1024:.0f} KiB "
+              f"({after_size / before_size:.0%})")
+        print("Query\t\tRows\tv1 ms\tv2 ms")
+        for name, (rows, v1_ms) in before_times.items():
+            print(f"{name:<12}\t{rows}\t{v1_ms:.2f}\t{after_times[name][1]:.2f}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert temperature_log.db to schema v2")
+    parser.add_argument("args", nargs="+", metavar="[compare] db")
+    parser.add_argument("--chunk", type=int, default=5000)
+    parser.add_argument("--pause", type=float, default=0.05)
+    parser.add_argument("--drop-old", action="store_true",
+                        help="drop the renamed v1 table once the cut-over is done")
+    parser.add_argument("--vacuum", action="store_true", help="VACUUM after migrating")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    if args.args[0] == "compare":
+        compare(args.args[1] if len(args.args) > 1 else "temperature_log.db", args.chunk)
+    else:
+        migrate(args.args[0], args.chunk, args.pause, args.drop_old, args.vacuum)
+
+
+if __name__ == "__main__":
+    main()
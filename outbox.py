@@ -0,0 +1,95 @@
+# outbox.py - Disk-backed store-and-forward queue for telemetry samples
+# When the UART link (or whatever sits behind it) is down, TelemetryWriter parks
+# samples here instead of dropping them, and replays the backlog oldest-first in
+# batched bursts once writes succeed again. The outbox lives in its own SQLite
+# file so it never contends with the temperature logger for locks, and is capped
+# in size: past the cap the oldest samples are evicted.
+import logging
+import sqlite3
+import threading
+
+OUTBOX_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+)
+
+
+class TelemetryOutbox():
+    def __init__(self, db_path, max_samples=100000):
+        self.db_path = db_path
+        self.max_samples = max_samples
+        # Opened here but used from the telemetry thread; access is serialized by the lock
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.lock = threading.Lock()
+        for pragma in OUTBOX_PRAGMAS:
+            self.conn.execute(pragma)
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY,
+                ts INTEGER NOT NULL,
+                state TEXT NOT NULL,
+                temp_tenths INTEGER NOT NULL,
+                set_point INTEGER NOT NULL
+            )
+        ''')
+        self.conn.commit()
+        self.depth = self.conn.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+        self.stored = 0
+        self.evicted = 0
+        self.acked = 0
+        if self.depth:
+            logging.info(f"Telemetry outbox has {self.depth} samples waiting from a previous run")
+
+    def __len__(self):
+        return self.depth
+
+    # Durably append samples; evicts the oldest ones if the cap is exceeded
+    def push(self, samples):
+        with self.lock:
+            self.conn.executemany(
+                "INSERT INTO outbox (ts, state, temp_tenths, set_point) VALUES (?, ?, ?, ?)",
+                [tuple(sample) for sample in samples]
+            )
+            self.depth += len(samples)
+            self.stored += len(samples)
+            overflow = self.depth - self.max_samples
+            if overflow > 0:
+                self.conn.execute(
+                    "DELETE FROM outbox WHERE id IN (SELECT id FROM outbox ORDER BY id LIMIT ?)",
+                    (overflow,)
+                )
+                self.depth -= overflow
+                self.evicted += overflow
+            self.conn.commit()
+        if overflow > 0:
+            logging.warning(f"Telemetry outbox full, evicted {overflow} oldest samples")
+
+    # Oldest n samples as (last id, [(ts, state, temp_tenths, set_point), ...])
+    def peek(self, n):
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT id, ts, state, temp_tenths, set_point FROM outbox ORDER BY id LIMIT ?", (n,)
+            ).fetchall()
+        if not rows:
+            return None, []
+        return rows[-1][0], [row[1:] for row in rows]
+
+    # Remove everything up to and including last_id once it has been delivered
+    def ack(self, last_id):
+        with self.lock:
+            removed = self.conn.execute("DELETE FROM outbox WHERE id <= ?", (last_id,)).rowcount
+            self.conn.commit()
+            self.depth -= removed
+            self.acked += removed
+
+    def stats(self):
+        return {
+            "backlog": self.depth,
+            "stored": self.stored,
+            "evicted": self.evicted,
+            "replayed": self.acked,
+        }
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
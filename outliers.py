@@ -0,0 +1,212 @@
+# outliers.py - Streaming outlier rejection ahead of the smoothing filter
+# Keeps the last N raw readings in an indexable skiplist so the rolling median
+# and MAD (median absolute deviation) are available with O(log n) insert/evict.
+# A reading whose modified z-score 0.6745 * |x - median| / MAD exceeds the
+# threshold is dropped before it can drag the moving average around. Failed
+# sensor reads are counted as missing samples instead of being fed in as zeros.
+import logging
+import math
+import random
+from collections import deque
+
+
+# === Indexable skiplist (sorted multiset with O(log n) insert, remove and index) ===
+class SkiplistNode():
+    __slots__ = ("value", "next", "width")
+
+    def __init__(self, value, next, width):
+        self.value = value
+        self.next = next
+        self.width = width
+
+
+# Tail sentinel; samples are always finite so inf sorts after all of them
+NIL = SkiplistNode(math.inf, [], [])
+
+
+class IndexableSkiplist():
+    def __init__(self, expected_size=64):
+        self.size = 0
+        self.maxlevels = int(1 + math.log2(max(2, expected_size)))
+        self.top_down = tuple(reversed(range(self.maxlevels)))
+        self.head = SkiplistNode(None, [NIL] * self.maxlevels, [1] * self.maxlevels)
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, i):
+        if not 0 <= i < self.size:
+            raise IndexError("skiplist index out of range")
+        node = self.head
+        i += 1
+        for level in self.top_down:
+            width = node.width[level]
+            while width <= i:
+                i -= width
+                node = node.next[level]
+                width = node.width[level]
+        return node.value
+
+    def insert(self, value):
+        chain = [None] * self.maxlevels
+        steps_at_level = [0] * self.maxlevels
+        node = self.head
+        for level in reversed(range(self.maxlevels)):
+            while node.next[level].value <= value:
+                steps_at_level[level] += node.width[level]
+                node = node.next[level]
+            chain[level] = node
+
+        levels = 1
+        while levels < self.maxlevels and random.random() < 0.5:
+            levels += 1
+        new_node = SkiplistNode(value, [None] * levels, [None] * levels)
+        steps = 0
+        for level in range(levels):
+            prev_node = chain[level]
+            new_node.next[level] = prev_node.next[level]
+            prev_node.next[level] = new_node
+            new_node.width[level] = prev_node.width[level] - steps
+            prev_node.width[level] = steps + 1
+            steps += steps_at_level[level]
+        for level in range(levels, self.maxlevels):
+            chain[level].width[level] += 1
+        self.size += 1
+
+    def remove(self, value):
+        chain = [None] * self.maxlevels
+        node = self.head
+        for level in reversed(range(self.maxlevels)):
+            while node.next[level].value < value:
+                node = node.next[level]
+            chain[level] = node
+        if chain[0].next[0].value != value:
+            raise KeyError(value)
+
+        levels = len(chain[0].next[0].next)
+        for level in range(levels):
+            prev_node = chain[level]
+            prev_node.width[level] += prev_node.next[level].width[level] - 1
+            prev_node.next[level] = prev_node.next[level].next[level]
+        for level in range(levels, self.maxlevels):
+            chain[level].width[level] -= 1
+        self.size -= 1
+
+
+# === k-th smallest (0-based) of two ascending sequences given by accessor functions ===
+# Binary search over how many items come from the first sequence: O(log n) probes.
+def kth_of_two_sorted(a, a_len, b, b_len, k):
+    lo, hi = max(0, k + 1 - b_len), min(k + 1, a_len)
+    while lo < hi:
+        i = (lo + hi) // 2
+        if a(i) < b(k - i):
+            lo = i + 1
+        else:
+            hi = i
+    i, j = lo, k + 1 - lo
+    if i == 0:
+        return b(j - 1)
+    if j == 0:
+        return a(i - 1)
+    return max(a(i - 1), b(j - 1))
+
+
+# === Rolling median / MAD outlier filter ===
+class OutlierFilter():
+    # window: number of recent raw readings kept; threshold: modified z-score cut-off;
+    # min_samples: readings needed before anything is rejected; min_mad: floor on
+    # the MAD so a run of identical readings doesn't make every change an outlier.
+    def __init__(self, window=15, threshold=3.5, min_samples=5, min_mad=0.1):
+        if window < 3:
+            raise ValueError("window must be at least 3")
+        self.window = window
+        self.threshold = threshold
+        self.min_samples = min(min_samples, window)
+        self.min_mad = min_mad
+        self.order = deque()
+        self.sorted = IndexableSkiplist(expected_size=window)
+
+        self.accepted = 0
+        self.rejected = 0
+        self.missing = 0
+
+    def median(self):
+        n = len(self.sorted)
+        if n == 0:
+            return None
+        mid = n // 2
+        if n % 2:
+            return self.sorted[mid]
+        return (self.sorted[mid - 1] + self.sorted[mid]) / 2
+
+    # Deviations below the median, read right-to-left, and above it, read left-to-right,
+    # are each already ascending, so the MAD is a k-th-of-two-sorted-sequences lookup.
+    def mad(self, med=None):
+        n = len(self.sorted)
+        if n == 0:
+            return None
+        if med is None:
+            med = self.median()
+        mid = n // 2
+        values = self.sorted
+
+        def below(i):
+            return med - values[mid - 1 - i]
+
+        def above(j):
+            return values[mid + j] - med
+
+        k = n // 2
+        upper = kth_of_two_sorted(below, mid, above, n - mid, k)
+        if n % 2:
+            return upper
+        lower = kth_of_two_sorted(below, mid, above, n - mid, k - 1)
+        return (lower + upper) / 2
+
+    # Record a failed or absent read; it never enters the window
+    def mark_missing(self):
+        self.missing += 1
+
+    # Returns True if the sample should be passed on to the smoothing filter
+    def accept(self, sample):
+        if sample is None or not math.isfinite(sample):
+            self.mark_missing()
+            return False
+
+        is_outlier = False
+        if len(self.sorted) >= self.min_samples:
+            med = self.median()
+            # The spread is at least min_mad, so a sample this close to the
+            # median passes whatever the MAD is; most do, and skip computing it
+            if 0.6745 * abs(sample - med) > self.threshold * self.min_mad:
+                spread = max(self.mad(med), self.min_mad)
+                score = 0.6745 * abs(sample - med) / spread
+                is_outlier = score > self.threshold
+                if is_outlier:
+                    logging.debug("Rejected outlier %.2f (median %.2f, score %.1f)", sample, med, score)
+
+        # Every valid reading enters the window, so a genuine step change becomes
+        # the new median after half a window instead of being rejected forever.
+        self.order.append(sample)
+        self.sorted.insert(sample)
+        if len(self.order) > self.window:
+            self.sorted.remove(self.order.popleft())
+
+        if is_outlier:
+            self.rejected += 1
+            return False
+        self.accepted += 1
+        return True
+
+    def stats(self):
+        return {"accepted": self.accepted, "rejected": self.rejected, "missing": self.missing}
+
+
+# === Build the outlier stage from config.json ===
+def make_outlier_filter(config):
+    return OutlierFilter(
+        window=config.get("outlier_window", 15),
+        threshold=config.get("outlier_threshold", 3.5),
+        min_samples=config.get("outlier_min_samples", 5),
+        min_mad=config.get("outlier_min_mad", 0.1)
+    )
@@ -0,0 +1,399 @@
+# pwm.py - Precomputed multi-channel PWM waveform engine
+# "PWM Original Code.py" fades GPIO 18 by calling ChangeDutyCycle and then
+# sleep(0.1) for each of 21 steps up and 21 down. Every step lasts 0.1 s plus
+# whatever the call and the wake-up cost, so the fade drifts and jitters, and
+# each extra channel needs a loop of its own.
+#
+# Here a waveform is one period of duty cycles computed up front from a curve
+# (linear, sine, breathing, or custom points) at any resolution, gamma-corrected
+# so equal steps look equally bright. One timer thread drives every channel on
+# absolute deadlines. The step to show is derived from the time since the
+# channel started, so a late wake-up shows the right step instead of pushing the
+# rest of the fade back, and a duty cycle equal to the last one isn't rewritten.
+#
+# WaveformLed gives a channel gpiozero's PWMLED interface (on/off/pulse), so the
+# thermostat's heat and cool LEDs can share one engine ("led_driver": "waveform").
+#
+#     python pwm.py [--seconds 10] [--channels 2] [--resolution 42]
+import argparse
+import json
+import logging
+import math
+import threading
+import time
+
+from clock import SYSTEM_CLOCK
+from scheduler import Histogram
+
+
+# === Curves: phase in [0, 1) -> brightness in [0, 1], peaking at phase 0.5 ===
+def linear_curve(t):
+    return 2 * t if t < 0.5 else 2 - 2 * t
+
+
+def sine_curve(t):
+    return 0.5 - 0.5 * math.cos(2 * math.pi * t)
+
+
+def breathing_curve(t):
+    return (math.exp(-math.cos(2 * math.pi * t)) - 1 / math.e) / (math.e - 1 / math.e)
+
+
+CURVES = {"linear": linear_curve, "sine": sine_curve, "breathing": breathing_curve}
+
+
+# Custom curve from evenly spaced brightness points over one period, linearly
+# interpolated and wrapping back to the first point
+def points_curve(points):
+    points = [min(1.0, max(0.0, float(p))) for p in points]
+    if len(points) < 2:
+        raise ValueError("A custom curve needs at least two points")
+    segments = len(points)
+
+    def curve(t):
+        position = t * segments
+        i = int(position) % segments
+        return points[i] + (points[(i + 1) % segments] - points[i]) * (position - int(position))
+    return curve
+
+
+def resolve_curve(curve):
+    if callable(curve):
+        return curve
+    if isinstance(curve, str):
+        if curve not in CURVES:
+            raise ValueError(f"Unknown curve '{curve}', expected one of {tuple(CURVES)} or a list of points")
+        return CURVES[curve]
+    return points_curve(curve)
+
+
+# Spread the rising half of the curve over `rise` of the period and the falling
+# half over the rest (gpiozero's separate fade_in_time and fade_out_time)
+def skewed(curve, rise):
+    if rise == 0.5:
+        return curve
+
+    def skewed_curve(t):
+        if t < rise:
+            return curve(0.5 * t / rise)
+        return curve(0.5 + 0.5 * (t - rise) / (1 - rise))
+    return skewed_curve
+
+
+# One period of duty cycles (0.0-1.0). Perceived brightness is roughly
+# duty ** (1 / gamma), so each brightness level is raised to gamma.
+def duty_table(curve, resolution=100, gamma=2.2, max_duty=1.0, rise=0.5, precision=4):
+    if resolution < 2:
+        raise ValueError("resolution must be at least 2 steps per period")
+    curve = skewed(resolve_curve(curve), rise)
+    return tuple(round(max_duty * min(1.0, max(0.0, curve(i / resolution))) ** gamma, precision)
+                 for i in range(resolution))
+
+
+# Tables for named curves are shared between waveforms
+_tables = {}
+
+
+def cached_duty_table(curve, resolution, gamma, max_duty, rise):
+    if not isinstance(curve, str):
+        return duty_table(curve, resolution, gamma, max_duty, rise)
+    key = (curve, resolution, gamma, max_duty, rise)
+    if key not in _tables:
+        _tables[key] = duty_table(curve, resolution, gamma, max_duty, rise)
+    return _tables[key]
+
+
+class Waveform():
+    # period: seconds per cycle; resolution: steps per cycle; repeat: number of
+    # cycles to play, None for forever; rise: fraction of the period spent rising
+    def __init__(self, curve="breathing", period=2.0, resolution=100, gamma=2.2,
+                 repeat=None, max_duty=1.0, rise=0.5):
+        if period <= 0:
+            raise ValueError("period must be positive")
+        self.period = period
+        self.duties = cached_duty_table(curve, resolution, gamma, max_duty, rise)
+        self.step = period / len(self.duties)
+        self.repeat = repeat
+        # Where a finite waveform comes to rest
+        self.final = self.duties[0]
+
+
+# === Channels and the timer thread ===
+class PwmChannel():
+    # write: called with a duty cycle from 0.0 to 1.0
+    def __init__(self, name, write):
+        self.name = name
+        self.write = write
+        self.waveform = None
+        self.start = 0.0
+        self.deadline = None
+        self.last_step = -1
+        # Last duty cycle written, None if unknown
+        self.level = None
+
+        self.writes = 0
+        self.unchanged = 0
+        self.missed = 0
+        self.failures = 0
+        self.jitter = Histogram()
+
+    def stats(self):
+        return {
+            "writes": self.writes,
+            "unchanged": self.unchanged,
+            "missed_steps": self.missed,
+            "failures": self.failures,
+            "jitter": self.jitter.stats(),
+        }
+
+
+class WaveformEngine():
+    def __init__(self, clock=SYSTEM_CLOCK):
+        self.clock = clock
+        self.channels = {}
+        self.condition = threading.Condition()
+        self.stopped = False
+        self.thread = None
+        self.wakeups = 0
+        # Start lateness of every step on every channel
+        self.jitter = Histogram()
+
+    def add_channel(self, name, write):
+        with self.condition:
+            if name in self.channels:
+                raise ValueError(f"PWM channel '{name}' already exists")
+            channel = PwmChannel(name, write)
+            self.channels[name] = channel
+            return channel
+
+    def remove_channel(self, name):
+        with self.condition:
+            return self.channels.pop(name, None)
+
+    # Start playing waveform on a channel from its first step
+    def play(self, name, waveform):
+        with self.condition:
+            channel = self.channels[name]
+            channel.waveform = waveform
+            channel.start = self.clock.monotonic()
+            channel.deadline = channel.start
+            channel.last_step = -1
+            self.condition.notify()
+
+    # Stop any waveform and hold a constant duty cycle, written straight away
+    def hold(self, name, duty):
+        with self.condition:
+            channel = self.channels[name]
+            channel.waveform = None
+            channel.deadline = None
+            self.output(channel, duty)
+
+    def output(self, channel, duty):
+        if duty == channel.level:
+            channel.unchanged += 1
+            return
+        try:
+            channel.write(duty)
+        except Exception as e:
+            channel.level = None
+            channel.failures += 1
+            logging.error(f"PWM channel {channel.name} write failed: {e}")
+            return
+        channel.level = duty
+        channel.writes += 1
+
+    # Bring every due channel to the step for the current time; returns the next deadline
+    def update(self):
+        now = self.clock.monotonic()
+        next_deadline = None
+        for channel in self.channels.values():
+            waveform = channel.waveform
+            if waveform is None:
+                continue
+            if now >= channel.deadline:
+                lateness_ms = (now - channel.deadline) * 1000
+                channel.jitter.add(lateness_ms)
+                self.jitter.add(lateness_ms)
+                # Never behind the step whose deadline just passed, whatever the rounding
+                step = max(int((now - channel.start) / waveform.step), channel.last_step + 1)
+                channel.missed += step - channel.last_step - 1
+                channel.last_step = step
+                if waveform.repeat is not None and step >= waveform.repeat * len(waveform.duties):
+                    self.output(channel, waveform.final)
+                    channel.waveform = None
+                    channel.deadline = None
+                    continue
+                self.output(channel, waveform.duties[step % len(waveform.duties)])
+                channel.deadline = channel.start + (step + 1) * waveform.step
+            if next_deadline is None or channel.deadline < next_deadline:
+                next_deadline = channel.deadline
+        return next_deadline
+
+    def run(self):
+        with self.condition:
+            while not self.stopped:
+                deadline = self.update()
+                self.wakeups += 1
+                # Sleep until the next step is due, or until play()/stop() wakes us
+                timeout = None if deadline is None else max(0.0, deadline - self.clock.monotonic())
+                self.condition.wait(timeout)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="pwm", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self, timeout=2.0):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+    def stats(self):
+        with self.condition:
+            return {
+                "wakeups": self.wakeups,
+                "jitter": self.jitter.stats(),
+                "channels": {name: channel.stats() for name, channel in self.channels.items()},
+            }
+
+
+# === gpiozero PWMLED look-alike driven by the engine ===
+# led is anything with a 0.0-1.0 value attribute, such as a gpiozero PWMLED.
+# Pulses always run in the background on the engine's thread.
+class WaveformLed():
+    def __init__(self, engine, name, led, curve="breathing", resolution=100, gamma=2.2):
+        self.engine = engine
+        self.name = name
+        self.led = led
+        self.curve = curve
+        self.resolution = resolution
+        self.gamma = gamma
+        self.mode = "off"
+        engine.add_channel(name, self.write)
+
+    def write(self, duty):
+        self.led.value = duty
+
+    def on(self):
+        self.mode = "on"
+        self.engine.hold(self.name, 1.0)
+
+    def off(self):
+        self.mode = "off"
+        self.engine.hold(self.name, 0.0)
+
+    def pulse(self, fade_in_time=1, fade_out_time=1, n=None, background=True):
+        period = fade_in_time + fade_out_time
+        if period <= 0:
+            self.on()
+            return
+        self.mode = "pulse"
+        self.engine.play(self.name, Waveform(self.curve, period, self.resolution, self.gamma,
+                                             repeat=n, rise=fade_in_time / period))
+
+    @property
+    def value(self):
+        return self.led.value
+
+    @property
+    def is_lit(self):
+        return self.mode != "off"
+
+    def close(self):
+        self.engine.remove_channel(self.name)
+        self.led.close()
+
+
+# === Build an engine-driven LED from config.json ===
+def make_waveform_led(engine, name, led, config):
+    return WaveformLed(
+        engine, name, led,
+        curve=config.get("led_pulse_curve", "breathing"),
+        resolution=config.get("led_pulse_resolution", 100),
+        gamma=config.get("led_gamma", 2.2)
+    )
+
+
+# === Benchmark: update jitter of the original sleep loop vs the engine ===
+# Neither side touches GPIO; the duty-cycle write is a no-op, so what is
+# measured is how far each update lands from its ideal time.
+ORIGINAL_STEP_S = 0.1
+ORIGINAL_DUTIES = list(range(0, 101, 5)) + list(range(100, -1, -5))
+
+
+def sleep_loop_fade(seconds, jitter, write):
+    started = time.monotonic()
+    updates = 0
+    while time.monotonic() - started < seconds:
+        jitter.add((time.monotonic() - (started + updates * ORIGINAL_STEP_S)) * 1000)
+        write(ORIGINAL_DUTIES[updates % len(ORIGINAL_DUTIES)])
+        updates += 1
+        time.sleep(ORIGINAL_STEP_S)
+    return updates
+
+
+def bench_sleep_loop(seconds, channels):
+    jitter = Histogram()
+    lock = threading.Lock()
+    counts = []
+
+    # The original needs one loop, and so one thread, per channel
+    def run():
+        local = Histogram()
+        updates = sleep_loop_fade(seconds, local, lambda duty: None)
+        with lock:
+            for i, n in enumerate(local.counts):
+                jitter.counts[i] += n
+            jitter.count += local.count
+            jitter.total += local.total
+            jitter.max = max(jitter.max, local.max)
+            counts.append(updates)
+
+    cpu = time.process_time()
+    threads = [threading.Thread(target=run) for _ in range(channels)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return {"threads": channels, "updates": sum(counts),
+            "cpu_s": round(time.process_time() - cpu, 3), "jitter": jitter.stats()}
+
+
+def bench_engine(seconds, channels, resolution):
+    engine = WaveformEngine().start()
+    period = ORIGINAL_STEP_S * len(ORIGINAL_DUTIES)
+    cpu = time.process_time()
+    for i in range(channels):
+        engine.add_channel(f"ch{i}", lambda duty: None)
+        engine.play(f"ch{i}", Waveform("linear", period, resolution, gamma=1.0))
+    time.sleep(seconds)
+    engine.stop()
+    stats = engine.stats()
+    return {"threads": 1, "updates": stats["jitter"]["count"],
+            "writes": sum(c["writes"] for c in stats["channels"].values()),
+            "missed_steps": sum(c["missed_steps"] for c in stats["channels"].values()),
+            "cpu_s": round(time.process_time() - cpu, 3), "jitter": stats["jitter"]}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare PWM update jitter: sleep loop vs waveform engine")
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--channels", type=int, default=2)
+    parser.add_argument("--resolution", type=int, default=len(ORIGINAL_DUTIES),
+                        help="engine steps per fade cycle (the original has 42)")
+    args = parser.parse_args(argv)
+
+    report = {
+        "seconds": args.seconds,
+        "channels": args.channels,
+        "sleep_loop": bench_sleep_loop(args.seconds, args.channels),
+        "engine": bench_engine(args.seconds, args.channels, args.resolution),
+    }
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,241 @@
+# rollups.py - Incrementally maintained minute/hour/day rollups of temperature_readings
+# AFTER INSERT triggers upsert one row per (bucket, state) at each level, so
+# dashboard and summary queries read a bounded number of rollup rows instead of
+# scanning the whole readings table. avg_temp_by_state is redefined on top of
+# the all-time rollup, which never holds more than one row per state. Works on
+# both schema versions: the trigger sits on whichever table holds the readings.
+#
+# Every rollup sample is one logging period. With change-only logging
+# (deadband.py) the rows the filter suppresses are not stored, so the DB writer
+# hands them to rollup_repeat_sql() instead (see db_writer.RepeatedRow), and
+# backfill() rebuilds change-only sessions from their expanded series: sample
+# counts, seconds in state and averages come out as dense logging gives them.
+#
+# Backfill an existing database once with:
+#     python rollups.py backfill temperature_log.db
+import argparse
+import logging
+import sqlite3
+
+from archive import stage_archived_rows
+from deadband import expand_readings, load_sessions
+from schema import SCHEMA_V1, reading_source
+
+# === Rollup levels: table name -> length of the timestamp prefix used as the bucket ===
+# Timestamps are "%Y-%m-%d %H:%M:%S" strings, so a prefix is a calendar bucket.
+ROLLUP_LEVELS = {
+    "minute": ("temperature_rollup_minute", 16),   # "YYYY-MM-DD HH:MM"
+    "hour": ("temperature_rollup_hour", 13),       # "YYYY-MM-DD HH"
+    "day": ("temperature_rollup_day", 10),         # "YYYY-MM-DD"
+}
+TOTAL_TABLE = "temperature_rollup_total"
+
+# Seconds represented by one rollup sample: the db_log job's period
+DEFAULT_SAMPLE_PERIOD = 30
+
+V1_COLUMNS = ("timestamp", "state", "temperature", "set_point")
+
+
+def rollup_table_ddl(table):
+    return f'''
+        CREATE TABLE IF NOT EXISTS {table} (
+            bucket TEXT NOT NULL,
+            state TEXT NOT NULL,
+            samples INTEGER NOT NULL,
+            temp_sum INTEGER NOT NULL,
+            temp_min INTEGER NOT NULL,
+            temp_max INTEGER NOT NULL,
+            set_point_sum INTEGER NOT NULL,
+            PRIMARY KEY (bucket, state)
+        ) WITHOUT ROWID
+    '''
+
+
+def rollup_upsert_sql(table, bucket_expr, state, temp, set_point):
+    return f'''
+        INSERT INTO {table} (bucket, state, samples, temp_sum, temp_min, temp_max, set_point_sum)
+        VALUES ({bucket_expr}, {state}, 1, {temp}, {temp}, {temp}, {set_point})
+        ON CONFLICT(bucket, state) DO UPDATE SET
+            samples = samples + 1,
+            temp_sum = temp_sum + excluded.temp_sum,
+            temp_min = MIN(temp_min, excluded.temp_min),
+            temp_max = MAX(temp_max, excluded.temp_max),
+            set_point_sum = set_point_sum + excluded.set_point_sum;
+    '''
+
+
+# === Create rollup tables, the maintenance trigger and the bounded summary view ===
+# Does not commit, so a schema migration can swap the trigger inside its own transaction
+def create_rollup_objects(conn):
+    source, exprs = reading_source(conn, "NEW.")
+    upserts = []
+    for table, width in ROLLUP_LEVELS.values():
+        conn.execute(rollup_table_ddl(table))
+        upserts.append(rollup_upsert_sql(
+            table, f"substr({exprs['timestamp']}, 1, {width})", exprs["state"],
+            exprs["temperature"], exprs["set_point"]))
+    conn.execute(rollup_table_ddl(TOTAL_TABLE))
+    upserts.append(rollup_upsert_sql(
+        TOTAL_TABLE, "'all'", exprs["state"], exprs["temperature"], exprs["set_point"]))
+
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_temperature_rollups
+        AFTER INSERT ON {source}
+        BEGIN
+            {"".join(upserts)}
+        END
+    ''')
+
+    # Replace the full-scan view with one that reads at most one row per state
+    conn.execute("DROP VIEW IF EXISTS avg_temp_by_state")
+    conn.execute(f'''
+        CREATE VIEW avg_temp_by_state AS
+        SELECT state, CAST(temp_sum AS REAL) / samples AS avg_temp
+        FROM {TOTAL_TABLE}
+    ''')
+
+
+# Upserts counting a logger row (timestamp, state, temperature, set_point, ts)
+# that was not stored, in every rollup, with the values reading_insert_sql()
+# would have stored
+def rollup_repeat_sql(version):
+    bucket = "datetime(?5, 'unixepoch', 'localtime')"
+    if version == SCHEMA_V1:
+        temp = "(CAST(?3 AS INTEGER) - (?3 < CAST(?3 AS INTEGER)))"
+    else:
+        tenths = "CAST(ROUND(?3 * 10) AS INTEGER)"
+        temp = f"(CASE WHEN {tenths} % 10 = 0 THEN {tenths} / 10 ELSE {tenths} / 10.0 END)"
+    statements = [rollup_upsert_sql(table, f"substr({bucket}, 1, {width})", "?2", temp, "?4")
+                  for table, width in ROLLUP_LEVELS.values()]
+    # ?5 only so the statement takes the same five parameters as the others
+    statements.append(rollup_upsert_sql(TOTAL_TABLE, "COALESCE('all', ?5)", "?2", temp, "?4"))
+    return tuple(statements)
+
+
+def install_rollups(conn):
+    create_rollup_objects(conn)
+    conn.commit()
+
+    if needs_backfill(conn):
+        logging.warning("Rollup tables are empty but temperature_readings has data; "
+                        "run 'python rollups.py backfill <db>' to populate them")
+
+
+def needs_backfill(conn):
+    has_rollups = conn.execute(f"SELECT 1 FROM {TOTAL_TABLE} LIMIT 1").fetchone()
+    source = reading_source(conn)[0]
+    has_readings = conn.execute(f"SELECT 1 FROM {source} LIMIT 1").fetchone()
+    return has_readings is not None and has_rollups is None
+
+
+# === Rebuild every rollup from temperature_readings in one transaction ===
+# Holding a write lock for the whole rebuild means rows inserted by the logger
+# either land before it (and are counted by the scan) or after it (and are
+# counted by the trigger), never both.
+def backfill(conn):
+    source, exprs = reading_source(conn)
+    sessions = load_sessions(conn)
+    # Months moved to the cold archive still count (the expansion reads them itself)
+    if not sessions and stage_archived_rows(conn, source):
+        source = f"(SELECT * FROM {source} UNION ALL SELECT * FROM temp.archived_readings)"
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        if sessions:
+            # Change-only rows count once per logging period they stand for
+            source = stage_expanded_rows(conn)
+            exprs = {column: column for column in V1_COLUMNS}
+        temp = exprs["temperature"]
+        levels = [(table, f"substr({exprs['timestamp']}, 1, {width})")
+                  for table, width in ROLLUP_LEVELS.values()]
+        levels.append((TOTAL_TABLE, "'all'"))
+        for table, bucket_expr in levels:
+            conn.execute(f"DELETE FROM {table}")
+            conn.execute(f'''
+                INSERT INTO {table} (bucket, state, samples, temp_sum, temp_min, temp_max, set_point_sum)
+                SELECT {bucket_expr}, {exprs['state']}, COUNT(*), SUM({temp}), MIN({temp}),
+                       MAX({temp}), SUM({exprs['set_point']})
+                FROM {source}
+                GROUP BY 1, 2
+            ''')
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return conn.execute(f"SELECT COALESCE(SUM(samples), 0) FROM {TOTAL_TABLE}").fetchone()[0]
+
+
+# The dense series of every reading, hot and archived, in temp.expanded_readings
+def stage_expanded_rows(conn):
+    conn.execute("DROP TABLE IF EXISTS temp.expanded_readings")
+    conn.execute(f"CREATE TEMP TABLE expanded_readings ({', '.join(V1_COLUMNS)})")
+    conn.executemany("INSERT INTO temp.expanded_readings VALUES (?, ?, ?, ?)", expand_readings(conn))
+    return "temp.expanded_readings"
+
+
+# === Summary queries (bounded by the number of buckets, not the history length) ===
+# Returns (bucket, state, samples, avg_temp, min_temp, max_temp, avg_set_point,
+# seconds_in_state) rows for buckets in [start, end]. start/end use the same
+# prefix format as the level's buckets (e.g. "2025-08-01" for "day").
+def rollup_summary(conn, level="hour", start=None, end=None, state_filter=None,
+                   sample_period=DEFAULT_SAMPLE_PERIOD):
+    if level not in ROLLUP_LEVELS:
+        raise ValueError(f"Unknown rollup level '{level}', expected one of {tuple(ROLLUP_LEVELS)}")
+    table = ROLLUP_LEVELS[level][0]
+    query = f'''
+        SELECT bucket, state, samples, CAST(temp_sum AS REAL) / samples, temp_min, temp_max,
+               CAST(set_point_sum AS REAL) / samples, samples * ?
+        FROM {table} WHERE 1=1
+    '''
+    params = [sample_period]
+    if start:
+        query += " AND bucket >= ?"
+        params.append(start)
+    if end:
+        query += " AND bucket <= ?"
+        params.append(end)
+    if state_filter:
+        query += " AND state = ?"
+        params.append(state_filter)
+    query += " ORDER BY bucket, state"
+    return conn.execute(query, params).fetchall()
+
+
+# Seconds spent in each state between two days (inclusive), from the day rollup
+def state_time(conn, start_day=None, end_day=None, sample_period=DEFAULT_SAMPLE_PERIOD):
+    query = f"SELECT state, SUM(samples) * ? FROM {ROLLUP_LEVELS['day'][0]} WHERE 1=1"
+    params = [sample_period]
+    if start_day:
+        query += " AND bucket >= ?"
+        params.append(start_day)
+    if end_day:
+        query += " AND bucket <= ?"
+        params.append(end_day)
+    query += " GROUP BY state"
+    return dict(conn.execute(query, params).fetchall())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Maintain temperature_readings rollup tables")
+    parser.add_argument("command", choices=["backfill", "summary"])
+    parser.add_argument("db", nargs="?", default="temperature_log.db")
+    parser.add_argument("--level", default="day", choices=list(ROLLUP_LEVELS))
+    parser.add_argument("--start")
+    parser.add_argument("--end")
+    args = parser.parse_args(argv)
+
+    conn = sqlite3.connect(args.db)
+    try:
+        install_rollups(conn)
+        if args.command == "backfill":
+            rows = backfill(conn)
+            print(f"Rolled up {rows} readings")
+        else:
+            print("Bucket\t\t\tState\tSamples\tAvg\tMin\tMax\tSetPoint\tSeconds")
+            for row in rollup_summary(conn, args.level, args.start, args.end):
+                print(f"{row[0]}\t{row[1]}\t{row[2]}\t{row[3]:.1f}\t{row[4]}\t{row[5]}\t{row[6]:.1f}\t\t{row[7]}")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,269 @@
+# runtime.py - asyncio runtime for the thermostat
+# Replaces the display thread, the writer threads, the gpiozero callbacks
+# poking shared state and the sleep(30) main loop with a single event loop:
+#
+#   sampler      task; each AHTx0 read runs on a one-thread "i2c" executor
+#   display      task; the DeadlineScheduler jobs (LCD, line alternation,
+#                telemetry and DB logging) run on the loop itself
+#   telemetry    task; batches samples and writes frames on a "serial" executor,
+#                replaying the outbox backlog when the link is back
+#   persistence  task; batches rows and commits them on a "sqlite" executor
+#   intervals    task; applies state interval events on the same executor
+#   retention    task; once a day moves old months to the cold archive on the
+#                same executor, if "archive_max_age_days" is set
+#
+# Button presses arrive on gpiozero's threads and are handed to the loop with
+# call_soon_threadsafe, so every state change happens on the loop thread.
+# SIGINT/SIGTERM trigger an ordered shutdown: buttons are detached, producers
+# stop, the writers drain and commit, then connections and devices close.
+import asyncio
+import logging
+import signal
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from archive import run_retention
+from inputs import button_handler, hold_handler
+from state_intervals import apply_events
+
+# Sentinel queued by AsyncBatcher.close()
+_STOP = object()
+
+
+# === Batching consumer task ===
+# Drop-in for the writer threads' submit(): items go to a bounded asyncio
+# queue and are flushed in the executor when batch_size accumulate or
+# max_delay seconds after the first one arrived.
+class AsyncBatcher():
+    def __init__(self, name, flush, executor, batch_size, max_delay, max_queue=1000):
+        self.name = name
+        self.flush = flush
+        self.executor = executor
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.queue = asyncio.Queue(maxsize=max_queue)
+        self.dropped = 0
+        self.batches = 0
+        self.items = 0
+
+    # Called on the loop thread; never blocks
+    def submit(self, item):
+        try:
+            self.queue.put_nowait(item)
+            return True
+        except asyncio.QueueFull:
+            self.dropped += 1
+            logging.warning(f"{self.name} queue full, dropping item")
+            return False
+
+    async def close(self):
+        await self.queue.put(_STOP)
+
+    async def write(self, batch):
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(self.executor, self.flush, batch)
+        except Exception as e:
+            logging.error(f"{self.name} flush of {len(batch)} items failed: {e}")
+            return
+        self.batches += 1
+        self.items += len(batch)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self.queue.get()
+            if item is _STOP:
+                break
+            batch = [item]
+            deadline = loop.time() + self.max_delay
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self.write(batch)
+
+        # Anything queued behind the sentinel still goes out
+        rest = []
+        while not self.queue.empty():
+            item = self.queue.get_nowait()
+            if item is not _STOP:
+                rest.append(item)
+        for start in range(0, len(rest), self.batch_size):
+            await self.write(rest[start:start + self.batch_size])
+
+    def stats(self):
+        return {"queue_depth": self.queue.qsize(), "batches": self.batches,
+                "items": self.items, "dropped": self.dropped}
+
+
+class ThermostatRuntime():
+    # db_writer and telemetry are a BatchedWriter and TelemetryWriter that are
+    # NOT started: the runtime uses their commit()/dispatch()/replay() paths
+    # from its own tasks instead of their threads.
+    def __init__(self, config, hardware, screen, sampler, tsm, db_writer, telemetry, outbox=None):
+        self.config = config
+        self.hardware = hardware
+        self.screen = screen
+        self.sampler = sampler
+        self.tsm = tsm
+        self.db_writer = db_writer
+        self.telemetry = telemetry
+        self.outbox = outbox
+        self.i2c_executor = ThreadPoolExecutor(1, thread_name_prefix="i2c")
+        self.serial_executor = ThreadPoolExecutor(1, thread_name_prefix="serial")
+        self.sqlite_executor = ThreadPoolExecutor(1, thread_name_prefix="sqlite")
+        self.db_conn = None
+        self.stopping = None
+
+    # === Tasks ===
+    async def sample_loop(self):
+        loop = asyncio.get_running_loop()
+        interval = self.sampler.interval
+        next_sample = loop.time() + interval
+        while True:
+            await asyncio.sleep(max(0.0, next_sample - loop.time()))
+            await loop.run_in_executor(self.i2c_executor, self.sampler.sample)
+            next_sample += interval
+            # If a read stalled past the next slot, resynchronise instead of bursting
+            if next_sample < loop.time():
+                next_sample = loop.time() + interval
+
+    async def replay_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.telemetry.replay_interval)
+            if self.telemetry.backlog() and time.monotonic() >= self.telemetry.retry_at:
+                await loop.run_in_executor(self.serial_executor, self.telemetry.replay)
+
+    # First pass a minute after startup, so devices that reboot daily still archive
+    async def retention_loop(self):
+        loop = asyncio.get_running_loop()
+        config = self.config
+        delay = 60.0
+        while True:
+            await asyncio.sleep(delay)
+            delay = config.get("archive_interval", 86400.0)
+            try:
+                stats = await loop.run_in_executor(
+                    self.sqlite_executor, run_retention, self.db_conn, config.get("archive_dir", "archive"),
+                    config["archive_max_age_days"], config.get("archive_codec", "lzma"))
+            except Exception as e:
+                logging.error(f"Archiving old readings failed: {e}")
+                continue
+            if stats["months"]:
+                logging.info(f"Archived old readings: {stats}")
+
+    def commit_rows(self, rows):
+        self.db_writer.commit(self.db_conn, rows)
+
+    def apply_interval_events(self, events):
+        apply_events(self.db_conn, events)
+
+    # === Buttons ===
+    # Events are queued on the loop; the display task's "buttons" job coalesces
+    # and applies them (see inputs.py)
+    def attach_buttons(self, loop):
+        for name, button in self.hardware.buttons().items():
+            button.when_pressed = button_handler(loop.call_soon_threadsafe, self.tsm.inputs.press, name)
+            button.when_held = hold_handler(button, loop.call_soon_threadsafe, self.tsm.inputs.hold, name)
+
+    def detach_buttons(self):
+        for button in self.hardware.buttons().values():
+            button.when_pressed = None
+            button.when_held = None
+
+    def request_stop(self):
+        if not self.stopping.is_set():
+            logging.info("Shutting down system...")
+            self.stopping.set()
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        self.stopping = asyncio.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, self.request_stop)
+
+        # The writer's own connection lives on the sqlite executor's thread
+        self.db_conn = await loop.run_in_executor(self.sqlite_executor, self.db_writer.connect)
+        persistence = AsyncBatcher(
+            "DB writer", self.commit_rows, self.sqlite_executor,
+            self.db_writer.batch_size, self.db_writer.flush_interval,
+            max_queue=self.db_writer.queue.maxsize)
+        telemetry = AsyncBatcher(
+            "Telemetry", self.telemetry.dispatch, self.serial_executor,
+            self.telemetry.batch_size, self.telemetry.max_delay,
+            max_queue=self.telemetry.queue.maxsize)
+        self.tsm.db_writer = persistence
+        self.tsm.telemetry = telemetry
+        # State intervals go to the same database on the same thread
+        intervals = None
+        if self.tsm.intervals is not None:
+            intervals = AsyncBatcher(
+                "State intervals", self.apply_interval_events, self.sqlite_executor,
+                self.db_writer.batch_size, self.db_writer.flush_interval)
+            self.tsm.intervals.attach(intervals)
+
+        # A first reading before anything tries to display it, unless startup took one
+        if self.sampler.latest() is None:
+            await loop.run_in_executor(self.i2c_executor, self.sampler.sample)
+        consumers = [asyncio.create_task(persistence.run(), name="persistence"),
+                     asyncio.create_task(telemetry.run(), name="telemetry")]
+        if intervals is not None:
+            consumers.append(asyncio.create_task(intervals.run(), name="intervals"))
+        producers = [asyncio.create_task(self.sample_loop(), name="sampler"),
+                     asyncio.create_task(self.tsm.scheduler.run_async(), name="display")]
+        if self.outbox is not None:
+            producers.append(asyncio.create_task(self.replay_loop(), name="replay"))
+        if self.config.get("archive_max_age_days"):
+            producers.append(asyncio.create_task(self.retention_loop(), name="retention"))
+        self.attach_buttons(loop)
+        logging.info("Thermostat runtime started")
+
+        await self.stopping.wait()
+
+        # 1. No new button events
+        self.detach_buttons()
+        # 2. Stop producing samples, frames and rows
+        for task in producers:
+            task.cancel()
+        await asyncio.gather(*producers, return_exceptions=True)
+        # 3. Drain the writers: last telemetry batch and outbox burst, last DB
+        #    commit, and the interval of the state we stop in
+        await telemetry.close()
+        await persistence.close()
+        if intervals is not None:
+            self.tsm.endInterval()
+            await intervals.close()
+        await asyncio.gather(*consumers, return_exceptions=True)
+        if self.telemetry.backlog():
+            await loop.run_in_executor(self.serial_executor, self.telemetry.replay)
+        # 4. Close connections and devices, each on the thread that owns it
+        await loop.run_in_executor(self.sqlite_executor, self.db_conn.close)
+        if self.outbox is not None:
+            await loop.run_in_executor(self.serial_executor, self.outbox.close)
+        self.screen.cleanupDisplay()
+        self.hardware.close()
+        for executor in (self.i2c_executor, self.serial_executor, self.sqlite_executor):
+            executor.shutdown(wait=True)
+
+        logging.info(f"Telemetry stats: {self.telemetry.stats()} queue: {telemetry.stats()}")
+        logging.info(f"Sampler stats: {self.sampler.stats()}")
+        logging.info(f"LCD framebuffer stats: {self.screen.framebuffer.stats()}")
+        logging.info(f"Display schedule stats: {self.tsm.scheduler.stats()}")
+        logging.info(f"Button input stats: {self.tsm.inputs.stats()}")
+        logging.info(f"LED actuator stats: {self.tsm.actuators.stats()}")
+        logging.info(f"DB writer stats: {self.db_writer.stats()} queue: {persistence.stats()}")
+        if intervals is not None:
+            logging.info(f"State interval stats: {self.tsm.intervals.stats()} queue: {intervals.stats()}")
+        if self.tsm.logFilter is not None:
+            logging.info(f"Change-only log stats: {self.tsm.logFilter.stats()}")
@@ -0,0 +1,90 @@
+# sampler.py - Single sensor-sampling service for the AHTx0
+# One thread owns the I2C bus and reads the sensor at a fixed rate. Each read is
+# published as an immutable Reading snapshot, so updateLights, setupSerialOutput
+# and manageMyDisplay can all look at the latest value without touching the bus
+# or pushing extra samples into the moving average. Readings pass through an
+# optional outlier stage before they reach the smoothing filter.
+import logging
+import threading
+from collections import namedtuple
+
+from clock import SYSTEM_CLOCK
+from smoothing import MovingAverage
+
+# === Immutable snapshot published after every successful read ===
+# raw/smoothed are in Fahrenheit, humidity is relative humidity in percent (or
+# None if the sensor could not provide it), timestamp is the sampler clock's
+# monotonic() time.
+Reading = namedtuple("Reading", ["raw", "smoothed", "humidity", "timestamp"])
+
+
+class SensorSampler():
+    def __init__(self, sensor, interval=1.0, smoother=None, outlier_filter=None,
+                 clock=SYSTEM_CLOCK):
+        self.sensor = sensor
+        self.interval = interval
+        self.smoother = smoother if smoother is not None else MovingAverage(window=5)
+        self.outlier_filter = outlier_filter
+        self.clock = clock
+        self.reading = None
+        self.read_errors = 0
+        self.rejected = 0
+        self.stopEvent = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="sensor-sampler", daemon=True)
+
+    # Take one reading up front so consumers have a snapshot as soon as start() returns
+    def start(self):
+        self.sample()
+        self.thread.start()
+        return self
+
+    def stop(self, timeout=2.0):
+        self.stopEvent.set()
+        if self.thread.is_alive():
+            self.thread.join(timeout)
+
+    # Latest snapshot, or None if no read has succeeded yet. Never touches the bus.
+    def latest(self):
+        return self.reading
+
+    def stats(self):
+        stats = {"read_errors": self.read_errors, "rejected": self.rejected}
+        if self.outlier_filter is not None:
+            stats.update(self.outlier_filter.stats())
+        return stats
+
+    def sample(self):
+        try:
+            raw_temp = ((9/5) * self.sensor.temperature) + 32
+        except Exception as e:
+            # A failed read is a missing sample: keep the previous snapshot
+            # rather than feeding a bogus value to the smoothing filter
+            self.read_errors += 1
+            if self.outlier_filter is not None:
+                self.outlier_filter.mark_missing()
+            logging.error(f"Temperature read failed: {e}")
+            return self.reading
+
+        if self.outlier_filter is not None and not self.outlier_filter.accept(raw_temp):
+            self.rejected += 1
+            return self.reading
+
+        try:
+            humidity = self.sensor.relative_humidity
+        except Exception as e:
+            humidity = None
+            logging.warning(f"Humidity read failed: {e}")
+
+        smoothed_temp = self.smoother.update(raw_temp)
+        # A single reference assignment, so readers never see a half-built snapshot
+        self.reading = Reading(raw_temp, smoothed_temp, humidity, self.clock.monotonic())
+        return self.reading
+
+    def run(self):
+        next_sample = self.clock.monotonic() + self.interval
+        while not self.stopEvent.wait(max(0.0, next_sample - self.clock.monotonic())):
+            self.sample()
+            next_sample += self.interval
+            # If a read stalled past the next slot, resynchronise instead of bursting
+            if next_sample < self.clock.monotonic():
+                next_sample = self.clock.monotonic() + self.interval
@@ -0,0 +1,159 @@
+# scheduler.py - Drift-free periodic job scheduler for the display loop
+# manageMyDisplay used to do its work and then sleep(1), so every pass took
+# 1 s plus the cost of the sensor snapshot, LCD, serial and DB work, and the
+# "every 30 passes" log slid later and later. Here each job has an absolute
+# deadline on a monotonic clock that advances by exactly one period per run,
+# so work time never accumulates into the schedule.
+#
+# When a job falls a whole period or more behind (a slow SD card commit, a
+# stalled bus), its overrun policy decides what happens:
+#     "skip"      drop the missed runs and resume on the next period boundary
+#     "catch_up"  run back-to-back until the job is on schedule again
+#
+# Each job keeps histograms of its start lateness (jitter) and of how far each
+# actual period was from the nominal one.
+import asyncio
+import bisect
+import logging
+import threading
+
+from clock import SYSTEM_CLOCK
+
+OVERRUN_POLICIES = ("skip", "catch_up")
+
+# Histogram bucket upper bounds in milliseconds; the last bucket is open-ended
+HISTOGRAM_BOUNDS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000)
+HISTOGRAM_LABELS = [f"<={bound}ms" for bound in HISTOGRAM_BOUNDS_MS] + [f">{HISTOGRAM_BOUNDS_MS[-1]}ms"]
+
+
+class Histogram():
+    def __init__(self):
+        self.counts = [0] * (len(HISTOGRAM_BOUNDS_MS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value_ms):
+        self.counts[bisect.bisect_left(HISTOGRAM_BOUNDS_MS, value_ms)] += 1
+        self.count += 1
+        self.total += value_ms
+        self.max = max(self.max, value_ms)
+
+    def stats(self):
+        return {
+            "count": self.count,
+            "mean_ms": round(self.total / self.count, 3) if self.count else 0.0,
+            "max_ms": round(self.max, 3),
+            "buckets": {label: n for label, n in zip(HISTOGRAM_LABELS, self.counts) if n},
+        }
+
+
+class PeriodicJob():
+    def __init__(self, name, period, callback, policy, deadline, max_catch_up):
+        self.name = name
+        self.period = period
+        self.callback = callback
+        self.policy = policy
+        self.deadline = deadline
+        self.max_catch_up = max_catch_up
+        self.last_start = None
+        self.runs = 0
+        self.skipped = 0
+        self.overruns = 0
+        self.failures = 0
+        self.jitter = Histogram()
+        self.period_error = Histogram()
+
+    def stats(self):
+        return {
+            "period_s": self.period,
+            "policy": self.policy,
+            "runs": self.runs,
+            "overruns": self.overruns,
+            "skipped": self.skipped,
+            "failures": self.failures,
+            "jitter": self.jitter.stats(),
+            "period_error": self.period_error.stats(),
+        }
+
+
+class DeadlineScheduler():
+    def __init__(self, clock=SYSTEM_CLOCK):
+        self.clock = clock
+        self.jobs = []
+        self.stopEvent = threading.Event()
+
+    # delay: seconds until the first run (defaults to one period). Jobs due at
+    # the same instant run in the order they were added.
+    def add(self, name, period, callback, policy="skip", delay=None, max_catch_up=10):
+        if period <= 0:
+            raise ValueError(f"Job '{name}' needs a positive period")
+        if policy not in OVERRUN_POLICIES:
+            raise ValueError(f"Unknown overrun policy '{policy}', expected one of {OVERRUN_POLICIES}")
+        deadline = self.clock.monotonic() + (period if delay is None else delay)
+        job = PeriodicJob(name, period, callback, policy, deadline, max_catch_up)
+        self.jobs.append(job)
+        return job
+
+    def next_deadline(self):
+        return min(job.deadline for job in self.jobs) if self.jobs else None
+
+    def run_job(self, job, now):
+        job.jitter.add((now - job.deadline) * 1000)
+        if job.last_start is not None:
+            job.period_error.add(abs(now - job.last_start - job.period) * 1000)
+        job.last_start = now
+        try:
+            job.callback()
+        except Exception as e:
+            job.failures += 1
+            logging.error(f"Scheduled job '{job.name}' failed: {e}")
+        job.runs += 1
+        job.deadline += job.period
+
+    # Run every job that is due, applying overrun policies; returns the next deadline
+    def run_pending(self):
+        for job in self.jobs:
+            now = self.clock.monotonic()
+            if now < job.deadline:
+                continue
+            self.run_job(job, now)
+            now = self.clock.monotonic()
+            if now < job.deadline:
+                continue
+            job.overruns += 1
+            if job.policy == "catch_up":
+                bursts = 0
+                while now >= job.deadline and bursts < job.max_catch_up:
+                    self.run_job(job, now)
+                    bursts += 1
+                    now = self.clock.monotonic()
+            if now >= job.deadline:
+                # Give up on the missed runs and stay on the original period grid
+                missed = int((now - job.deadline) // job.period) + 1
+                job.deadline += missed * job.period
+                job.skipped += missed
+        return self.next_deadline()
+
+    # Run jobs until stop() is called
+    def run(self):
+        while not self.stopEvent.is_set():
+            deadline = self.run_pending()
+            if deadline is None:
+                self.stopEvent.wait()
+                break
+            self.stopEvent.wait(max(0.0, deadline - self.clock.monotonic()))
+
+    # Same loop as an asyncio task; stops on stop() or when the task is cancelled
+    async def run_async(self):
+        while not self.stopEvent.is_set():
+            deadline = self.run_pending()
+            if deadline is None:
+                return
+            await asyncio.sleep(max(0.0, deadline - self.clock.monotonic()))
+
+    def stop(self):
+        self.stopEvent.set()
+
+    def stats(self):
+        return {job.name: job.stats() for job in self.jobs}
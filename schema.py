@@ -0,0 +1,247 @@
+# schema.py - temperature_log.db schema versions
+#
+# v1 (Enhancement Three): temperature_readings(timestamp TEXT, state TEXT,
+#     temperature INTEGER, set_point INTEGER) as a rowid table with separate
+#     idx_timestamp / idx_state indexes.
+#
+# v2: readings(ts, state, temp_tenths, set_point) WITHOUT ROWID, keyed on ts.
+#     ts is UTC seconds since the epoch, so the hour repeated when daylight
+#     saving time ends does not collide with the one before it; local time is
+#     only produced for display ('localtime' below). state is a small integer
+#     code and temp_tenths is the temperature in tenths of a degree Fahrenheit.
+#     temperature_readings stays available as a view with an INSTEAD OF INSERT
+#     trigger, so code written against v1 (including a logger that is still
+#     running during migration) keeps working unchanged. Like the v1 table, the
+#     view shows local timestamps and whole degrees (temp_tenths floored); the
+#     query helpers below read the tenths.
+#
+# The logger inserts through reading_insert_sql(): rows carry the epoch
+# seconds they were taken at, v2 stores them directly in readings and reports
+# same-second rows it could not store in the cursor's rowcount, and a v1 table
+# gets the local time and whole degrees.
+import logging
+
+SCHEMA_V1 = 1
+SCHEMA_V2 = 2
+
+# === Small-integer state codes used by v2 ===
+STATE_CODES = {"off": 0, "heat": 1, "cool": 2}
+STATE_NAMES = {code: name for name, code in STATE_CODES.items()}
+
+V1_TABLE_DDL = '''
+    CREATE TABLE IF NOT EXISTS temperature_readings (
+        timestamp TEXT NOT NULL,
+        state TEXT CHECK(state IN ('heat', 'cool', 'off')) NOT NULL,
+        temperature INTEGER NOT NULL,
+        set_point INTEGER NOT NULL
+    )
+'''
+V1_INDEX_DDL = (
+    "CREATE INDEX IF NOT EXISTS idx_timestamp ON temperature_readings(timestamp)",
+    "CREATE INDEX IF NOT EXISTS idx_state ON temperature_readings(state)",
+)
+
+V2_TABLE_DDL = '''
+    CREATE TABLE IF NOT EXISTS readings (
+        ts INTEGER NOT NULL PRIMARY KEY,
+        state INTEGER NOT NULL CHECK(state IN (0, 1, 2)),
+        temp_tenths INTEGER NOT NULL,
+        set_point INTEGER NOT NULL
+    ) WITHOUT ROWID
+'''
+# In a WITHOUT ROWID table every secondary index also carries the primary key,
+# so this is effectively an index on (state, ts)
+V2_INDEX_DDL = (
+    "CREATE INDEX IF NOT EXISTS idx_readings_state ON readings(state)",
+)
+
+
+# === SQL expressions converting between the two layouts ===
+def v1_to_v2_exprs(prefix=""):
+    return {
+        "ts": f"CAST(strftime('%s', {prefix}timestamp, 'utc') AS INTEGER)",
+        "state": (f"CASE {prefix}state WHEN 'off' THEN 0 WHEN 'heat' THEN 1 "
+                  f"WHEN 'cool' THEN 2 END"),
+        "temp_tenths": f"CAST(ROUND({prefix}temperature * 10) AS INTEGER)",
+        "set_point": f"{prefix}set_point",
+    }
+
+
+# Whole-degree temperatures come back as INTEGER, exactly as v1 stored them
+def v2_to_v1_exprs(prefix=""):
+    return {
+        "timestamp": f"datetime({prefix}ts, 'unixepoch', 'localtime')",
+        "state": (f"CASE {prefix}state WHEN 0 THEN 'off' WHEN 1 THEN 'heat' "
+                  f"WHEN 2 THEN 'cool' END"),
+        "temperature": (f"CASE WHEN {prefix}temp_tenths % 10 = 0 THEN {prefix}temp_tenths / 10 "
+                        f"ELSE {prefix}temp_tenths / 10.0 END"),
+        "set_point": f"{prefix}set_point",
+    }
+
+
+# Name of the base table holding readings and v1-shaped expressions over it,
+# for code (rollups, backfills) that has to work against either version
+def reading_source(conn, prefix=""):
+    if schema_version(conn) == SCHEMA_V2:
+        return "readings", v2_to_v1_exprs(prefix)
+    return "temperature_readings", {
+        "timestamp": f"{prefix}timestamp",
+        "state": f"{prefix}state",
+        "temperature": f"{prefix}temperature",
+        "set_point": f"{prefix}set_point",
+    }
+
+
+# Whole degrees, rounded down like the v1 logger did (SQLite's / truncates towards zero)
+def floor_tenths_expr(column):
+    return f"({column} / 10 - ({column} < 0 AND {column} % 10 != 0))"
+
+
+def v2_compat_view_ddl():
+    v1 = v2_to_v1_exprs()
+    v2 = v1_to_v2_exprs("NEW.")
+    return (
+        f'''
+        CREATE VIEW IF NOT EXISTS temperature_readings AS
+        SELECT {v1["timestamp"]} AS timestamp, {v1["state"]} AS state,
+               {floor_tenths_expr("temp_tenths")} AS temperature, set_point
+        FROM readings
+        ''',
+        # For writers of v1-shaped rows; the local time is read as the UTC
+        # instant it names, and same-second duplicates are dropped rather than
+        # failing the batch (the logger uses reading_insert_sql, which counts them)
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_temperature_readings_insert
+        INSTEAD OF INSERT ON temperature_readings
+        BEGIN
+            INSERT INTO readings (ts, state, temp_tenths, set_point)
+            VALUES ({v2["ts"]}, {v2["state"]}, {v2["temp_tenths"]}, {v2["set_point"]})
+            ON CONFLICT(ts) DO NOTHING;
+        END
+        ''',
+    )
+
+
+# Rebuilt on every open so databases created before the view floored pick it up;
+# the rollup trigger sits on readings and is not affected
+def refresh_compat_view(conn):
+    conn.execute("DROP VIEW IF EXISTS temperature_readings")
+    for ddl in v2_compat_view_ddl():
+        conn.execute(ddl)
+
+
+# INSERT for (timestamp, state, temperature, set_point, ts) rows: the local
+# timestamp string, the temperature to a tenth of a degree and the epoch
+# seconds the row was taken at. Both versions take the time from ts. On v2 a
+# row in the same second as a stored one is not inserted, and is missing from
+# the cursor's rowcount. A v1 table keeps whole degrees.
+def reading_insert_sql(version):
+    if version == SCHEMA_V1:
+        return ("INSERT INTO temperature_readings VALUES "
+                "(datetime(?5, 'unixepoch', 'localtime'), ?2, CAST(?3 AS INTEGER) - (?3 < CAST(?3 AS INTEGER)), ?4)")
+    return ("INSERT INTO readings (ts, state, temp_tenths, set_point) VALUES "
+            "(?5, CASE ?2 WHEN 'off' THEN 0 WHEN 'heat' THEN 1 WHEN 'cool' THEN 2 END, "
+            "CAST(ROUND(?3 * 10) AS INTEGER), ?4) ON CONFLICT(ts) DO NOTHING")
+
+
+def schema_version(conn):
+    if conn.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_V2:
+        return SCHEMA_V2
+    row = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'temperature_readings'"
+    ).fetchone()
+    return SCHEMA_V1 if row else 0
+
+
+def create_v2(conn):
+    # Lets archive.py hand pages freed by archiving back to the filesystem;
+    # only takes effect before the first table is created
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    conn.execute(V2_TABLE_DDL)
+    for ddl in V2_INDEX_DDL:
+        conn.execute(ddl)
+    for ddl in v2_compat_view_ddl():
+        conn.execute(ddl)
+    conn.execute(f"PRAGMA user_version = {SCHEMA_V2}")
+
+
+# === Open-time schema setup ===
+# New databases start on v2; existing v1 databases keep working as before until
+# they are converted with 'python migrate.py <db>'.
+def ensure_schema(conn):
+    version = schema_version(conn)
+    if version == 0:
+        create_v2(conn)
+        version = SCHEMA_V2
+    elif version == SCHEMA_V2:
+        refresh_compat_view(conn)
+    elif version == SCHEMA_V1:
+        conn.execute(V1_TABLE_DDL)
+        for ddl in V1_INDEX_DDL:
+            conn.execute(ddl)
+        logging.info("temperature_log.db uses schema v1; run 'python migrate.py' to convert it")
+    conn.commit()
+    return version
+
+
+# === Filtered SELECT over the readings that uses the right index on either version ===
+# Returns (sql, params). layout="v1" yields (timestamp, state, temperature,
+# set_point) rows, layout="v2" yields (ts, state code, temp_tenths, set_point)
+# rows, always in time order. On v2 the date bounds become integer ranges on the
+# primary key instead of string compares.
+#
+# For keyset pagination, with_key=True appends two key columns (ts and 0 on v2,
+# timestamp and rowid on v1) and after=<those two values> resumes strictly
+# after that row.
+def readings_query(conn, start_date=None, end_date=None, state_filter=None,
+                   layout="v1", after=None, limit=None, with_key=False):
+    params = []
+    if schema_version(conn) == SCHEMA_V2:
+        if layout == "v1":
+            v1 = v2_to_v1_exprs()
+            columns = f"{v1['timestamp']}, {v1['state']}, {v1['temperature']}, set_point"
+        else:
+            columns = "ts, state, temp_tenths, set_point"
+        if with_key:
+            columns += ", ts, 0"
+        query = f"SELECT {columns} FROM readings WHERE 1=1"
+        if start_date:
+            query += " AND ts >= CAST(strftime('%s', ?, 'utc') AS INTEGER)"
+            params.append(start_date)
+        if end_date:
+            query += " AND ts <= CAST(strftime('%s', ?, 'utc') AS INTEGER)"
+            params.append(end_date)
+        if state_filter:
+            query += " AND state = ?"
+            params.append(STATE_CODES.get(state_filter, -1))
+        if after:
+            query += " AND ts > ?"
+            params.append(after[0])
+        query += " ORDER BY ts"
+    else:
+        if layout == "v1":
+            columns = "timestamp, state, temperature, set_point"
+        else:
+            v2 = v1_to_v2_exprs()
+            columns = f"{v2['ts']}, {v2['state']}, {v2['temp_tenths']}, set_point"
+        if with_key:
+            columns += ", timestamp, rowid"
+        query = f"SELECT {columns} FROM temperature_readings WHERE 1=1"
+        if start_date:
+            query += " AND timestamp >= ?"
+            params.append(start_date)
+        if end_date:
+            query += " AND timestamp <= ?"
+            params.append(end_date)
+        if state_filter:
+            query += " AND state = ?"
+            params.append(state_filter)
+        if after:
+            query += " AND (timestamp, rowid) > (?, ?)"
+            params.extend(after)
+        query += " ORDER BY timestamp, rowid"
+
+    if limit:
+        query += " LIMIT ?"
+        params.append(limit)
+    return query, params
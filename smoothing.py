@@ -0,0 +1,217 @@
+# smoothing.py - Incremental smoothing filters for temperature readings
+# Every filter does O(1) work per sample through update() and also offers a
+# NumPy-vectorized apply(array) that re-filters a whole history in bulk, e.g.
+# the temperature column of temperature_readings. The live path does not need
+# NumPy; it is only imported when apply() is called.
+import math
+from collections import deque
+
+
+# === Filter interface ===
+class SmoothingFilter():
+    # Feed one sample and return the new smoothed value
+    def update(self, sample):
+        raise NotImplementedError
+
+    # Current smoothed value, or None before the first sample
+    @property
+    def value(self):
+        raise NotImplementedError
+
+    def reset(self):
+        raise NotImplementedError
+
+    # Filter a whole array from a fresh state; does not touch the live state
+    def apply(self, samples):
+        raise NotImplementedError
+
+
+# === Simple moving average with a running sum ===
+class MovingAverage(SmoothingFilter):
+    # Re-sum the window this often so floating-point drift in the running sum stays bounded
+    RESUM_EVERY = 4096
+
+    def __init__(self, window=5):
+        if window < 1:
+            raise ValueError("window must be at least 1")
+        self.window = window
+        self.reset()
+
+    def reset(self):
+        self.history = deque(maxlen=self.window)
+        self.total = 0.0
+        self.updates = 0
+
+    def update(self, sample):
+        if len(self.history) == self.window:
+            self.total -= self.history[0]
+        self.history.append(sample)
+        self.total += sample
+        self.updates += 1
+        if self.updates % self.RESUM_EVERY == 0:
+            self.total = math.fsum(self.history)
+        return self.total / len(self.history)
+
+    @property
+    def value(self):
+        return self.total / len(self.history) if self.history else None
+
+    # Matches update(): the first window-1 outputs average over what is available
+    def apply(self, samples):
+        import numpy as np
+        x = np.asarray(samples, dtype=np.float64)
+        if x.size == 0:
+            return x.copy()
+        csum = np.cumsum(x)
+        out = csum.copy()
+        out[self.window:] -= csum[:-self.window]
+        counts = np.minimum(np.arange(1, x.size + 1), self.window)
+        return out / counts
+
+
+# === Exponential moving average ===
+class ExponentialAverage(SmoothingFilter):
+    def __init__(self, alpha=0.3):
+        if not 0.0 < alpha <= 1.0:
+            raise ValueError("alpha must be in (0, 1]")
+        self.alpha = alpha
+        self.reset()
+
+    def reset(self):
+        self.current = None
+
+    def update(self, sample):
+        if self.current is None:
+            self.current = float(sample)
+        else:
+            self.current += self.alpha * (sample - self.current)
+        return self.current
+
+    @property
+    def value(self):
+        return self.current
+
+    def apply(self, samples):
+        import numpy as np
+        x = np.asarray(samples, dtype=np.float64)
+        if x.size == 0:
+            return x.copy()
+        out = np.empty_like(x)
+        out[0] = x[0]
+        out[1:] = ema_block_apply(x[1:], self.alpha, x[0])
+        return out
+
+
+# === 1-D Kalman filter (random-walk temperature model) ===
+class KalmanFilter(SmoothingFilter):
+    # process_noise is the variance the true temperature drifts by per sample,
+    # measurement_noise the variance of a single sensor read.
+    def __init__(self, process_noise=0.01, measurement_noise=0.25):
+        if process_noise <= 0 or measurement_noise <= 0:
+            raise ValueError("noise variances must be positive")
+        self.q = process_noise
+        self.r = measurement_noise
+        self.reset()
+
+    def reset(self):
+        self.estimate = None
+        self.variance = None
+
+    def update(self, sample):
+        if self.estimate is None:
+            self.estimate = float(sample)
+            self.variance = self.r
+            return self.estimate
+        predicted = self.variance + self.q
+        gain = predicted / (predicted + self.r)
+        self.estimate += gain * (sample - self.estimate)
+        self.variance = (1.0 - gain) * predicted
+        return self.estimate
+
+    @property
+    def value(self):
+        return self.estimate
+
+    # The gain sequence does not depend on the data and converges within a few
+    # dozen steps, after which the filter is exactly an EMA with the steady-state
+    # gain. Only the warm-up runs in Python; the tail is vectorized.
+    def apply(self, samples):
+        import numpy as np
+        x = np.asarray(samples, dtype=np.float64)
+        if x.size == 0:
+            return x.copy()
+        out = np.empty_like(x)
+        estimate = out[0] = x[0]
+        variance = self.r
+        gain = None
+        i = 1
+        while i < x.size:
+            predicted = variance + self.q
+            new_gain = predicted / (predicted + self.r)
+            estimate += new_gain * (x[i] - estimate)
+            variance = (1.0 - new_gain) * predicted
+            out[i] = estimate
+            i += 1
+            if gain is not None and abs(new_gain - gain) < 1e-12:
+                break
+            gain = new_gain
+        if i < x.size:
+            out[i:] = ema_block_apply(x[i:], new_gain, estimate)
+        return out
+
+
+# === Vectorized EMA recursion: y[i] = y[i-1] + alpha * (x[i] - y[i-1]) ===
+# Uses the closed form y[i] = d^(i+1) * (y0 + alpha * sum_k x[k] * d^-(k+1)) with
+# d = 1 - alpha, evaluated in blocks short enough that d^-(k+1) cannot overflow.
+def ema_block_apply(x, alpha, initial):
+    import numpy as np
+    out = np.empty_like(x)
+    if x.size == 0:
+        return out
+    decay = 1.0 - alpha
+    if decay <= 0.0:
+        out[:] = x
+        return out
+
+    block = max(1, min(x.size, int(250 / -math.log10(decay))))
+    steps = np.arange(1, block + 1, dtype=np.float64)
+    grow = decay ** -steps
+    shrink = decay ** steps
+
+    previous = initial
+    for start in range(0, x.size, block):
+        chunk = x[start:start + block]
+        n = chunk.size
+        acc = np.cumsum(chunk * grow[:n]) * alpha
+        out[start:start + n] = shrink[:n] * (previous + acc)
+        previous = out[start + n - 1]
+    return out
+
+
+# === Build the filter selected in config.json ===
+# "smoothing_filter" is one of "sma" (default), "ema" or "kalman".
+FILTERS = ("sma", "ema", "kalman")
+
+
+def make_filter(config):
+    kind = config.get("smoothing_filter", "sma").lower()
+    if kind == "sma":
+        return MovingAverage(window=config.get("smoothing_window", 5))
+    if kind == "ema":
+        return ExponentialAverage(alpha=config.get("smoothing_alpha", 0.3))
+    if kind == "kalman":
+        return KalmanFilter(
+            process_noise=config.get("kalman_process_noise", 0.01),
+            measurement_noise=config.get("kalman_measurement_noise", 0.25)
+        )
+    raise ValueError(f"Unknown smoothing_filter '{kind}', expected one of {FILTERS}")
+
+
+# === Re-filter the logged history in bulk ===
+# Returns (ts, raw temperatures, smoothed temperatures) as arrays in time order;
+# ts is wall-clock epoch seconds as stored by schema v2.
+def refilter_history(conn, smoother, start_date=None, end_date=None):
+    from history import readings_array
+    readings = readings_array(conn, start_date, end_date)
+    raw = readings["temp_tenths"] / 10.0
+    return readings["ts"], raw, smoother.apply(raw)
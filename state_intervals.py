@@ -0,0 +1,307 @@
+# state_intervals.py - Run-length log of thermostat states with duty-cycle counters
+# "How long did we heat yesterday" used to mean scanning temperature_readings
+# and counting 30-second samples. Now every state the machine enters becomes
+# one row of state_intervals (state, started, ended, temperature at both ends,
+# set point), written when the state is entered and closed when it is left,
+# and closing an interval adds its seconds to per-day and all-time counters:
+#
+#   state_duty_day(day, state, seconds, entries)    seconds split at midnight;
+#                                                   entries counts intervals started
+#   state_duty_total(state, seconds, entries)
+#
+# so runtime, duty-cycle and cycle-count reports read a few counter rows, and
+# listing the intervals of a period is a range scan on the started index.
+# Only the newest interval can be open (ended NULL); one left open by a crash
+# is closed at startup at the last logged reading.
+#
+# The hooks on TemperatureMachine only queue events (StateIntervalRecorder);
+# the runtime applies them on its SQLite thread with apply_events().
+#
+#     python state_intervals.py report [db] [--start-day 2025-01-01] [--end-day 2025-01-31]
+#     python state_intervals.py list [db] [--start ...] [--end ...] [--state heat]
+import argparse
+import sqlite3
+from datetime import datetime, timedelta
+
+from schema import SCHEMA_V2, schema_version
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+STATES = ("heat", "cool", "off")
+
+INTERVALS_DDL = (
+    '''
+    CREATE TABLE IF NOT EXISTS state_intervals (
+        id INTEGER PRIMARY KEY,
+        state TEXT CHECK(state IN ('heat', 'cool', 'off')) NOT NULL,
+        started TEXT NOT NULL,
+        ended TEXT,
+        start_temp REAL,
+        end_temp REAL,
+        set_point INTEGER NOT NULL
+    )
+    ''',
+    "CREATE INDEX IF NOT EXISTS idx_state_intervals_started ON state_intervals(started)",
+    '''
+    CREATE TABLE IF NOT EXISTS state_duty_day (
+        day TEXT NOT NULL,
+        state TEXT NOT NULL,
+        seconds INTEGER NOT NULL,
+        entries INTEGER NOT NULL,
+        PRIMARY KEY (day, state)
+    ) WITHOUT ROWID
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS state_duty_total (
+        state TEXT NOT NULL PRIMARY KEY,
+        seconds INTEGER NOT NULL,
+        entries INTEGER NOT NULL
+    ) WITHOUT ROWID
+    ''',
+)
+
+DAY_UPSERT = '''
+    INSERT INTO state_duty_day (day, state, seconds, entries) VALUES (?, ?, ?, ?)
+    ON CONFLICT(day, state) DO UPDATE SET
+        seconds = seconds + excluded.seconds,
+        entries = entries + excluded.entries
+'''
+TOTAL_UPSERT = '''
+    INSERT INTO state_duty_total (state, seconds, entries) VALUES (?, ?, ?)
+    ON CONFLICT(state) DO UPDATE SET
+        seconds = seconds + excluded.seconds,
+        entries = entries + excluded.entries
+'''
+
+
+# === Recording: called from TemperatureMachine's on_enter_*/on_exit_* hooks ===
+# Events are held until a writer (anything with submit(), e.g. the runtime's
+# AsyncBatcher) is attached, since the initial state is entered while the
+# machine is still being built.
+class StateIntervalRecorder():
+    def __init__(self):
+        self.writer = None
+        self.pending = []
+        self.current = None
+        self.entered = 0
+        self.exited = 0
+
+    def submit(self, event):
+        if self.writer is None:
+            self.pending.append(event)
+        else:
+            self.writer.submit(event)
+
+    def attach(self, writer):
+        self.writer = writer
+        pending, self.pending = self.pending, []
+        for event in pending:
+            writer.submit(event)
+
+    def enter(self, state, now, temp, set_point):
+        self.current = state
+        self.entered += 1
+        self.submit(("enter", state, now.strftime(TIME_FORMAT), temp, set_point))
+
+    def exit(self, now, temp):
+        if self.current is None:
+            return
+        self.current = None
+        self.exited += 1
+        self.submit(("exit", now.strftime(TIME_FORMAT), temp))
+
+    def stats(self):
+        return {"state": self.current, "entered": self.entered, "exited": self.exited,
+                "pending": len(self.pending)}
+
+
+# === Storage ===
+def install_intervals(conn):
+    for ddl in INTERVALS_DDL:
+        conn.execute(ddl)
+    conn.commit()
+
+
+# (day, seconds) pieces of [started, ended), split at midnight
+def split_by_day(started, ended):
+    at = datetime.strptime(started, TIME_FORMAT)
+    end = datetime.strptime(ended, TIME_FORMAT)
+    while at < end:
+        midnight = datetime(at.year, at.month, at.day) + timedelta(days=1)
+        piece_end = min(midnight, end)
+        yield at.strftime("%Y-%m-%d"), int((piece_end - at).total_seconds())
+        at = piece_end
+
+
+# Only the newest interval can be open, so finding it is one rowid lookup
+def last_open_interval(conn):
+    row = conn.execute(
+        "SELECT id, state, started, ended FROM state_intervals ORDER BY id DESC LIMIT 1").fetchone()
+    return row[:3] if row is not None and row[3] is None else None
+
+
+def close_open_interval(conn, ended, temp):
+    row = last_open_interval(conn)
+    if row is None:
+        return None
+    interval_id, state, started = row
+    ended = max(ended, started)
+    conn.execute("UPDATE state_intervals SET ended = ?, end_temp = ? WHERE id = ?", (ended, temp, interval_id))
+    total = 0
+    for day, seconds in split_by_day(started, ended):
+        conn.execute(DAY_UPSERT, (day, state, seconds, 0))
+        total += seconds
+    conn.execute(TOTAL_UPSERT, (state, total, 0))
+    return interval_id
+
+
+def open_interval(conn, state, started, temp, set_point):
+    # Only one interval is ever open
+    close_open_interval(conn, started, temp)
+    conn.execute(
+        "INSERT INTO state_intervals (state, started, start_temp, set_point) VALUES (?, ?, ?, ?)",
+        (state, started, temp, set_point))
+    conn.execute(DAY_UPSERT, (started[:10], state, 0, 1))
+    conn.execute(TOTAL_UPSERT, (state, 0, 1))
+
+
+# Apply a batch of recorder events in one transaction
+def apply_events(conn, events):
+    try:
+        for event in events:
+            if event[0] == "enter":
+                open_interval(conn, *event[1:])
+            else:
+                close_open_interval(conn, *event[1:])
+        conn.commit()
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+
+
+# An interval still open from a previous run ends at the last reading logged
+# after it started (or where it started, if there is none)
+def close_dangling(conn):
+    row = last_open_interval(conn)
+    if row is None:
+        return None
+    if schema_version(conn) == SCHEMA_V2:
+        last = conn.execute("SELECT datetime(MAX(ts), 'unixepoch', 'localtime') FROM readings").fetchone()[0]
+    else:
+        last = conn.execute("SELECT MAX(timestamp) FROM temperature_readings").fetchone()[0]
+    interval_id = close_open_interval(conn, last or row[2], None)
+    conn.commit()
+    return interval_id
+
+
+# === Queries ===
+# Intervals overlapping [start, end], clipped to it; an open interval is
+# clipped at now. Rows are (state, started, ended, start_temp, end_temp, set_point).
+def intervals_between(conn, start=None, end=None, state_filter=None, now=None):
+    now = now or datetime.now().strftime(TIME_FORMAT)
+    query = "SELECT state, started, COALESCE(ended, ?), start_temp, end_temp, set_point FROM state_intervals WHERE 1=1"
+    params = [now]
+    if start:
+        # Begin with the interval in effect at start: one index lookup
+        query += " AND started >= COALESCE((SELECT MAX(started) FROM state_intervals WHERE started <= ?), ?)"
+        params.extend([start, start])
+    if end:
+        query += " AND started <= ?"
+        params.append(end)
+    if state_filter:
+        query += " AND state = ?"
+        params.append(state_filter)
+    query += " ORDER BY started"
+    for state, started, ended, start_temp, end_temp, set_point in conn.execute(query, params):
+        if start and ended < start:
+            continue
+        started = max(started, start) if start else started
+        ended = min(ended, end) if end else ended
+        yield (state, started, ended, start_temp, end_temp, set_point)
+
+
+# {day: {state: {"seconds": s, "entries": n}}} between two days (inclusive),
+# from the counters. With now, the time the open interval has run so far is added.
+def duty_by_day(conn, start_day=None, end_day=None, now=None):
+    query = "SELECT day, state, seconds, entries FROM state_duty_day WHERE 1=1"
+    params = []
+    if start_day:
+        query += " AND day >= ?"
+        params.append(start_day)
+    if end_day:
+        query += " AND day <= ?"
+        params.append(end_day)
+    days = {}
+    for day, state, seconds, entries in conn.execute(query + " ORDER BY day", params):
+        days.setdefault(day, {})[state] = {"seconds": seconds, "entries": entries}
+    if now:
+        row = last_open_interval(conn)
+        if row is not None:
+            _, state, started = row
+            for day, seconds in split_by_day(started, max(now, started)):
+                if (start_day and day < start_day) or (end_day and day > end_day):
+                    continue
+                counter = days.setdefault(day, {}).setdefault(state, {"seconds": 0, "entries": 0})
+                counter["seconds"] += seconds
+    return days
+
+
+def duty_totals(conn):
+    return {state: {"seconds": seconds, "entries": entries} for state, seconds, entries in
+            conn.execute("SELECT state, seconds, entries FROM state_duty_total")}
+
+
+# Per-day runtime, duty cycle (share of the recorded time) and cycles per state
+def daily_report(conn, start_day=None, end_day=None, now=None):
+    report = []
+    for day, states in sorted(duty_by_day(conn, start_day, end_day, now).items()):
+        recorded = sum(counter["seconds"] for counter in states.values())
+        row = {"day": day, "recorded_s": recorded}
+        for state in STATES:
+            counter = states.get(state, {"seconds": 0, "entries": 0})
+            row[f"{state}_s"] = counter["seconds"]
+            row[f"{state}_duty"] = round(counter["seconds"] / recorded, 4) if recorded else 0.0
+            row[f"{state}_cycles"] = counter["entries"]
+        report.append(row)
+    return report
+
+
+def format_duration(seconds):
+    return f"{seconds // 3600}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Thermostat state runtime and cycling reports")
+    parser.add_argument("command", choices=["report", "list"])
+    parser.add_argument("db", nargs="?", default="temperature_log.db")
+    parser.add_argument("--start-day")
+    parser.add_argument("--end-day")
+    parser.add_argument("--start")
+    parser.add_argument("--end")
+    parser.add_argument("--state", choices=list(STATES))
+    args = parser.parse_args(argv)
+
+    conn = sqlite3.connect(args.db)
+    try:
+        install_intervals(conn)
+        now = datetime.now().strftime(TIME_FORMAT)
+        if args.command == "report":
+            print("Day\t\tRecorded\tHeat\tDuty\tCycles\tCool\tDuty\tCycles\tOff")
+            for row in daily_report(conn, args.start_day, args.end_day, now):
+                print(f"{row['day']}\t{format_duration(row['recorded_s'])}\t\t"
+                      f"{format_duration(row['heat_s'])}\t{row['heat_duty']:.1%}\t{row['heat_cycles']}\t"
+                      f"{format_duration(row['cool_s'])}\t{row['cool_duty']:.1%}\t{row['cool_cycles']}\t"
+                      f"{format_duration(row['off_s'])}")
+            totals = duty_totals(conn)
+            print("All time: " + ", ".join(
+                f"{state} {format_duration(counter['seconds'])} in {counter['entries']} cycles"
+                for state, counter in sorted(totals.items())))
+        else:
+            print("State\tStarted\t\t\tEnded\t\t\tStartTemp\tEndTemp\tSetPoint")
+            for row in intervals_between(conn, args.start, args.end, args.state, now):
+                print("\t".join("" if value is None else str(value) for value in row))
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
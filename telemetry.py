@@ -0,0 +1,456 @@
+# telemetry.py - Non-blocking, framed binary telemetry over the UART link
+# manageMyDisplay used to format "state,temp,setpoint" and call ser.write()
+# inline, so a slow or wedged link stalled the LCD and the database logging.
+# Samples now go onto a bounded queue and a writer thread batches them into
+# compact frames:
+#
+#   offset  size  field
+#   0       2     sync bytes 0xA5 0x5A
+#   2       1     protocol version
+#   3       1     flags (reserved, 0)
+#   4       2     sequence number (uint16, wraps)
+#   6       1     sample count N
+#   7       9*N   samples: ts uint32 (epoch s), state uint8, temp_tenths int16, set_point int16
+#   7+9N    2     CRC-16/CCITT-FALSE over bytes 2 .. 7+9N
+#
+# All fields are little-endian. temp_tenths is the smoothed temperature
+# truncated to a tenth of a degree. A text mode writes the original
+# "state,temp,setpoint" strings for receivers that have not been updated, one
+# per line so that a batch (or an outbox replay) can be split up again.
+# Batches that cannot be written can be parked in a disk outbox (outbox.py)
+# and replayed when the link comes back.
+#
+#     python telemetry.py selftest [--pty] [--samples 1000] [--mode text]
+import argparse
+import binascii
+import logging
+import os
+import queue
+import struct
+import threading
+import time
+from collections import namedtuple
+
+from schema import STATE_CODES, STATE_NAMES
+
+SYNC = b"\xA5\x5A"
+VERSION = 1
+HEADER = struct.Struct("<2sBBHB")
+SAMPLE = struct.Struct("<IBhh")
+CRC = struct.Struct("<H")
+MAX_SAMPLES = 255
+
+TelemetrySample = namedtuple("TelemetrySample", ["ts", "state", "temp_tenths", "set_point"])
+Frame = namedtuple("Frame", ["seq", "samples"])
+
+# Sentinel placed on the queue by close() to stop the writer thread
+_STOP = object()
+
+
+# === Encoding ===
+def crc16(data):
+    return binascii.crc_hqx(data, 0xFFFF)
+
+
+def encode_frame(seq, samples):
+    if not 0 < len(samples) <= MAX_SAMPLES:
+        raise ValueError(f"a frame carries 1..{MAX_SAMPLES} samples, got {len(samples)}")
+    body = HEADER.pack(SYNC, VERSION, 0, seq & 0xFFFF, len(samples))[2:]
+    body += b"".join(SAMPLE.pack(s.ts, STATE_CODES[s.state], s.temp_tenths, s.set_point)
+                     for s in samples)
+    return SYNC + body + CRC.pack(crc16(body))
+
+
+# The fields setupSerialOutput used to send, newline-terminated. temp_tenths is
+# truncated, so temp_tenths // 10 is the floored whole degrees the original sent.
+def encode_text(sample):
+    return f"{sample.state},{sample.temp_tenths // 10},{sample.set_point}\n".encode()
+
+
+# === Decoding ===
+# Incremental parser: feed() arbitrary chunks of the byte stream and get back
+# every complete, CRC-valid frame. Garbage and corrupt frames are skipped by
+# scanning for the next sync pattern.
+class FrameParser():
+    def __init__(self):
+        self.buffer = bytearray()
+        self.expected_seq = None
+        self.frames = 0
+        self.crc_errors = 0
+        self.bytes_skipped = 0
+        self.lost_frames = 0
+
+    def feed(self, data):
+        self.buffer += data
+        frames = []
+        while True:
+            start = self.buffer.find(SYNC)
+            if start < 0:
+                # Keep a trailing 0xA5 in case the second sync byte is still in flight
+                keep = 1 if self.buffer[-1:] == SYNC[:1] else 0
+                self.bytes_skipped += len(self.buffer) - keep
+                del self.buffer[:len(self.buffer) - keep]
+                break
+            if start:
+                self.bytes_skipped += start
+                del self.buffer[:start]
+            if len(self.buffer) < HEADER.size:
+                break
+            _, version, _, seq, count = HEADER.unpack_from(self.buffer)
+            size = HEADER.size + count * SAMPLE.size + CRC.size
+            if version != VERSION or count == 0:
+                self.resync()
+                continue
+            if len(self.buffer) < size:
+                break
+            body = bytes(self.buffer[2:size - CRC.size])
+            if CRC.unpack_from(self.buffer, size - CRC.size)[0] != crc16(body):
+                self.crc_errors += 1
+                self.resync()
+                continue
+            samples = []
+            for offset in range(HEADER.size, size - CRC.size, SAMPLE.size):
+                ts, state, temp_tenths, set_point = SAMPLE.unpack_from(self.buffer, offset)
+                samples.append(TelemetrySample(ts, STATE_NAMES.get(state, str(state)), temp_tenths, set_point))
+            del self.buffer[:size]
+            if self.expected_seq is not None and seq != self.expected_seq:
+                self.lost_frames += (seq - self.expected_seq) & 0xFFFF
+            self.expected_seq = (seq + 1) & 0xFFFF
+            self.frames += 1
+            frames.append(Frame(seq, samples))
+        return frames
+
+    # Drop the current sync bytes and look for the next frame start
+    def resync(self):
+        self.bytes_skipped += 1
+        del self.buffer[:1]
+
+
+# Lines of the text mode back as (state, temp, set_point); a partial last line
+# is kept until the rest arrives
+class TextParser():
+    def __init__(self):
+        self.buffer = bytearray()
+        self.lines = 0
+        self.bad_lines = 0
+
+    def feed(self, data):
+        self.buffer += data
+        samples = []
+        while True:
+            end = self.buffer.find(b"\n")
+            if end < 0:
+                break
+            line = bytes(self.buffer[:end])
+            del self.buffer[:end + 1]
+            try:
+                state, temp, set_point = line.decode().split(",")
+                samples.append((state, int(temp), int(set_point)))
+                self.lines += 1
+            except ValueError:
+                self.bad_lines += 1
+        return samples
+
+
+# === Writer thread ===
+class TelemetryWriter():
+    # port only needs write(); mode is "binary" or "text". A frame is sent when
+    # batch_size samples are queued or max_delay seconds after the first one.
+    #
+    # With an outbox (see outbox.py), a failed write parks the batch on disk
+    # instead of dropping it. While a backlog exists, new batches are appended
+    # behind it so ordering is kept, and the backlog is replayed oldest-first in
+    # bursts of up to replay_frames frames of replay_batch samples. Failed replay
+    # attempts back off exponentially up to max_backoff seconds.
+    def __init__(self, port, mode="binary", batch_size=4, max_delay=5.0, max_queue=256,
+                 outbox=None, replay_batch=64, replay_frames=16, replay_interval=0.5,
+                 max_backoff=30.0):
+        if mode not in ("binary", "text"):
+            raise ValueError(f"Unknown telemetry mode '{mode}'")
+        self.port = port
+        self.mode = mode
+        self.batch_size = max(1, min(batch_size, MAX_SAMPLES))
+        self.max_delay = max_delay
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.seq = 0
+        self.thread = threading.Thread(target=self.run, name="telemetry-writer", daemon=True)
+
+        self.outbox = outbox
+        self.replay_batch = max(1, min(replay_batch, MAX_SAMPLES))
+        self.replay_frames = replay_frames
+        self.replay_interval = replay_interval
+        self.max_backoff = max_backoff
+        self.backoff = 1.0
+        # Replay a backlog left over from a previous run straight away
+        self.retry_at = time.monotonic()
+
+        self.lock = threading.Lock()
+        self.samples_sent = 0
+        self.frames_sent = 0
+        self.bytes_sent = 0
+        self.samples_dropped = 0
+        self.write_errors = 0
+        self.last_write_ms = 0.0
+        self.max_write_ms = 0.0
+        self.replay_rate = 0.0
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    # Never blocks the display loop: a full queue drops the sample and counts it
+    def submit(self, sample):
+        try:
+            self.queue.put_nowait(sample)
+            return True
+        except queue.Full:
+            with self.lock:
+                self.samples_dropped += 1
+            logging.warning("Telemetry queue full, dropping sample")
+            return False
+
+    # Send whatever is still queued, then stop the thread
+    def close(self, timeout=5.0):
+        if not self.thread.is_alive():
+            return
+        self.queue.put(_STOP)
+        self.thread.join(timeout)
+        if self.thread.is_alive():
+            logging.error("Telemetry writer did not stop within timeout")
+
+    def stats(self):
+        with self.lock:
+            stats = {
+                "queue_depth": self.queue.qsize(),
+                "samples_sent": self.samples_sent,
+                "frames_sent": self.frames_sent,
+                "bytes_sent": self.bytes_sent,
+                "samples_dropped": self.samples_dropped,
+                "write_errors": self.write_errors,
+                "last_write_ms": round(self.last_write_ms, 3),
+                "max_write_ms": round(self.max_write_ms, 3),
+            }
+        if self.outbox is not None:
+            stats.update(self.outbox.stats())
+            stats["replay_samples_per_s"] = round(self.replay_rate, 1)
+        return stats
+
+    def backlog(self):
+        return len(self.outbox) if self.outbox is not None else 0
+
+    def run(self):
+        batch = []
+        deadline = None
+        while True:
+            wakeups = []
+            if batch:
+                wakeups.append(deadline)
+            if self.backlog():
+                wakeups.append(self.retry_at)
+            timeout = max(0.0, min(wakeups) - time.monotonic()) if wakeups else None
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            if item is _STOP:
+                break
+            if item is not None:
+                if not batch:
+                    deadline = time.monotonic() + self.max_delay
+                batch.append(item)
+
+            if batch and (len(batch) >= self.batch_size or time.monotonic() >= deadline):
+                self.dispatch(batch)
+                batch = []
+            if self.backlog() and time.monotonic() >= self.retry_at:
+                self.replay()
+
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _STOP:
+                batch.append(item)
+        for start in range(0, len(batch), self.batch_size):
+            self.dispatch(batch[start:start + self.batch_size])
+        # One last burst; anything still undelivered stays in the outbox for next time
+        if self.backlog():
+            self.replay()
+
+    def dispatch(self, batch):
+        if self.backlog():
+            self.outbox.push(batch)
+            return
+        if self.send(batch):
+            return
+        if self.outbox is not None:
+            self.outbox.push(batch)
+            self.schedule_retry()
+        else:
+            with self.lock:
+                self.samples_dropped += len(batch)
+
+    def schedule_retry(self):
+        self.retry_at = time.monotonic() + self.backoff
+        self.backoff = min(self.backoff * 2, self.max_backoff)
+
+    # Send up to replay_frames frames from the backlog, oldest first
+    def replay(self):
+        start = time.perf_counter()
+        replayed = 0
+        for _ in range(self.replay_frames):
+            last_id, rows = self.outbox.peek(self.replay_batch)
+            if not rows:
+                break
+            if not self.send([TelemetrySample(*row) for row in rows]):
+                self.schedule_retry()
+                break
+            self.outbox.ack(last_id)
+            replayed += len(rows)
+        else:
+            # Link is healthy; leave a gap so live samples and the link's peer keep up
+            self.backoff = 1.0
+            self.retry_at = time.monotonic() + self.replay_interval
+
+        if replayed:
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                self.replay_rate = replayed / elapsed if elapsed > 0 else 0.0
+            logging.info(f"Replayed {replayed} telemetry samples, {self.backlog()} left in outbox")
+            if not self.backlog():
+                self.backoff = 1.0
+
+    def encode(self, batch):
+        if self.mode == "text":
+            return b"".join(encode_text(sample) for sample in batch)
+        data = encode_frame(self.seq, batch)
+        self.seq = (self.seq + 1) & 0xFFFF
+        return data
+
+    def send(self, batch):
+        data = self.encode(batch)
+        start = time.perf_counter()
+        try:
+            self.port.write(data)
+        except Exception as e:
+            with self.lock:
+                self.write_errors += 1
+            logging.error(f"Telemetry write failed: {e}")
+            return False
+        elapsed_ms = (time.perf_counter() - start) * 1000.0
+        with self.lock:
+            self.samples_sent += len(batch)
+            self.frames_sent += 1
+            self.bytes_sent += len(data)
+            self.last_write_ms = elapsed_ms
+            self.max_write_ms = max(self.max_write_ms, elapsed_ms)
+        return True
+
+
+# === Loopback test harness ===
+# In-memory port: everything written can be read back, like a wire from TX to RX
+class LoopbackPort():
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.data = bytearray()
+
+    def write(self, data):
+        with self.lock:
+            self.data += data
+        return len(data)
+
+    def read_all(self):
+        with self.lock:
+            data = bytes(self.data)
+            self.data.clear()
+        return data
+
+    def close(self):
+        pass
+
+
+# Pseudo-terminal pair: the writer talks to the slave side exactly as it would
+# to /dev/serial0, and the test reads the master side
+class PtyPort():
+    def __init__(self):
+        import tty
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        self.name = os.ttyname(self.slave)
+
+    def write(self, data):
+        view = memoryview(data)
+        while view:
+            written = os.write(self.slave, view)
+            view = view[written:]
+        return len(data)
+
+    def read_all(self):
+        import select
+        chunks = []
+        while select.select([self.master], [], [], 0)[0]:
+            chunks.append(os.read(self.master, 65536))
+        return b"".join(chunks)
+
+    def close(self):
+        os.close(self.slave)
+        os.close(self.master)
+
+
+def selftest(use_pty=False, samples=1000, batch_size=8, mode="binary"):
+    port = PtyPort() if use_pty else LoopbackPort()
+    writer = TelemetryWriter(port, mode=mode, batch_size=batch_size, max_delay=0.01,
+                             max_queue=samples + 1).start()
+    binary = mode == "binary"
+    parser = FrameParser() if binary else TextParser()
+    sent = [TelemetrySample(1754000000 + i * 30, ("off", "heat", "cool")[i % 3], 650 + i % 200, 70)
+            for i in range(samples)]
+    expected = sent if binary else [(s.state, s.temp_tenths // 10, s.set_point) for s in sent]
+    received = []
+
+    def receive():
+        for item in parser.feed(port.read_all()):
+            if binary:
+                received.extend(item.samples)
+            else:
+                received.append(item)
+
+    for sample in sent:
+        writer.submit(sample)
+        # Drain as we go so a pty's kernel buffer never fills up
+        receive()
+    writer.close()
+    deadline = time.monotonic() + 2.0
+    while len(received) < samples and time.monotonic() < deadline:
+        receive()
+        time.sleep(0.01)
+    if use_pty:
+        port.close()
+
+    if binary:
+        errors = f"crc errors {parser.crc_errors}, lost frames {parser.lost_frames}"
+        ok = received == expected and parser.crc_errors == 0 and parser.lost_frames == 0
+    else:
+        errors = f"bad lines {parser.bad_lines}"
+        ok = received == expected and parser.bad_lines == 0
+    print(f"{'pty' if use_pty else 'loopback'} ({mode}): sent {samples} samples in "
+          f"{writer.stats()['frames_sent']} frames ({writer.stats()['bytes_sent']} bytes), "
+          f"received {len(received)}, {errors}: {'OK' if ok else 'FAILED'}")
+    return ok
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Telemetry protocol tools")
+    parser.add_argument("command", choices=["selftest"])
+    parser.add_argument("--pty", action="store_true", help="run over a pseudo-terminal pair")
+    parser.add_argument("--samples", type=int, default=1000)
+    parser.add_argument("--batch", type=int, default=8)
+    parser.add_argument("--mode", choices=["binary", "text"], default="binary")
+    args = parser.parse_args(argv)
+    raise SystemExit(0 if selftest(args.pty, args.samples, args.batch, args.mode) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,27 @@
+# test_harness.py - Pinned digest of a virtual-time replay
+import os
+import subprocess
+import sys
+
+from harness import replay
+
+# Two simulated hours (the default) from seed 1, with every scripted press; a
+# change here means the LCD, serial or stored output changed
+TWO_HOUR_DIGEST = "68a247e4d83a4a2980cdaed971d2ddacaf21a84a20cc98a3e6454f6e1b75ec92"
+
+
+def test_replay_digest_is_pinned():
+    report = replay(seed=1)
+    assert report["button_presses"] == 6
+    assert report["digest"] == TWO_HOUR_DIGEST
+
+
+def test_replay_digest_ignores_time_zone():
+    code = "from harness import replay; print(replay(hours=1, seed=1)['digest'])"
+    digests = set()
+    for tz in ("UTC", "Asia/Kolkata", "America/New_York"):
+        env = dict(os.environ, TZ=tz)
+        result = subprocess.run([sys.executable, "-c", code], env=env, capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)), check=True)
+        digests.add(result.stdout.strip())
+    assert len(digests) == 1
@@ -0,0 +1,28 @@
+# test_telemetry.py - Telemetry encoding over the loopback and pty ports
+import os
+
+import pytest
+
+from telemetry import TelemetrySample, TextParser, encode_text, selftest
+
+
+def test_binary_loopback():
+    assert selftest(samples=200, batch_size=8)
+
+
+def test_text_loopback_splits_batches():
+    assert selftest(samples=200, batch_size=4, mode="text")
+
+
+@pytest.mark.skipif(not hasattr(os, "openpty"), reason="needs a pseudo-terminal")
+def test_text_pty_splits_batches():
+    assert selftest(use_pty=True, samples=200, batch_size=4, mode="text")
+
+
+def test_text_field_is_floored_degrees():
+    # 71.96 F is truncated to 719 tenths, which the text mode sends as 71 like floor() did
+    sample = TelemetrySample(0, "heat", 719, 72)
+    assert encode_text(sample) == b"heat,71,72\n"
+    parser = TextParser()
+    assert parser.feed(encode_text(sample) * 2 + b"cool,6") == [("heat", 71, 72), ("heat", 71, 72)]
+    assert parser.feed(b"8,70\n") == [("cool", 68, 70)]
@@ -0,0 +1,282 @@
+# thermostat.py - Thermostat state machine and LCD wrapper
+# Moved out of "Enhancement Three Databases.py" so they can run against any
+# hal.Hardware: the Raspberry Pi peripherals, or the simulated backends for
+# profiling and load testing on a machine without GPIO.
+import logging
+from math import floor
+from threading import RLock, Thread
+
+from statemachine import StateMachine, State
+
+from actuators import OFF, ON, PULSE, ActuatorBank
+from clock import SYSTEM_CLOCK
+from db_writer import RepeatedRow
+from inputs import ButtonInputQueue, button_handler, hold_handler
+from lcd_framebuffer import LcdFramebuffer
+from scheduler import DeadlineScheduler
+from telemetry import TelemetrySample
+
+# === Periodic jobs of the display loop ===
+# job name -> (config.json key for its period, default period in seconds).
+# Each job's overrun policy can be set in config.json under "overrun_policy".
+DISPLAY_JOBS = {
+    "buttons": ("button_poll_period", 0.05),
+    "lcd_alternate": ("lcd_alternate_period", 5.0),
+    "lcd_refresh": ("lcd_refresh_period", 1.0),
+    "telemetry": ("telemetry_period", 30.0),
+    "db_log": ("db_log_period", 30.0),
+}
+
+
+# === LCD Display class ===
+class ManagedDisplay():
+    def __init__(self, display):
+        self.lcd = display
+        # Only cells that changed since the last frame are sent to the panel
+        self.framebuffer = LcdFramebuffer(self.lcd, display.columns, display.rows)
+        self.framebuffer.clear()
+
+    def cleanupDisplay(self):
+        self.lcd.clear()
+        self.lcd.deinit()
+
+    def updateScreen(self, message):
+        try:
+            self.framebuffer.render(message)
+        except Exception as e:
+            logging.error(f"LCD update failed: {e}")
+
+
+# === Thermostat state machine ===
+class TemperatureMachine(StateMachine):
+    off = State(initial=True)
+    heat = State()
+    cool = State()
+
+    cycle = (off.to(heat) | heat.to(cool) | cool.to(off))
+
+    # telemetry and db_writer are optional so the machine can be driven on its own;
+    # clock paces the display loop and stamps its output (see clock.py); inputs
+    # is the ButtonInputQueue the buttons feed (see inputs.py); log_filter picks
+    # the rows worth storing in change-only mode (see deadband.py); intervals
+    # records how long each state lasted (see state_intervals.py)
+    def __init__(self, hardware, screen, sampler, set_point, telemetry=None, db_writer=None,
+                 clock=SYSTEM_CLOCK, inputs=None, log_filter=None, intervals=None):
+        # Set before StateMachine.__init__, which already runs on_enter_off.
+        # The LEDs are driven through cached actuators that skip redundant writes.
+        self.actuators = ActuatorBank({"red": hardware.red_led, "blue": hardware.blue_led})
+        self.redLight = self.actuators["red"]
+        self.blueLight = self.actuators["blue"]
+        self.screen = screen
+        self.sampler = sampler
+        self.setPoint = set_point
+        self.telemetry = telemetry
+        self.db_writer = db_writer
+        self.logFilter = log_filter
+        self.intervals = intervals
+        self.clock = clock
+        self.inputs = inputs if inputs is not None else ButtonInputQueue(clock=clock)
+        # Guards setPoint and state changes against concurrent button handling
+        self.lock = RLock()
+        self.endDisplay = False
+        self.displayThread = None
+        self.showTemp = True
+        self.scheduler = DeadlineScheduler(clock)
+        super().__init__()
+
+    def on_enter_heat(self):
+        self.redLight.on()
+        self.blueLight.off()
+        self.startInterval("heat")
+        logging.info("State changed to HEAT")
+
+    def on_exit_heat(self):
+        self.redLight.off()
+        self.endInterval()
+
+    def on_enter_cool(self):
+        self.blueLight.on()
+        self.redLight.off()
+        self.startInterval("cool")
+        logging.info("State changed to COOL")
+
+    def on_exit_cool(self):
+        self.blueLight.off()
+        self.endInterval()
+
+    def on_enter_off(self):
+        self.redLight.off()
+        self.blueLight.off()
+        self.startInterval("off")
+        logging.info("State changed to OFF")
+
+    def on_exit_off(self):
+        self.endInterval()
+
+    # === State intervals ===
+    # Also called on shutdown to close the interval of the final state
+    def endInterval(self):
+        if self.intervals is not None:
+            self.intervals.exit(self.clock.now(), self.intervalTemp())
+
+    def startInterval(self, state):
+        if self.intervals is not None:
+            self.intervals.enter(state, self.clock.now(), self.intervalTemp(), self.setPoint)
+
+    def intervalTemp(self):
+        reading = self.sampler.latest()
+        return None if reading is None else round(reading.smoothed, 1)
+
+    # Latest smoothed value from the sampler; no I2C read happens here
+    def get_smoothed_fahrenheit(self):
+        reading = self.sampler.latest()
+        if reading is None:
+            raise RuntimeError("No temperature reading available yet")
+        return reading.smoothed
+
+    def processTempStateButton(self):
+        logging.info("Cycling thermostat state")
+        with self.lock:
+            self.cycle()
+
+    def processTempIncButton(self):
+        with self.lock:
+            self.setPoint += 1
+        logging.info(f"Increased set point to {self.setPoint}")
+        self.updateLights()
+
+    def processTempDecButton(self):
+        with self.lock:
+            self.setPoint -= 1
+        logging.info(f"Decreased set point to {self.setPoint}")
+        self.updateLights()
+
+    # Apply one coalesced batch of button events: net state cycles, net
+    # set-point change, then a single LED update
+    def processInput(self):
+        batch = self.inputs.drain()
+        if batch is None:
+            return
+        delta, cycles = batch
+        with self.lock:
+            for _ in range(cycles):
+                logging.info("Cycling thermostat state")
+                self.cycle()
+            if delta:
+                self.setPoint += delta
+                logging.info(f"Changed set point by {delta:+d} to {self.setPoint}")
+        self.updateLights()
+
+    def updateLights(self):
+        try:
+            temp = floor(self.get_smoothed_fahrenheit())
+        except Exception as e:
+            logging.error(f"Temperature read failed: {e}")
+            return
+
+        # Work out the wanted output of each LED; the actuators only write the ones that changed
+        red, blue = OFF, OFF
+        if self.current_state_value == self.heat.value:
+            red = PULSE if temp < self.setPoint else ON
+        elif self.current_state_value == self.cool.value:
+            blue = PULSE if temp > self.setPoint else ON
+        self.actuators.apply(red=red, blue=blue)
+
+        # Formatted lazily by the log pipeline, and rate-limited there
+        logging.debug("State: %s, Temp: %s, SetPoint: %s", self.current_state_value, temp, self.setPoint)
+
+    # Register the display loop's jobs with their periods and overrun policies.
+    # This is the only display loop: the runtime runs the scheduler, and the
+    # harness, bench and fleet call scheduler.run_pending() on a virtual clock.
+    # stagger delays the first telemetry sample and DB row (fleet.py spreads
+    # its devices' rows over the logging period with it).
+    def scheduleJobs(self, config=None, stagger=0.0):
+        config = config or {}
+        policies = config.get("overrun_policy", {})
+        callbacks = {
+            "buttons": self.processInput,
+            "lcd_alternate": self.alternateDisplay,
+            "lcd_refresh": self.refreshDisplay,
+            "telemetry": self.sendTelemetry,
+            "db_log": self.logReading,
+        }
+        for name, (key, default) in DISPLAY_JOBS.items():
+            # Buttons and the LCD start straight away; everything else waits one period
+            period = config.get(key, default)
+            if name in ("buttons", "lcd_refresh"):
+                delay = 0
+            elif name in ("telemetry", "db_log"):
+                delay = period + stagger
+            else:
+                delay = None
+            self.scheduler.add(name, period, callbacks[name],
+                               policy=policies.get(name, "skip"), delay=delay)
+
+    def run(self):
+        if not self.scheduler.jobs:
+            self.scheduleJobs()
+        self.displayThread = Thread(target=self.manageMyDisplay, name="display")
+        self.displayThread.start()
+
+    def stop(self, timeout=5.0):
+        self.endDisplay = True
+        self.scheduler.stop()
+        if self.displayThread is not None:
+            self.displayThread.join(timeout)
+
+    def setupSerialOutput(self, now=None):
+        now = self.clock.now() if now is None else now
+        try:
+            # Truncated, so the text mode's temp_tenths // 10 is floor(temperature) as before
+            return TelemetrySample(int(now.timestamp()), self.current_state_value,
+                                   floor(self.get_smoothed_fahrenheit() * 10), self.setPoint)
+        except Exception as e:
+            logging.error(f"Serial output failed: {e}")
+            return None
+
+    def refreshDisplay(self, now=None):
+        now = self.clock.now() if now is None else now
+        temp = floor(self.get_smoothed_fahrenheit())
+        lcd_line_1 = now.strftime("%Y-%m-%d %H:%M:%S")
+        lcd_line_2 = f"Temp: {temp}°F" if self.showTemp else f"{self.current_state_value} {self.setPoint}°F"
+        self.screen.updateScreen(f"{lcd_line_1}\n{lcd_line_2}")
+
+    # Flip line 2 between the temperature and the state/set point
+    def alternateDisplay(self):
+        self.showTemp = not self.showTemp
+
+    def sendTelemetry(self, now=None):
+        output = self.setupSerialOutput(now)
+        if output is not None and self.telemetry is not None:
+            self.telemetry.submit(output)
+
+    def logReading(self, now=None):
+        if self.db_writer is None:
+            return
+        now = self.clock.now() if now is None else now
+        current_time = now.strftime("%Y-%m-%d %H:%M:%S")
+        # Tenths of a degree; v2 stores them as temp_tenths, a v1 table floors them
+        temp = round(self.get_smoothed_fahrenheit() * 10) / 10
+        row = self.readingRow(now, current_time, temp)
+        if self.logFilter is None or self.logFilter.accept(row, now):
+            self.db_writer.submit(row)
+        else:
+            # Still a logging period for the rollups, at the values last stored
+            self.db_writer.submit(RepeatedRow(row[:1] + self.logFilter.last[1:4] + row[4:]))
+
+    # Row handed to the database writer: temperature_readings' v1 column order,
+    # then the epoch seconds, which the database stores (see schema.reading_insert_sql)
+    def readingRow(self, now, current_time, temp):
+        return (current_time, self.current_state_value, temp, self.setPoint, int(now.timestamp()))
+
+    # Runs the scheduled jobs on absolute deadlines until stop()
+    def manageMyDisplay(self):
+        self.scheduler.run()
+        self.screen.cleanupDisplay()
+
+    # Buttons only queue events; processInput applies them from the display loop.
+    # Held increase/decrease buttons auto-repeat through when_held.
+    def attachButtons(self, hardware):
+        for name, button in hardware.buttons().items():
+            button.when_pressed = button_handler(self.inputs.press, name)
+            button.when_held = hold_handler(button, self.inputs.hold, name)